@@ -0,0 +1,30 @@
+"""add_cover_placeholder_columns
+
+Revision ID: 8a3f1c2d5e6b
+Revises: 7949be753eef
+Create Date: 2026-10-19 10:12:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8a3f1c2d5e6b'
+down_revision = '7949be753eef'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('books', sa.Column('cover_placeholder', sa.Text(), nullable=True))
+    op.add_column('books', sa.Column('cover_color', sa.String(length=7), nullable=True))
+    op.add_column('books', sa.Column('cover_width', sa.Integer(), nullable=True))
+    op.add_column('books', sa.Column('cover_height', sa.Integer(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('books', 'cover_height')
+    op.drop_column('books', 'cover_width')
+    op.drop_column('books', 'cover_color')
+    op.drop_column('books', 'cover_placeholder')
@@ -0,0 +1,44 @@
+"""add_visits_book_date_unique
+
+Revision ID: 9b4e2d7f1a3c
+Revises: 8a3f1c2d5e6b
+Create Date: 2026-10-19 11:02:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9b4e2d7f1a3c'
+down_revision = '8a3f1c2d5e6b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Merge duplicate (book_id, visit_date) rows left by the old
+    # read-modify-write counter into the oldest row of each group
+    op.execute("""
+        UPDATE visits AS v
+        SET visit_count = d.total
+        FROM (
+            SELECT min(id) AS keep_id, sum(visit_count) AS total
+            FROM visits
+            GROUP BY book_id, visit_date
+            HAVING count(*) > 1
+        ) AS d
+        WHERE v.id = d.keep_id
+    """)
+    op.execute("""
+        DELETE FROM visits AS v
+        USING visits AS k
+        WHERE v.book_id = k.book_id
+          AND v.visit_date = k.visit_date
+          AND v.id > k.id
+    """)
+    op.create_unique_constraint('uq_visits_book_id_visit_date', 'visits', ['book_id', 'visit_date'])
+
+
+def downgrade() -> None:
+    op.drop_constraint('uq_visits_book_id_visit_date', 'visits', type_='unique')
@@ -0,0 +1,66 @@
+"""add_popularity_rollups
+
+Revision ID: a4c7e1b9d2f0
+Revises: 9b4e2d7f1a3c
+Create Date: 2026-10-19 12:05:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a4c7e1b9d2f0'
+down_revision = '9b4e2d7f1a3c'
+branch_labels = None
+depends_on = None
+
+# Must match app.services.popularity_service.POPULARITY_WINDOWS
+WINDOWS = (1, 7, 30, 365)
+
+
+def upgrade() -> None:
+    op.create_table(
+        'popularity_windows',
+        sa.Column('window_days', sa.SmallInteger(), autoincrement=False, nullable=False),
+        sa.Column('as_of', sa.Date(), nullable=False),
+        sa.Column('book_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.PrimaryKeyConstraint('window_days')
+    )
+    op.create_table(
+        'popularity_rollups',
+        sa.Column('window_days', sa.SmallInteger(), autoincrement=False, nullable=False),
+        sa.Column('book_id', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('visit_count', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['book_id'], ['books.id'], ),
+        sa.PrimaryKeyConstraint('window_days', 'book_id')
+    )
+    op.create_index(
+        'ix_popularity_rollups_window_rank',
+        'popularity_rollups',
+        ['window_days', sa.text('visit_count DESC'), 'book_id'],
+        unique=False
+    )
+
+    # Seed every window from the existing visits
+    for window in WINDOWS:
+        op.execute(f"""
+            INSERT INTO popularity_rollups (window_days, book_id, visit_count)
+            SELECT {window}, book_id, sum(visit_count)
+            FROM visits
+            WHERE visit_date >= CURRENT_DATE - {window}
+            GROUP BY book_id
+            HAVING sum(visit_count) > 0
+        """)
+        op.execute(f"""
+            INSERT INTO popularity_windows (window_days, as_of, book_count)
+            SELECT {window}, CURRENT_DATE, count(*)
+            FROM popularity_rollups
+            WHERE window_days = {window}
+        """)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_popularity_rollups_window_rank', table_name='popularity_rollups')
+    op.drop_table('popularity_rollups')
+    op.drop_table('popularity_windows')
@@ -0,0 +1,33 @@
+"""add_book_trending_score
+
+Revision ID: b7d2f4a8c1e3
+Revises: a4c7e1b9d2f0
+Create Date: 2026-10-19 13:20:00.000000
+
+Scores start empty; fill them from the visits with
+scripts/recompute_trending.py --apply.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7d2f4a8c1e3'
+down_revision = 'a4c7e1b9d2f0'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('books', sa.Column('trending_score', sa.Float(), nullable=True))
+    op.add_column('books', sa.Column('trending_updated_at', sa.DateTime(timezone=True), nullable=True))
+    op.add_column('books', sa.Column('trending_key', sa.Float(), nullable=True))
+    op.create_index('ix_books_trending', 'books', ['trending_key', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_books_trending', table_name='books')
+    op.drop_column('books', 'trending_key')
+    op.drop_column('books', 'trending_updated_at')
+    op.drop_column('books', 'trending_score')
@@ -0,0 +1,47 @@
+"""add_analytics_events
+
+Revision ID: c3e8a5f1b6d9
+Revises: b7d2f4a8c1e3
+Create Date: 2026-10-19 14:30:00.000000
+
+Monthly partitions are created by the application
+(app.services.event_service.ensure_partitions) as they are needed.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3e8a5f1b6d9'
+down_revision = 'b7d2f4a8c1e3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'analytics_events',
+        sa.Column('id', sa.BigInteger(), autoincrement=True, nullable=False),
+        sa.Column('occurred_at', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('received_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+        sa.Column('event_type', sa.String(length=64), nullable=False),
+        sa.Column('book_id', sa.Integer(), nullable=True),
+        sa.Column('session_id', sa.String(length=64), nullable=True),
+        sa.Column('metadata', postgresql.JSONB(astext_type=sa.Text()), nullable=True),
+        sa.PrimaryKeyConstraint('id', 'occurred_at'),
+        postgresql_partition_by='RANGE (occurred_at)'
+    )
+    op.create_index(
+        'ix_analytics_events_type_occurred_at',
+        'analytics_events',
+        ['event_type', 'occurred_at'],
+        unique=False
+    )
+
+
+def downgrade() -> None:
+    # Drops every attached partition with it
+    op.drop_index('ix_analytics_events_type_occurred_at', table_name='analytics_events')
+    op.drop_table('analytics_events')
@@ -0,0 +1,41 @@
+"""add_visitor_sketches
+
+Revision ID: d5f1b3c7e9a2
+Revises: c3e8a5f1b6d9
+Create Date: 2026-10-19 15:40:00.000000
+
+Visits recorded before this revision have no visitor sketches, so their
+unique visitor counts start at zero.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd5f1b3c7e9a2'
+down_revision = 'c3e8a5f1b6d9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('visits', sa.Column('visitor_sketch', sa.LargeBinary(), nullable=True))
+    op.add_column('popularity_rollups', sa.Column('visitor_sketch', sa.LargeBinary(), nullable=True))
+    op.add_column(
+        'popularity_rollups',
+        sa.Column('unique_visitors', sa.Integer(), nullable=False, server_default='0')
+    )
+    op.create_index(
+        'ix_popularity_rollups_window_unique_rank',
+        'popularity_rollups',
+        ['window_days', sa.text('unique_visitors DESC'), 'book_id'],
+        unique=False
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_popularity_rollups_window_unique_rank', table_name='popularity_rollups')
+    op.drop_column('popularity_rollups', 'unique_visitors')
+    op.drop_column('popularity_rollups', 'visitor_sketch')
+    op.drop_column('visits', 'visitor_sketch')
@@ -0,0 +1,45 @@
+"""add_cover_refresh_checkpoints
+
+Revision ID: f2b6d8a4c9e1
+Revises: e7a9c2d4f6b1
+Create Date: 2026-10-19 21:10:00.000000
+
+Replaces the data/cover_refresh_checkpoint.json file. A run interrupted
+before this revision starts over from the first book.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2b6d8a4c9e1'
+down_revision = 'e7a9c2d4f6b1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'cover_refresh_checkpoints',
+        sa.Column('id', sa.SmallInteger(), autoincrement=False, nullable=False),
+        sa.Column('status', sa.String(length=16), nullable=False),
+        sa.Column('started_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('finished_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('last_book_id', sa.Integer(), nullable=False),
+        sa.Column('total', sa.Integer(), nullable=False),
+        sa.Column('processed', sa.Integer(), nullable=False),
+        sa.Column('updated', sa.Integer(), nullable=False),
+        sa.Column('unchanged', sa.Integer(), nullable=False),
+        sa.Column('skipped', sa.Integer(), nullable=False),
+        sa.Column('failed', sa.Integer(), nullable=False),
+        sa.Column('recent_errors', postgresql.JSONB(astext_type=sa.Text()), nullable=False),
+        sa.Column('error', sa.Text(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('cover_refresh_checkpoints')
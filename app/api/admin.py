@@ -1,10 +1,12 @@
 from fastapi import APIRouter, Depends, HTTPException, Query, Body
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, update
-from app.db.database import get_db
+from app.db.database import get_db, replica_router
+from app.db.pool_metrics import get_pool_stats
+from app.db.query_stats import query_stats
 from app.db.models import Book, Author
 from scripts.bootstrap_books import bootstrap_books
-from typing import Optional
+from typing import Literal, Optional
 from pydantic import BaseModel
 
 router = APIRouter()
@@ -81,16 +83,11 @@ async def update_book(
                     status_code=404,
                     detail=f"Author with key {book_update.author_key} not found"
                 )
-            # Update book's author_id
-            book.author_id = new_author.id
-        elif book_update.author is not None:
-            # Update existing author's name
-            result = await db.execute(
-                select(Author).where(Author.id == book.author_id)
-            )
-            author = result.scalars().first()
-            if author:
-                author.name = book_update.author
+            # Link the book to the new author
+            book.author = new_author
+        elif book_update.author is not None and book.author:
+            # Update existing author's name (loaded with the book)
+            book.author.name = book_update.author
 
         # Update book fields
         update_data = book_update.dict(
@@ -122,3 +119,31 @@ async def update_book(
     except Exception as e:
         await db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/db/replicas")
+async def get_replica_status():
+    """Health, lag and rotation state of each read replica."""
+    return {"replicas": replica_router.get_status()}
+
+@router.get("/db/pool")
+async def get_pool_status():
+    """Connection pool metrics of the primary and each replica: checkout waits and timeouts, connections in use and their age."""
+    return {"pools": get_pool_stats()}
+
+@router.get("/db/queries")
+async def get_query_stats(
+    order_by: Literal["total_ms", "mean_ms", "max_ms", "calls", "errors", "slow"] = "total_ms",
+    limit: int = Query(50, ge=1, le=1000)
+):
+    """Latency of each normalized statement, and statements per request of each route, since startup or the last reset."""
+    return {
+        "since": query_stats.started_at,
+        "statements": query_stats.get_statements(order_by, limit),
+        "routes": query_stats.get_routes()
+    }
+
+@router.delete("/db/queries")
+async def reset_query_stats():
+    """Start the statement and route aggregates over."""
+    query_stats.reset()
+    return {"message": "Query stats reset"}
@@ -1,86 +1,216 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import ValidationError
 from sqlalchemy.ext.asyncio import AsyncSession
-from typing import List, Dict, Any, Optional
-from app.db.database import get_db
-from app.services import analytics_service
+from datetime import date
+from typing import List, Dict, Any, Optional, Literal, Union
+from app.db.database import get_read_db, ReadSessionLocal
+from app.services import analytics_service, export_service, popularity_service
+from app.services.event_service import event_buffer
+from app.services.response_cache_service import response_cache
+from app.core.config import settings
+from app.core.visitor import visitor_hash
 from app.db import schemas
-from app.core.exceptions import BookNotFoundError
+from app.core.exceptions import BookNotFoundError, InvalidCursorError
 
 router = APIRouter()
 
-@router.post("/visit/{book_id}", response_model=schemas.Visit)
-async def record_visit(book_id: int, db: AsyncSession = Depends(get_db)):
+# Books an export can be filtered to in one request
+MAX_EXPORT_BOOK_IDS = 1000
+
+def _book_payload(book) -> Dict[str, Any]:
+    return {
+        "id": book.id,
+        "title": book.title,
+        "author_id": book.author_id,
+        "author": book.author_str,
+        "open_library_key": book.open_library_key,
+        "cover_image_url": book.cover_image_url,
+        "cover_placeholder": book.cover_placeholder,
+        "cover_color": book.cover_color,
+        "cover_width": book.cover_width,
+        "cover_height": book.cover_height,
+        "summary": book.summary,
+        "questions_and_answers": book.questions_and_answers,
+        "affiliate_links": book.affiliate_links,
+        "created_at": book.created_at,
+        "updated_at": book.updated_at
+    }
+
+@router.post("/visit/{book_id}", response_model=schemas.VisitRecorded)
+async def record_visit(
+    book_id: int,
+    db: AsyncSession = Depends(get_read_db),
+    visitor: int = Depends(visitor_hash)
+):
     try:
-        return await analytics_service.record_visit(db, book_id)
+        return await analytics_service.record_visit(db, book_id, visitor)
     except BookNotFoundError as e:
         raise HTTPException(status_code=404, detail=str(e))
 
-@router.get("/popular", response_model=List[Dict[str, Any]])
-async def get_popular_books(
-    days: int = Query(365, ge=1, description="Number of days to look back"),
-    limit: int = Query(12, ge=1, le=50, description="Maximum number of books to return"),
-    page: Optional[int] = Query(None, ge=1, description="Page number (enables pagination if provided)"),
-    per_page: Optional[int] = Query(None, ge=1, le=50, description="Items per page (required if page is provided)"),
-    db: AsyncSession = Depends(get_db)
-):
-    """Get the most popular books based on visit count."""
+@router.post("/events", response_model=schemas.EventsAccepted, status_code=202)
+async def record_events(request: Request):
+    """
+    Accept a batch of analytics events, {"events": [...]}, for the event log.
+
+    The body is parsed as JSON whatever its content type, since
+    navigator.sendBeacon sends strings as text/plain.
+    """
+    body = await request.body()
+    try:
+        batch = schemas.EventBatch.model_validate_json(body)
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors(include_url=False))
+    if len(batch.events) > settings.EVENT_BATCH_MAX_EVENTS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"At most {settings.EVENT_BATCH_MAX_EVENTS} events per request"
+        )
+    accepted, dropped = event_buffer.add(batch.events)
+    return {"accepted": accepted, "dropped": dropped}
+
+async def _popular_payload(
+    db: AsyncSession,
+    days: int,
+    limit: int,
+    page: Optional[int],
+    per_page: Optional[int],
+    rank_by: str
+) -> Union[List[Dict[str, Any]], Dict[str, Any]]:
     # If page is provided, use pagination
     if page is not None:
         items_per_page = per_page or limit
         offset = (page - 1) * items_per_page
-        books_with_visits, total = await analytics_service.get_popular_books(
-            db=db, 
-            days=days,
-            limit=items_per_page,
-            offset=offset,
-            get_total=True
-        )
+        try:
+            books_with_visits, total = await analytics_service.get_popular_books(
+                db=db, 
+                days=days,
+                limit=items_per_page,
+                offset=offset,
+                get_total=True,
+                rank_by=rank_by
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
         
-        # Return paginated response in the same format as before
-        return [
-            {
-                "id": book.id,
-                "title": book.title,
-                "author_id": book.author_id,
-                "author": book.author_str,
-                "open_library_key": book.open_library_key,
-                "cover_image_url": book.cover_image_url,
-                "summary": book.summary,
-                "questions_and_answers": book.questions_and_answers,
-                "affiliate_links": book.affiliate_links,
-                "created_at": book.created_at,
-                "updated_at": book.updated_at,
-                "visit_count": visit_count,
-                # Add pagination metadata as regular fields
-                "_total": total,
-                "_page": page,
-                "_per_page": items_per_page,
-                "_total_pages": (total + items_per_page - 1) // items_per_page,
-                "_has_more": page * items_per_page < total
-            }
-            for book, visit_count in books_with_visits
-        ]
+        # The page's books, with the pagination metadata once alongside them
+        return {
+            "books": [
+                {
+                    **_book_payload(book),
+                    "visit_count": visit_count,
+                    "unique_visitors": unique_visitors
+                }
+                for book, visit_count, unique_visitors in books_with_visits
+            ],
+            "total": total,
+            "page": page,
+            "per_page": items_per_page,
+            "total_pages": (total + items_per_page - 1) // items_per_page,
+            "has_more": page * items_per_page < total
+        }
     else:
         # Original behavior without pagination
-        books_with_visits = await analytics_service.get_popular_books(
-            db=db, 
-            days=days,
-            limit=limit
-        )
+        try:
+            books_with_visits = await analytics_service.get_popular_books(
+                db=db, 
+                days=days,
+                limit=limit,
+                rank_by=rank_by
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
         return [
             {
-                "id": book.id,
-                "title": book.title,
-                "author_id": book.author_id,
-                "author": book.author_str,
-                "open_library_key": book.open_library_key,
-                "cover_image_url": book.cover_image_url,
-                "summary": book.summary,
-                "questions_and_answers": book.questions_and_answers,
-                "affiliate_links": book.affiliate_links,
-                "created_at": book.created_at,
-                "updated_at": book.updated_at,
-                "visit_count": visit_count
+                **_book_payload(book),
+                "visit_count": visit_count,
+                "unique_visitors": unique_visitors
             }
-            for book, visit_count in books_with_visits
+            for book, visit_count, unique_visitors in books_with_visits
         ]
+
+def _popular_cache_key(days: int, limit: int, page: Optional[int], per_page: Optional[int], rank_by: str) -> Optional[str]:
+    """Response cache key of a request for the first POPULAR_CACHE_PAGES pages of a standard window."""
+    if days not in popularity_service.POPULARITY_WINDOWS:
+        return None
+    if page is None:
+        return f"popular:v2:{days}:{rank_by}:limit:{limit}"
+    if page > settings.POPULAR_CACHE_PAGES:
+        return None
+    return f"popular:v2:{days}:{rank_by}:page:{page}:{per_page or limit}"
+
+@router.get("/popular", response_model=Union[List[Dict[str, Any]], Dict[str, Any]])
+async def get_popular_books(
+    days: int = Query(365, ge=1, description="Number of days to look back"),
+    limit: int = Query(12, ge=1, le=50, description="Maximum number of books to return"),
+    page: Optional[int] = Query(None, ge=1, description="Page number (enables pagination if provided)"),
+    per_page: Optional[int] = Query(None, ge=1, le=50, description="Items per page (required if page is provided)"),
+    rank_by: Literal["visits", "unique_visitors"] = Query("visits", description="Rank by raw visits or unique visitors"),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """
+    Get the most popular books based on visit count or unique visitors.
+    With page, the page's books and the pagination metadata as
+    {"books": [...], "total", "page", "per_page", "total_pages", "has_more"}.
+
+    The first POPULAR_CACHE_PAGES pages of the standard windows are served
+    from the response cache, at most RESPONSE_CACHE_TTL seconds old (longer
+    while a refresh is running).
+    """
+    key = _popular_cache_key(days, limit, page, per_page, rank_by) if settings.POPULAR_CACHE_PAGES > 0 else None
+    if key is None:
+        return await _popular_payload(db, days, limit, page, per_page, rank_by)
+
+    async def render() -> bytes:
+        # In its own session, since background refreshes outlive the request
+        async with ReadSessionLocal() as session:
+            payload = await _popular_payload(session, days, limit, page, per_page, rank_by)
+        return JSONResponse(jsonable_encoder(payload)).body
+
+    return Response(await response_cache.get(key, render), media_type="application/json")
+
+@router.get("/trending", response_model=Dict[str, Any])
+async def get_trending_books(
+    limit: int = Query(12, ge=1, le=50, description="Maximum number of books to return"),
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page"),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """Get books by exponentially decayed visit count, hottest first."""
+    try:
+        books_with_scores, next_cursor = await analytics_service.get_trending_books(db, limit, cursor)
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {
+        "books": [
+            {**_book_payload(book), "trending_score": score}
+            for book, score in books_with_scores
+        ],
+        "next_cursor": next_cursor
+    }
+
+@router.get("/export")
+async def export_analytics(
+    dataset: Literal["visits", "events"] = Query("visits", description="Daily visit counts or the event log"),
+    format: Literal["ndjson", "csv"] = Query("ndjson", description="Newline-delimited JSON or CSV with a header row"),
+    start: Optional[date] = Query(None, description="First day to export (UTC for events)"),
+    end: Optional[date] = Query(None, description="Last day to export, inclusive"),
+    book_id: Optional[List[int]] = Query(None, description="Only these books; repeat for several"),
+    compress: bool = Query(True, description="Gzip the export on the fly")
+):
+    """
+    Stream visits or analytics events, oldest first, as NDJSON or CSV.
+
+    Rows are read through a server-side cursor and encoded (and compressed)
+    a batch at a time, so memory use does not grow with the export's size.
+    """
+    if start is not None and end is not None and start > end:
+        raise HTTPException(status_code=400, detail="start must not be after end")
+    if book_id and len(book_id) > MAX_EXPORT_BOOK_IDS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_EXPORT_BOOK_IDS} book_id values per export")
+    filename = export_service.export_filename(dataset, format, start, end, compress)
+    return StreamingResponse(
+        export_service.stream_export(dataset, format, start, end, book_id, compress),
+        media_type="application/gzip" if compress else export_service.EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
@@ -7,10 +7,11 @@ from fastapi.encoders import jsonable_encoder
 from fastapi.responses import JSONResponse
 from datetime import datetime
 
-from app.db.database import get_db
+from app.db.database import get_db, get_read_db
 from app.db import schemas, models
 from app.services import book_service, analytics_service
 from app.core.exceptions import BookNotFoundError
+from app.core.visitor import visitor_hash
 import httpx
 
 router = APIRouter()
@@ -25,7 +26,7 @@ async def create_book(book: schemas.BookCreate, db: AsyncSession = Depends(get_d
 @router.get("/{book_id}", response_model=schemas.BookResponse)
 async def get_book(
     book_id: int,
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     """Get a book by its ID."""
     try:
@@ -41,6 +42,10 @@ async def get_book(
             author=book.author_str,
             open_library_key=book.open_library_key,
             cover_image_url=book.cover_image_url,
+            cover_placeholder=book.cover_placeholder,
+            cover_color=book.cover_color,
+            cover_width=book.cover_width,
+            cover_height=book.cover_height,
             summary=book.summary,
             questions_and_answers=book.questions_and_answers,
             affiliate_links=book.affiliate_links,
@@ -124,6 +129,10 @@ async def create_book_from_open_library(
                     author=existing_book.author_str,
                     open_library_key=existing_book.open_library_key,
                     cover_image_url=existing_book.cover_image_url,
+                    cover_placeholder=existing_book.cover_placeholder,
+                    cover_color=existing_book.cover_color,
+                    cover_width=existing_book.cover_width,
+                    cover_height=existing_book.cover_height,
                     summary=existing_book.summary,
                     questions_and_answers=existing_book.questions_and_answers,
                     affiliate_links=existing_book.affiliate_links,
@@ -143,6 +152,10 @@ async def create_book_from_open_library(
             author=book.author_str,
             open_library_key=book.open_library_key,
             cover_image_url=book.cover_image_url,
+            cover_placeholder=book.cover_placeholder,
+            cover_color=book.cover_color,
+            cover_width=book.cover_width,
+            cover_height=book.cover_height,
             summary=book.summary,
             questions_and_answers=book.questions_and_answers,
             affiliate_links=book.affiliate_links,
@@ -156,7 +169,8 @@ async def create_book_from_open_library(
 @router.get("/db/open_library/{open_library_key}", response_model=Optional[schemas.BookResponse])
 async def get_book_by_open_library_key(
     open_library_key: str,
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db),
+    visitor: int = Depends(visitor_hash)
 ) -> Optional[schemas.BookResponse]:
     """Get a book from our database by its Open Library key."""
     try:
@@ -164,8 +178,8 @@ async def get_book_by_open_library_key(
         if not book:
             return None
             
-        # Record the visit
-        await analytics_service.record_visit(db, book.id)
+        # Record the visit (buffered, no database write on this request)
+        analytics_service.visit_buffer.add(book.id, visitor=visitor)
             
         return schemas.BookResponse(
             id=book.id,
@@ -174,6 +188,10 @@ async def get_book_by_open_library_key(
             author=book.author_str,
             open_library_key=book.open_library_key,
             cover_image_url=book.cover_image_url,
+            cover_placeholder=book.cover_placeholder,
+            cover_color=book.cover_color,
+            cover_width=book.cover_width,
+            cover_height=book.cover_height,
             summary=book.summary,
             questions_and_answers=book.questions_and_answers,
             affiliate_links=book.affiliate_links,
@@ -188,7 +206,7 @@ async def get_book_by_open_library_key(
 @router.get("/{book_id}/summary")
 async def get_book_summary(
     book_id: int,
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     """Get a summary for a book."""
     query = select(models.Book).where(models.Book.id == book_id)
@@ -201,7 +219,7 @@ async def get_book_summary(
     return {"summary": book.summary}
 
 @router.get("/{book_id}/questions_and_answers")
-async def get_book_questions_and_answers(book_id: int, db: AsyncSession = Depends(get_db)):
+async def get_book_questions_and_answers(book_id: int, db: AsyncSession = Depends(get_read_db)):
     """Get a book's questions and answers."""
     try:
         query = select(models.Book).where(models.Book.id == book_id)
@@ -217,7 +235,7 @@ async def get_book_questions_and_answers(book_id: int, db: AsyncSession = Depend
 
 @router.get("/debug/list", response_model=List[schemas.BookResponse])
 async def list_books(
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
     limit: int = 20
 ):
     """List books for debugging."""
@@ -234,6 +252,10 @@ async def list_books(
                 author=book.author_str,
                 open_library_key=book.open_library_key,
                 cover_image_url=book.cover_image_url,
+                cover_placeholder=book.cover_placeholder,
+                cover_color=book.cover_color,
+                cover_width=book.cover_width,
+                cover_height=book.cover_height,
                 summary=book.summary,
                 questions_and_answers=book.questions_and_answers,
                 affiliate_links=book.affiliate_links,
@@ -248,7 +270,7 @@ async def list_books(
 
 @router.get("/debug/authors", response_model=List[Dict[str, Any]])
 async def list_authors(
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
     limit: int = 50
 ):
     """List authors for debugging."""
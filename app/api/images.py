@@ -1,29 +1,161 @@
-from fastapi import APIRouter, HTTPException, Depends, BackgroundTasks
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, HTTPException, Depends, Request, Response
+from fastapi.responses import FileResponse, RedirectResponse, StreamingResponse
 from app.services.image_cache_service import image_cache
 from app.services import book_service
+from app.services.cover_refresh_service import cover_refresh_job
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.db.database import get_db
+from pathlib import Path
+from typing import Optional, Tuple
+import aiofiles
 import logging
+import re
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
+# Cached proxied images are served from URLs carrying their content hash,
+# so a URL's content never changes
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# The upstream URL entry point: a miss's streamed body, or the redirect to
+# the content hash URL
+PROXY_CACHE_CONTROL = "public, max-age=86400"
+_SHA256 = re.compile(r"^[0-9a-f]{64}$")
+_CACHE_KEY = re.compile(r"^[0-9a-f]{32}$")
+RANGE_CHUNK_SIZE = 64 * 1024
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    """Weak comparison of an If-None-Match header against an ETag"""
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+def _parse_range(range_header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single byte range into inclusive (start, end) offsets.
+    Returns None for headers we ignore (multiple ranges, other units) and
+    raises ValueError when the range cannot be satisfied.
+    """
+    unit, _, spec = range_header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        return None
+    start, _, end = spec.strip().partition("-")
+    try:
+        if not start:
+            # Suffix range: the last N bytes
+            length = int(end)
+            if length <= 0:
+                raise ValueError(range_header)
+            return max(size - length, 0), size - 1
+        first = int(start)
+        last = min(int(end), size - 1) if end else size - 1
+    except ValueError:
+        return None
+    if first >= size or first > last:
+        raise ValueError(range_header)
+    return first, last
+
+async def _read_range(path: Path, start: int, end: int):
+    async with aiofiles.open(path, "rb") as f:
+        await f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = await f.read(min(RANGE_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+def _cached_image_response(request: Request, path: Path, media_type: str, sha256: str) -> Response:
+    """Serve a cached image, honouring If-None-Match and single byte ranges"""
+    etag = f'"{sha256}"'
+    headers = {"ETag": etag, "Cache-Control": IMMUTABLE_CACHE_CONTROL, "Accept-Ranges": "bytes"}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and _etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+
+    size = path.stat().st_size
+    range_header = request.headers.get("range")
+    if range_header:
+        try:
+            byte_range = _parse_range(range_header, size)
+        except ValueError:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+        if byte_range:
+            start, end = byte_range
+            return StreamingResponse(
+                _read_range(path, start, end),
+                status_code=206,
+                media_type=media_type,
+                headers={
+                    **headers,
+                    "Content-Range": f"bytes {start}-{end}/{size}",
+                    "Content-Length": str(end - start + 1)
+                }
+            )
+    return FileResponse(path, media_type=media_type, headers=headers)
+
 @router.get("/images/proxy")
-async def get_proxied_image(url: str):
+async def get_proxied_image(request: Request, url: str):
     """
-    Proxy and cache images from external sources.
-    Images are cached on first request and served from cache thereafter.
+    Proxy and cache images from allowed external hosts.
+    On a miss the upstream body is streamed to the client while being written
+    to the cache; later requests are redirected to the cached image's
+    content hash URL.
     """
+    if not image_cache.is_proxy_allowed(url):
+        raise HTTPException(status_code=403, detail="Image host not allowed")
     try:
-        cached_path = await image_cache.get_or_download(url)
-        if cached_path:
-            return FileResponse(cached_path)
-        else:
-            raise HTTPException(status_code=404, detail="Image not found or failed to cache")
+        cached = await image_cache.get_proxy_file(url)
+        if cached:
+            key, sha256 = cached
+            return RedirectResponse(
+                str(request.url_for("get_hashed_image", key=key, sha256=sha256)),
+                status_code=302,
+                headers={"Cache-Control": PROXY_CACHE_CONTROL}
+            )
+
+        # A miss is always served in full; Range is only honoured once cached
+        upstream = await image_cache.stream_upstream(url)
     except Exception as e:
         logger.error(f"Error serving proxied image: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal server error")
+    if not upstream:
+        raise HTTPException(status_code=404, detail="Image not found or failed to cache")
+    media_type, body = upstream
+    return StreamingResponse(body, media_type=media_type, headers={"Cache-Control": PROXY_CACHE_CONTROL})
+
+@router.get("/images/proxy/{key}/{sha256}")
+async def get_hashed_image(request: Request, key: str, sha256: str):
+    """
+    A cached proxied image by cache key and content hash, with immutable
+    caching headers, an ETag of the hash and Range support. An outdated
+    hash is redirected to the current one.
+    """
+    if not _CACHE_KEY.match(key) or not _SHA256.match(sha256):
+        raise HTTPException(status_code=404, detail="Image not found")
+    try:
+        cached = await image_cache.get_hashed_file(key)
+    except Exception as e:
+        logger.error(f"Error serving cached image: {str(e)}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+    if not cached:
+        raise HTTPException(status_code=404, detail="Image not found")
+    path, media_type, current_sha256 = cached
+    if current_sha256 != sha256:
+        return RedirectResponse(
+            str(request.url_for("get_hashed_image", key=key, sha256=current_sha256)),
+            status_code=302,
+            headers={"Cache-Control": PROXY_CACHE_CONTROL}
+        )
+    return _cached_image_response(request, path, media_type, sha256)
+
+@router.get("/images/cache/stats")
+async def get_image_cache_stats():
+    """Image cache size, eviction and hit-ratio metrics"""
+    return image_cache.get_stats()
 
 @router.post("/images/refresh/{book_id}")
 async def refresh_book_cover(book_id: int, db: AsyncSession = Depends(get_db)):
@@ -38,12 +170,18 @@ async def refresh_book_cover(book_id: int, db: AsyncSession = Depends(get_db)):
         raise HTTPException(status_code=500, detail="Internal server error")
 
 @router.post("/images/refresh-all")
-async def refresh_all_covers(background_tasks: BackgroundTasks, db: AsyncSession = Depends(get_db)):
-    """Refresh cover images for all books in the background"""
+async def refresh_all_covers(restart: bool = False):
+    """
+    Start refreshing cover images for all books in the background, resuming
+    an interrupted run unless restart is set
+    """
     try:
-        # Start the refresh in the background
-        background_tasks.add_task(book_service.refresh_all_book_covers, db)
-        return {"message": "Started refreshing all book covers in the background"}
+        return await cover_refresh_job.start(restart=restart)
     except Exception as e:
         logger.error(f"Error starting cover refresh: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to start cover refresh")
+
+@router.get("/images/refresh-all/status")
+async def get_refresh_all_status():
+    """Progress, throughput and ETA of the bulk cover refresh, wherever it runs"""
+    return await cover_refresh_job.get_status()
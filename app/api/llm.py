@@ -14,9 +14,11 @@ from app.core.utils import clean_json_string
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
-class LLMProvider(str, Enum):
+class DigestProvider(str, Enum):
+    """Providers a client can ask for; LOCAL only when llm_service.local_provider_enabled()."""
     GEMINI = "gemini"
     CHATGPT = "chatgpt"
+    LOCAL = "local"
 
 class BookRequest(BaseModel):
     title: str
@@ -49,20 +51,20 @@ Please ensure:
 @router.post("/query")
 async def query_llm(
     request: BookRequest,
-    provider: LLMProvider = Query(LLMProvider.GEMINI, description="LLM provider to use"),
+    provider: DigestProvider = Query(DigestProvider.GEMINI, description="LLM provider to use"),
     db: AsyncSession = Depends(get_db)
 ) -> Dict[str, Any]:
     """
-    Get an AI-generated book digest using either Gemini (default) or ChatGPT.
+    Get an AI-generated book digest using Gemini (default), ChatGPT or, when
+    enabled, the local stand-in provider.
     Returns a JSON object with book information or NULL if book is not known.
     """
+    if provider is DigestProvider.LOCAL and not llm_service.local_provider_enabled():
+        raise HTTPException(status_code=400, detail="The local LLM provider is not enabled")
     try:
         prompt = generate_book_digest_prompt(request.title, request.author)
         
-        if provider == LLMProvider.GEMINI:
-            response = await llm_service.query_gemini(prompt)
-        else:  # ChatGPT
-            response = await llm_service.query_chatgpt(prompt)
+        response = await llm_service.query_llm(prompt, provider.value)
         
         # Clean and parse the response
         cleaned_response = clean_json_string(response)
@@ -4,7 +4,7 @@ from typing import List, Optional
 from fastapi.responses import HTMLResponse
 from fastapi.templating import Jinja2Templates
 
-from app.db.database import get_db
+from app.db.database import get_read_db
 from app.db import schemas
 from app.services import search_service
 
@@ -14,7 +14,7 @@ templates = Jinja2Templates(directory="app/templates")
 @router.get("/typeahead", response_model=List[schemas.TypeaheadSuggestion])
 async def typeahead(
     q: str = Query(..., min_length=1),
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     """Get typeahead suggestions for search."""
     return await search_service.get_typeahead_suggestions(db, q)
@@ -25,7 +25,7 @@ async def search_books(
     q: str = Query(..., min_length=1),
     page: int = Query(1, ge=1),
     per_page: int = Query(12, ge=1, le=50),
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     """Search for books and return json response."""
     try:
@@ -39,7 +39,7 @@ async def view_search_books(
     q: str = Query(..., min_length=1),
     page: int = Query(1, ge=1),
     per_page: int = Query(12, ge=1, le=50),
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     """Search for books and return HTML page."""
     try:
@@ -1,3 +1,7 @@
 class BookNotFoundError(Exception):
     """Raised when a book is not found in the database."""
     pass
+
+class InvalidCursorError(ValueError):
+    """Raised when a pagination cursor cannot be decoded."""
+    pass
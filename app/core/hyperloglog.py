@@ -0,0 +1,180 @@
+import hashlib
+import math
+from typing import Dict, Iterable, Optional
+
+# Serialised form: one header byte, then the registers. The header's low
+# five bits are the precision and the top bit marks the sparse encoding,
+# a sorted list of (index: 2 bytes, value: 1 byte) for the non-zero
+# registers, used while that is smaller than the dense m bytes.
+_SPARSE_FLAG = 0x80
+_PRECISION_MASK = 0x1F
+MIN_PRECISION = 4
+MAX_PRECISION = 16
+
+def hash_visitor(visitor_id: str) -> int:
+    """Uniformly distributed 64-bit hash of a visitor id."""
+    return int.from_bytes(hashlib.blake2b(visitor_id.encode(), digest_size=8).digest(), "big")
+
+def _sigma(x: float) -> float:
+    """x + sum over k >= 1 of x^(2^k) * 2^(k-1)"""
+    if x == 1:
+        return math.inf
+    y = 1.0
+    z = x
+    while True:
+        x *= x
+        previous = z
+        z += x * y
+        y += y
+        if z == previous:
+            return z
+
+def _tau(x: float) -> float:
+    """(1 - x - sum over k >= 1 of (1 - x^(2^-k))^2 * 2^-k) / 3"""
+    if x == 0 or x == 1:
+        return 0.0
+    y = 1.0
+    z = 1 - x
+    while True:
+        x = math.sqrt(x)
+        previous = z
+        y *= 0.5
+        z -= (1 - x) ** 2 * y
+        if z == previous:
+            return z / 3
+
+class HyperLogLog:
+    """
+    HyperLogLog cardinality sketch over 64-bit hashes.
+
+    With precision p it has m = 2^p registers and a standard error of about
+    1.04 / sqrt(m): 1.6% at p=12 (4 KiB dense) and 0.8% at p=14 (16 KiB).
+    Registers are kept in a dict until the sketch is dense enough for an
+    array to be smaller, so the many books seen by a handful of visitors a
+    day cost a few bytes each. Sketches merge losslessly, and one of higher
+    precision can be folded down to merge with a lower one.
+    """
+
+    def __init__(self, precision: int):
+        if not MIN_PRECISION <= precision <= MAX_PRECISION:
+            raise ValueError(f"HyperLogLog precision must be between {MIN_PRECISION} and {MAX_PRECISION}")
+        self.precision = precision
+        self.m = 1 << precision
+        self._sparse: Optional[Dict[int, int]] = {}
+        self._registers: Optional[bytearray] = None
+
+    def _set(self, index: int, value: int) -> None:
+        if self._registers is not None:
+            if value > self._registers[index]:
+                self._registers[index] = value
+            return
+        if value > self._sparse.get(index, 0):
+            self._sparse[index] = value
+            # Three bytes per sparse register against one per dense register
+            if len(self._sparse) * 3 > self.m:
+                self._densify()
+
+    def _densify(self) -> None:
+        registers = bytearray(self.m)
+        for index, value in self._sparse.items():
+            registers[index] = value
+        self._registers, self._sparse = registers, None
+
+    def _items(self) -> Iterable:
+        if self._registers is not None:
+            return ((index, value) for index, value in enumerate(self._registers) if value)
+        return self._sparse.items()
+
+    def add_hash(self, value: int) -> None:
+        """Add a 64-bit hash."""
+        index = value >> (64 - self.precision)
+        rest = value & ((1 << (64 - self.precision)) - 1)
+        # Position of the first 1 bit in the remaining 64 - p bits
+        self._set(index, 64 - self.precision - rest.bit_length() + 1)
+
+    def add(self, visitor_id: str) -> None:
+        self.add_hash(hash_visitor(visitor_id))
+
+    def reduce(self, precision: int) -> "HyperLogLog":
+        """This sketch folded down to a lower precision."""
+        if precision > self.precision:
+            raise ValueError("Cannot increase the precision of a sketch")
+        if precision == self.precision:
+            return self.copy()
+        shift = self.precision - precision
+        reduced = HyperLogLog(precision)
+        for index, value in self._items():
+            extra = index & ((1 << shift) - 1)
+            # The dropped index bits now lead the remaining hash bits
+            reduced._set(index >> shift, shift - extra.bit_length() + 1 if extra else shift + value)
+        return reduced
+
+    def merge(self, other: "HyperLogLog") -> "HyperLogLog":
+        """Add every item of another sketch to this one. Returns self."""
+        if other.precision > self.precision:
+            other = other.reduce(self.precision)
+        elif other.precision < self.precision:
+            reduced = self.reduce(other.precision)
+            self.precision, self.m = reduced.precision, reduced.m
+            self._sparse, self._registers = reduced._sparse, reduced._registers
+        for index, value in other._items():
+            self._set(index, value)
+        return self
+
+    def copy(self) -> "HyperLogLog":
+        sketch = HyperLogLog(self.precision)
+        sketch._sparse = dict(self._sparse) if self._sparse is not None else None
+        sketch._registers = bytearray(self._registers) if self._registers is not None else None
+        return sketch
+
+    def count(self) -> int:
+        """
+        Estimated number of distinct items added, using Ertl's improved
+        estimator ("New cardinality estimation algorithms for HyperLogLog
+        sketches", 2017), which needs neither linear counting for small
+        cardinalities nor empirical bias tables.
+        """
+        m = self.m
+        q = 64 - self.precision
+        histogram = [0] * (q + 2)
+        for _, value in self._items():
+            histogram[value] += 1
+        histogram[0] = m - sum(histogram)
+        if histogram[0] == m:
+            return 0
+        denominator = m * _tau(1 - histogram[q + 1] / m)
+        for k in range(q, 0, -1):
+            denominator = 0.5 * (denominator + histogram[k])
+        denominator += m * _sigma(histogram[0] / m)
+        return round(m * m / (2 * math.log(2)) / denominator)
+
+    def to_bytes(self) -> bytes:
+        if self._registers is not None:
+            return bytes([self.precision]) + bytes(self._registers)
+        data = bytearray([self.precision | _SPARSE_FLAG])
+        for index in sorted(self._sparse):
+            data += index.to_bytes(2, "big")
+            data.append(self._sparse[index])
+        return bytes(data)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "HyperLogLog":
+        if not data:
+            raise ValueError("Empty HyperLogLog sketch")
+        sketch = cls(data[0] & _PRECISION_MASK)
+        if data[0] & _SPARSE_FLAG:
+            for offset in range(1, len(data), 3):
+                sketch._sparse[int.from_bytes(data[offset:offset + 2], "big")] = data[offset + 2]
+        else:
+            if len(data) != sketch.m + 1:
+                raise ValueError("Truncated HyperLogLog sketch")
+            sketch._sparse, sketch._registers = None, bytearray(data[1:])
+        return sketch
+
+def merge_sketches(sketches: Iterable[Optional[bytes]], precision: int) -> HyperLogLog:
+    """Merge serialised sketches, skipping missing ones, into one sketch."""
+    merged = HyperLogLog(precision)
+    for data in sketches:
+        if data:
+            merged.merge(HyperLogLog.from_bytes(data))
+    return merged
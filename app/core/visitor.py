@@ -0,0 +1,42 @@
+from fastapi import Request, Response
+import re
+import secrets
+
+from app.core.hyperloglog import hash_visitor
+
+VISITOR_COOKIE = "visitor_id"
+VISITOR_COOKIE_MAX_AGE = 365 * 24 * 3600
+
+# User agents of clients that do not keep cookies: crawlers and HTTP libraries
+_COOKIELESS_AGENTS = re.compile(
+    r"bot|crawl|spider|slurp|curl|wget|python-requests|python-httpx|aiohttp|go-http-client|okhttp|java/",
+    re.IGNORECASE
+)
+
+def visitor_hash(request: Request, response: Response) -> int:
+    """
+    Dependency giving a 64-bit hash identifying the anonymous visitor.
+
+    Visitors are told apart by a random cookie, which is set on their first
+    request; that request is counted under the same id. Clients that do not
+    keep cookies, such as crawlers (by their user agent, or the lack of
+    one), are identified by their address and user agent instead, so
+    repeated hits from one of them count as a single visitor. Only the hash
+    is used; the id itself is never stored.
+    """
+    visitor_id = request.cookies.get(VISITOR_COOKIE)
+    if visitor_id:
+        return hash_visitor(visitor_id)
+    user_agent = request.headers.get("user-agent", "")
+    if not user_agent or _COOKIELESS_AGENTS.search(user_agent):
+        host = request.client.host if request.client else ""
+        return hash_visitor(f"{host}|{user_agent}")
+    visitor_id = secrets.token_urlsafe(16)
+    response.set_cookie(
+        VISITOR_COOKIE,
+        visitor_id,
+        max_age=VISITOR_COOKIE_MAX_AGE,
+        httponly=True,
+        samesite="lax"
+    )
+    return hash_visitor(visitor_id)
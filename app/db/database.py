@@ -1,9 +1,18 @@
+from fastapi import Request, Response
+from sqlalchemy import event
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.orm import sessionmaker, declarative_base, Session
+import asyncpg
 import os
 import logging
 import urllib.parse
 import ssl
+import uuid
+
+from app.core.config import settings
+from app.db.pool_metrics import InstrumentedPool, instrument_pool, pool_sizing
+from app.db.query_stats import query_stats
+from app.db.replicas import Replica, ReplicaRouter, is_disconnect, is_retryable_on_primary
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)  # Ensure we see the logs
@@ -48,15 +57,57 @@ if "postgresql+asyncpg" not in DATABASE_URL:
 
 logger.info(f"Using database URL: {masked_url}")
 
+class UniqueStatementNameConnection(asyncpg.Connection):
+    """
+    Names prepared statements uniquely across processes, so the statements
+    of clients sharing a PgBouncer server connection never collide.
+    """
+
+    def _get_unique_id(self, prefix):
+        return f"__asyncpg_{prefix}_{uuid.uuid4().hex}__"
+
+STATEMENT_MODES = ("direct", "pgbouncer", "pgbouncer_prepared")
+
+def statement_connect_args(mode: str, cache_size: int) -> dict:
+    """
+    asyncpg connect arguments for a DATABASE_STATEMENT_MODE.
+
+    Connected directly, or through a PgBouncer (>= 1.21) that tracks
+    protocol-level prepared statements, each connection keeps its prepared
+    statements and hot queries are parsed and planned once. Through an
+    older PgBouncer in transaction pooling a statement may be prepared on
+    one server connection and run on another, so nothing is cached and
+    every statement gets a name no other client uses.
+    """
+    if mode not in STATEMENT_MODES:
+        raise ValueError(f"Unknown DATABASE_STATEMENT_MODE {mode!r}, expected one of {', '.join(STATEMENT_MODES)}")
+    if mode == "pgbouncer":
+        return {
+            "statement_cache_size": 0,
+            "prepared_statement_cache_size": 0,
+            "connection_class": UniqueStatementNameConnection,
+        }
+    return {
+        "statement_cache_size": cache_size,
+        "prepared_statement_cache_size": cache_size,
+    }
+
+pool_size, max_overflow = pool_sizing(settings.DATABASE_MAX_CONNECTIONS, settings.WEB_CONCURRENCY)
+if settings.DATABASE_POOL_SIZE is not None:
+    pool_size = settings.DATABASE_POOL_SIZE
+if settings.DATABASE_MAX_OVERFLOW is not None:
+    max_overflow = settings.DATABASE_MAX_OVERFLOW
+
 # Configure SSL context based on environment
 engine_kwargs = {
-    "echo": True,
-    "pool_size": 20,
-    "max_overflow": 10,
-    "connect_args": {
-        "statement_cache_size": 0,
-        "prepared_statement_cache_size": 0,
-    }
+    "echo": settings.DATABASE_ECHO,
+    "poolclass": InstrumentedPool,
+    "pool_size": pool_size,
+    "max_overflow": max_overflow,
+    "pool_timeout": settings.DATABASE_POOL_TIMEOUT,
+    "pool_pre_ping": settings.DATABASE_POOL_PRE_PING,
+    "pool_recycle": settings.DATABASE_POOL_RECYCLE,
+    "connect_args": statement_connect_args(settings.DATABASE_STATEMENT_MODE, settings.DATABASE_STATEMENT_CACHE_SIZE)
 }
 
 # Only use SSL in production
@@ -71,15 +122,130 @@ else:
 
 try:
     engine = create_async_engine(DATABASE_URL, **engine_kwargs)
-    logger.info(f"Successfully created database engine (Environment: {ENVIRONMENT})")
+    logger.info(
+        f"Successfully created database engine (Environment: {ENVIRONMENT}, "
+        f"pool of {pool_size} + {max_overflow} overflow connections)"
+    )
 except Exception as e:
     logger.error(f"Error creating database engine: {str(e)}")
     raise
 
+query_stats.instrument(engine)
+instrument_pool(engine, "primary")
+
 SessionLocal = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 Base = declarative_base()
 
-async def get_db():
+class ReadOnlySessionError(RuntimeError):
+    """Raised when changes are flushed from a read-only session."""
+
+def _asyncpg_url(url: str) -> str:
+    parsed = urllib.parse.urlparse(url)
+    if parsed.scheme in ["postgres", "postgresql"]:
+        return url.replace(f"{parsed.scheme}://", "postgresql+asyncpg://", 1)
+    if parsed.scheme != "postgresql+asyncpg":
+        raise ValueError(f"Only PostgreSQL with asyncpg is supported. Current URL type: {parsed.scheme}")
+    return url
+
+# Read-only sessions run in autocommit, on the primary or a replica. An
+# older PgBouncer may send a statement prepared outside a transaction to
+# another server connection to run, so there they run in one.
+READ_ISOLATION_LEVEL = "READ COMMITTED" if settings.DATABASE_STATEMENT_MODE == "pgbouncer" else "AUTOCOMMIT"
+read_engine = engine.execution_options(isolation_level=READ_ISOLATION_LEVEL)
+
+replicas = []
+for replica_url in filter(None, (url.strip() for url in (settings.DATABASE_REPLICA_URLS or "").split(","))):
+    replica_url = _asyncpg_url(replica_url)
+    parsed = urllib.parse.urlparse(replica_url)
+    name = f"{parsed.hostname}:{parsed.port}{parsed.path}"
+    replica_engine = create_async_engine(replica_url, **engine_kwargs)
+    query_stats.instrument(replica_engine)
+    instrument_pool(replica_engine, name)
+    replicas.append(Replica(name, replica_engine.execution_options(isolation_level=READ_ISOLATION_LEVEL)))
+    logger.info(f"Using database replica {name}")
+replica_router = ReplicaRouter(
+    replicas,
+    max_lag=settings.DATABASE_REPLICA_MAX_LAG,
+    check_timeout=settings.DATABASE_REPLICA_HEALTH_TIMEOUT
+)
+
+# Set on responses to requests that used the read-write session, so the
+# client's reads for the next DATABASE_REPLICA_STICKY_SECONDS go to the
+# primary and see its writes whatever the replicas' lag
+PRIMARY_COOKIE = "db_primary"
+
+class _ReadOnlySyncSession(Session):
+    pass
+
+@event.listens_for(_ReadOnlySyncSession, "before_flush")
+def _refuse_flush(session, flush_context, instances):
+    raise ReadOnlySessionError("Changes cannot be written through a read-only session")
+
+class ReadOnlySession(AsyncSession):
+    """
+    Session for requests that only read.
+
+    Unless given a bind it reads from a replica picked by replica_router,
+    or the primary when there are none or none is healthy. A read that
+    fails on a replica with a connection or operational error is retried
+    once on the primary.
+
+    Its engine runs in autocommit (see READ_ISOLATION_LEVEL), so no BEGIN or COMMIT is sent, and the
+    connection goes back to the pool as soon as each statement's results
+    are loaded rather than when the response has been sent. Loaded objects
+    are detached and remain readable (relationships must be eager loaded,
+    as in any async session). Flushing changes raises ReadOnlySessionError.
+    """
+
+    sync_session_class = _ReadOnlySyncSession
+
+    def __init__(self, bind=None, **kwargs):
+        self.replica = replica_router.pick() if bind is None else None
+        if bind is None:
+            bind = self.replica.engine if self.replica else read_engine
+        super().__init__(bind=bind, **kwargs)
+
+    def _use_primary(self) -> None:
+        self.replica = None
+        self.bind = read_engine
+        self.sync_session.bind = read_engine.sync_engine
+
+    async def _run(self, method, *args, **kwargs):
+        try:
+            try:
+                return await method(*args, **kwargs)
+            except Exception as e:
+                if self.replica is None or not is_retryable_on_primary(e):
+                    raise
+                if is_disconnect(e):
+                    replica_router.mark_down(self.replica, str(e))
+                logger.warning(f"Retrying read on the primary after an error on replica {self.replica.name}: {str(e)}")
+                await self.close()
+                self._use_primary()
+                return await method(*args, **kwargs)
+        finally:
+            await self.close()
+
+    async def execute(self, *args, **kwargs):
+        return await self._run(super().execute, *args, **kwargs)
+
+    async def get(self, *args, **kwargs):
+        return await self._run(super().get, *args, **kwargs)
+
+    async def stream(self, *args, **kwargs):
+        # Server-side cursors only live inside a transaction, so the stream
+        # holds a read-only one until the session is closed
+        await self.connection(execution_options={"isolation_level": "READ COMMITTED", "postgresql_readonly": True})
+        return await super().stream(*args, **kwargs)
+
+ReadSessionLocal = sessionmaker(class_=ReadOnlySession, expire_on_commit=False)
+
+async def get_db(response: Response):
+    """Session for requests that write, committed when the request completes."""
+    if replica_router.replicas:
+        response.set_cookie(
+            PRIMARY_COOKIE, "1", max_age=settings.DATABASE_REPLICA_STICKY_SECONDS, httponly=True, samesite="lax"
+        )
     async with SessionLocal() as session:
         try:
             yield session
@@ -89,3 +255,12 @@ async def get_db():
             raise
         finally:
             await session.close()
+
+async def get_read_db(request: Request):
+    """
+    Session for requests that only read; see ReadOnlySession. Clients that
+    have just written read from the primary.
+    """
+    bind = read_engine if request.cookies.get(PRIMARY_COOKIE) else None
+    async with ReadSessionLocal(bind=bind) as session:
+        yield session
@@ -0,0 +1,36 @@
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+from typing import Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+async def try_session_lock(engine: AsyncEngine, namespace: int, key: int) -> Optional[AsyncConnection]:
+    """
+    Take the two-int session advisory lock (namespace, key) unless another
+    session holds it. Returns the connection holding it, in autocommit so
+    that holding the lock holds no transaction open, or None.
+    """
+    connection = await engine.connect()
+    try:
+        connection = await connection.execution_options(isolation_level="AUTOCOMMIT")
+        acquired = await connection.scalar(select(func.pg_try_advisory_lock(namespace, key)))
+    except Exception:
+        await connection.close()
+        raise
+    if not acquired:
+        await connection.close()
+        return None
+    return connection
+
+async def release_session_lock(connection: Optional[AsyncConnection], namespace: int, key: int) -> None:
+    """Release a lock taken by try_session_lock and return its connection to the pool."""
+    if connection is None:
+        return
+    try:
+        await connection.scalar(select(func.pg_advisory_unlock(namespace, key)))
+        await connection.close()
+    except Exception as e:
+        # Closing the database connection releases the lock with it
+        logger.error(f"Error releasing advisory lock ({namespace}, {key}): {str(e)}")
+        await connection.invalidate()
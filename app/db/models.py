@@ -1,6 +1,7 @@
-from sqlalchemy import Column, Integer, String, Text, Date, ForeignKey, DateTime, JSON
+from sqlalchemy import Column, Integer, SmallInteger, BigInteger, Float, String, Text, LargeBinary, Date, ForeignKey, DateTime, JSON, UniqueConstraint, Index
 from sqlalchemy.orm import relationship
-from sqlalchemy.sql import func
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.sql import func, text
 from sqlalchemy.ext.declarative import declarative_base
 from datetime import datetime
 import asyncio
@@ -10,14 +11,29 @@ Base = declarative_base()
 
 class Book(Base):
     __tablename__ = "books"
+    __table_args__ = (
+        # Trending feed order, scanned backwards from the hottest book
+        Index("ix_books_trending", "trending_key", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String, nullable=False, index=True)
-    author_id = Column(Integer, ForeignKey("authors.id"), nullable=False)
+    author_id = Column(Integer, ForeignKey("authors.id"), nullable=False, index=True)
     open_library_key = Column(String, nullable=False, unique=True, index=True)
     _image_url = Column("cover_image_url", String, nullable=True)  # Actual database column
     cover_image_open_library_url = Column(String, nullable=True)
+    # Shown while the cover loads: inline data URI, dominant colour and intrinsic size
+    cover_placeholder = Column(Text, nullable=True)
+    cover_color = Column(String(7), nullable=True)
+    cover_width = Column(Integer, nullable=True)
+    cover_height = Column(Integer, nullable=True)
     publication_year = Column(Integer)
+    # Exponentially decayed visit count as of trending_updated_at, and
+    # ln(score) shifted to a fixed epoch, which orders books by their
+    # current score without decaying every row (see popularity_service)
+    trending_score = Column(Float, nullable=True)
+    trending_updated_at = Column(DateTime(timezone=True), nullable=True)
+    trending_key = Column(Float, nullable=True)
     summary = Column(Text, nullable=True)
     questions_and_answers = Column(Text, nullable=True)
     affiliate_links = Column(Text, nullable=True)
@@ -73,12 +89,88 @@ class Author(Base):
 
 class Visit(Base):
     __tablename__ = "visits"
+    __table_args__ = (
+        # One row per book per day; visit counts are upserted into it
+        UniqueConstraint("book_id", "visit_date", name="uq_visits_book_id_visit_date"),
+        # Date range scans grouped by book (popular books, rollups), index only
+        Index("ix_visits_visit_date_book_id", "visit_date", "book_id", postgresql_include=["visit_count"]),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     book_id = Column(Integer, ForeignKey("books.id"))
-    visit_date = Column(Date, index=True)
+    visit_date = Column(Date)
     visit_count = Column(Integer, default=1)
+    # HyperLogLog sketch of the day's visitors (see app.core.hyperloglog)
+    visitor_sketch = Column(LargeBinary, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
 
     book = relationship("Book", back_populates="visits")
+
+class PopularityWindow(Base):
+    """Bookkeeping for one maintained popularity window (see PopularityRollup)."""
+    __tablename__ = "popularity_windows"
+
+    window_days = Column(SmallInteger, primary_key=True, autoincrement=False)
+    as_of = Column(Date, nullable=False)  # The window covers visit dates >= as_of - window_days
+    book_count = Column(Integer, nullable=False, default=0)
+
+class PopularityRollup(Base):
+    """Visit total of a book over one popularity window, ranked by the window rank index."""
+    __tablename__ = "popularity_rollups"
+    __table_args__ = (
+        Index("ix_popularity_rollups_window_rank", "window_days", text("visit_count DESC"), "book_id"),
+        Index("ix_popularity_rollups_window_unique_rank", "window_days", text("unique_visitors DESC"), "book_id"),
+    )
+
+    window_days = Column(SmallInteger, primary_key=True, autoincrement=False)
+    book_id = Column(Integer, ForeignKey("books.id"), primary_key=True, autoincrement=False)
+    visit_count = Column(Integer, nullable=False)
+    # Visitor sketch merged over the window's days, and its estimate
+    visitor_sketch = Column(LargeBinary, nullable=True)
+    unique_visitors = Column(Integer, nullable=False, default=0, server_default="0")
+
+    book = relationship("Book")
+
+class AnalyticsEvent(Base):
+    """
+    Append-only log of client and server events (searches, affiliate clicks,
+    digest refreshes, ...). Range partitioned by month on occurred_at, one
+    analytics_events_YYYY_MM partition per month (see event_service).
+    """
+    __tablename__ = "analytics_events"
+    __table_args__ = (
+        Index("ix_analytics_events_type_occurred_at", "event_type", "occurred_at"),
+        {"postgresql_partition_by": "RANGE (occurred_at)"},
+    )
+
+    # The partition key has to be part of the primary key
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    occurred_at = Column(DateTime(timezone=True), primary_key=True)
+    received_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    event_type = Column(String(64), nullable=False)
+    book_id = Column(Integer, nullable=True)  # No foreign key, so events outlive deleted books
+    session_id = Column(String(64), nullable=True)
+    event_metadata = Column("metadata", JSON().with_variant(JSONB, "postgresql"), nullable=True)
+
+class CoverRefreshCheckpoint(Base):
+    """
+    Position and counters of the cover refresh job (see cover_refresh_service),
+    one row written in the same transaction as each batch's cover updates.
+    """
+    __tablename__ = "cover_refresh_checkpoints"
+
+    id = Column(SmallInteger, primary_key=True, autoincrement=False)  # Always 1
+    status = Column(String(16), nullable=False)
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+    last_book_id = Column(Integer, nullable=False, default=0)
+    total = Column(Integer, nullable=False, default=0)
+    processed = Column(Integer, nullable=False, default=0)
+    updated = Column(Integer, nullable=False, default=0)
+    unchanged = Column(Integer, nullable=False, default=0)
+    skipped = Column(Integer, nullable=False, default=0)
+    failed = Column(Integer, nullable=False, default=0)
+    recent_errors = Column(JSON().with_variant(JSONB, "postgresql"), nullable=False, default=list)
+    error = Column(Text, nullable=True)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
@@ -0,0 +1,143 @@
+from sqlalchemy import event, exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from typing import Any, Dict, List, Optional, Tuple
+import bisect
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds, in milliseconds, of the checkout wait histogram's buckets
+WAIT_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+def pool_sizing(max_connections: int, workers: int) -> Tuple[int, int]:
+    """
+    Pool size and overflow for each of workers processes sharing a budget
+    of max_connections to one server: two thirds of a process's share kept
+    open, the rest opened under load and closed when returned.
+    """
+    per_process = max(max_connections // max(workers, 1), 1)
+    pool_size = max(per_process * 2 // 3, 1)
+    return pool_size, per_process - pool_size
+
+class PoolMetrics:
+    """
+    Checkout and connection metrics of one engine's pool: how long
+    checkouts waited for a connection (histogram, mean, max) and how many
+    timed out, connections in use and in overflow, and the age of the open
+    connections.
+    """
+
+    def __init__(self, name: str, pool: "InstrumentedPool"):
+        self.name = name
+        self.pool = pool
+        self.checkouts = 0
+        self.timeouts = 0
+        self.waits = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.wait_buckets = [0] * (len(WAIT_BUCKETS_MS) + 1)
+        self.max_in_use = 0
+        self.connections_opened = 0
+        self.connections_closed = 0
+        self.connections_invalidated = 0
+        self._connected_at: Dict[int, float] = {}
+
+        event.listen(pool, "connect", self._on_connect)
+        event.listen(pool, "checkout", self._on_checkout)
+        event.listen(pool, "invalidate", self._on_invalidate)
+        event.listen(pool, "close", self._on_close)
+        event.listen(pool, "detach", self._on_close)
+
+    def record_wait(self, seconds: float, timed_out: bool = False) -> None:
+        if timed_out:
+            self.timeouts += 1
+        self.waits += 1
+        self.wait_total += seconds
+        self.wait_max = max(self.wait_max, seconds)
+        self.wait_buckets[bisect.bisect_left(WAIT_BUCKETS_MS, seconds * 1000)] += 1
+
+    def _on_connect(self, dbapi_connection, connection_record) -> None:
+        self.connections_opened += 1
+        self._connected_at[id(connection_record)] = time.time()
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy) -> None:
+        self.checkouts += 1
+        self.max_in_use = max(self.max_in_use, self.pool.checkedout())
+
+    def _on_invalidate(self, dbapi_connection, connection_record, exception) -> None:
+        self.connections_invalidated += 1
+
+    def _on_close(self, dbapi_connection, connection_record) -> None:
+        if self._connected_at.pop(id(connection_record), None) is not None:
+            self.connections_closed += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        now = time.time()
+        ages = [now - connected_at for connected_at in self._connected_at.values()]
+        return {
+            "name": self.name,
+            "pool_size": self.pool.size(),
+            "max_overflow": self.pool._max_overflow,
+            "timeout": self.pool.timeout(),
+            "in_use": self.pool.checkedout(),
+            "idle": self.pool.checkedin(),
+            "overflow": max(self.pool.overflow(), 0),
+            "max_in_use": self.max_in_use,
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "wait_mean_ms": self.wait_total * 1000 / self.waits if self.waits else 0.0,
+            "wait_max_ms": self.wait_max * 1000,
+            "wait_histogram_ms": {
+                **{str(bound): count for bound, count in zip(WAIT_BUCKETS_MS, self.wait_buckets)},
+                "+Inf": self.wait_buckets[-1]
+            },
+            "connections_open": len(ages),
+            "connections_opened": self.connections_opened,
+            "connections_closed": self.connections_closed,
+            "connections_invalidated": self.connections_invalidated,
+            "connection_age_max_seconds": max(ages) if ages else None,
+            "connection_age_mean_seconds": sum(ages) / len(ages) if ages else None
+        }
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    """
+    Async queue pool that records how long each checkout took, into its
+    metrics: waiting for a free connection, or opening one, and the
+    pre-ping if enabled.
+    """
+
+    metrics: Optional[PoolMetrics] = None
+
+    def connect(self):
+        if self.metrics is None:
+            return super().connect()
+        start = time.perf_counter()
+        try:
+            connection = super().connect()
+        except exc.TimeoutError:
+            self.metrics.record_wait(time.perf_counter() - start, timed_out=True)
+            logger.error(f"Timed out waiting for a {self.metrics.name} database connection: {self.status()}")
+            raise
+        self.metrics.record_wait(time.perf_counter() - start)
+        return connection
+
+    def recreate(self):
+        # Disposing of the engine replaces its pool; its metrics carry over
+        pool = super().recreate()
+        if self.metrics is not None:
+            pool.metrics = self.metrics
+            self.metrics.pool = pool
+        return pool
+
+pool_metrics: List[PoolMetrics] = []
+
+def instrument_pool(engine, name: str) -> PoolMetrics:
+    """Collect the metrics of an engine created with poolclass=InstrumentedPool."""
+    pool = engine.sync_engine.pool
+    pool.metrics = PoolMetrics(name, pool)
+    pool_metrics.append(pool.metrics)
+    return pool.metrics
+
+def get_pool_stats() -> List[Dict[str, Any]]:
+    return [metrics.get_stats() for metrics in pool_metrics]
@@ -0,0 +1,303 @@
+from contextvars import ContextVar
+from datetime import date, datetime
+from decimal import Decimal
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+from typing import Any, Dict, List, Optional
+import asyncio
+import logging
+import random
+import re
+import time
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Distinct normalised statements tracked; the rest are counted together
+MAX_STATEMENTS = 1000
+OTHER_STATEMENTS = "<other statements>"
+# Raw statement texts whose normalised form is cached
+MAX_NORMALISED_CACHE = 5000
+# Characters of a statement kept in logs and aggregates
+STATEMENT_PREVIEW = 2000
+# Execution option that keeps a connection's statements out of the stats
+SKIP_OPTION = "skip_query_stats"
+
+_WHITESPACE = re.compile(r"\s+")
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"(?<![\w$%])\d+(?:\.\d+)?\b")
+_PLACEHOLDER = r"(?:%s|\$\d+|\?|%\(\w+\)s)"
+# IN lists and VALUES rows expanded to one placeholder per value
+_PLACEHOLDER_LIST = re.compile(rf"\(\s*{_PLACEHOLDER}(?:\s*,\s*{_PLACEHOLDER})+\s*\)")
+_REPEATED_ROWS = re.compile(r"(\(\.\.\.\))(?:\s*,\s*\(\.\.\.\))+")
+# Statements EXPLAIN ANALYZE must not run again: calls that take locks,
+# sleep or have side effects, and row locking clauses
+_UNSAFE_TO_ANALYZE = re.compile(
+    r"\b(?:pg_(?:try_)?advisory_\w+|pg_sleep\w*|pg_notify|nextval|setval|pg_cancel_backend|pg_terminate_backend"
+    r"|pg_stat_statements_reset|lo_\w+|dblink\w*)\s*\("
+    r"|\bFOR\s+(?:UPDATE|NO\s+KEY\s+UPDATE|SHARE|KEY\s+SHARE)\b",
+    re.IGNORECASE
+)
+
+def normalize_statement(statement: str) -> str:
+    """Statement text with literals and expanded placeholder lists collapsed, to group its executions."""
+    statement = _WHITESPACE.sub(" ", statement).strip()
+    statement = _STRING_LITERAL.sub("?", statement)
+    statement = _NUMBER_LITERAL.sub("?", statement)
+    statement = _PLACEHOLDER_LIST.sub("(...)", statement)
+    return _REPEATED_ROWS.sub(r"\1, ...", statement)
+
+def redact_value(value: Any) -> Any:
+    """A bound parameter as it may be logged: numbers, dates and nulls as they are, the rest by type and size."""
+    if value is None or isinstance(value, (bool, int, float, Decimal, date, datetime)):
+        return value
+    if isinstance(value, (str, bytes, bytearray, memoryview)):
+        return f"<{type(value).__name__} len={len(value)}>"
+    if isinstance(value, (list, tuple)):
+        return [redact_value(item) for item in value[:10]] + (["..."] if len(value) > 10 else [])
+    return f"<{type(value).__name__}>"
+
+def redact_parameters(parameters: Any, executemany: bool) -> Any:
+    if executemany:
+        parameters = list(parameters)
+        return {"parameter_sets": len(parameters), "first": redact_parameters(parameters[0], False) if parameters else None}
+    if isinstance(parameters, dict):
+        return {key: redact_value(value) for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [redact_value(value) for value in parameters]
+    return redact_value(parameters)
+
+class RequestQueries:
+    """Statements run while serving one request."""
+
+    __slots__ = ("count", "seconds")
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+current_request: ContextVar[Optional[RequestQueries]] = ContextVar("current_request_queries", default=None)
+
+class _StatementStats:
+    __slots__ = ("calls", "errors", "slow", "total", "max", "rows")
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.slow = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.rows = 0
+
+class _RouteStats:
+    __slots__ = ("requests", "queries", "max_queries", "seconds")
+
+    def __init__(self):
+        self.requests = 0
+        self.queries = 0
+        self.max_queries = 0
+        self.seconds = 0.0
+
+class QueryStats:
+    """
+    Latency of every statement run through the instrumented engines,
+    aggregated per normalised statement, and query counts per route.
+
+    Statements slower than DATABASE_SLOW_QUERY_MS are logged with their
+    parameters redacted. A DATABASE_SLOW_QUERY_EXPLAIN_RATE fraction of slow
+    SELECTs is re-run once under EXPLAIN (ANALYZE, BUFFERS), in a read-only
+    transaction on a separate connection, and the plan logged with them.
+    """
+
+    def __init__(self):
+        self._statements: Dict[str, _StatementStats] = {}
+        self._normalized: Dict[str, str] = {}
+        self._routes: Dict[str, _RouteStats] = {}
+        self._explaining = False
+        self._explain_tasks = set()
+        self.started_at = time.time()
+
+    def instrument(self, engine: AsyncEngine) -> None:
+        """Record the statements of an engine (and any engine sharing its pool)."""
+        sync_engine = engine.sync_engine
+        event.listen(sync_engine, "before_cursor_execute", self._before_cursor_execute)
+        event.listen(sync_engine, "after_cursor_execute", self._after_cursor_execute)
+        event.listen(sync_engine, "handle_error", self._handle_error)
+
+    def _normalize(self, statement: str) -> str:
+        normalized = self._normalized.get(statement)
+        if normalized is None:
+            if len(self._normalized) >= MAX_NORMALISED_CACHE:
+                self._normalized.clear()
+            normalized = self._normalized[statement] = normalize_statement(statement)[:STATEMENT_PREVIEW]
+        return normalized
+
+    def _stats_for(self, statement: str) -> _StatementStats:
+        key = self._normalize(statement)
+        stats = self._statements.get(key)
+        if stats is None:
+            if len(self._statements) >= MAX_STATEMENTS:
+                key = OTHER_STATEMENTS
+                stats = self._statements.get(key)
+            if stats is None:
+                stats = self._statements[key] = _StatementStats()
+        return stats
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if conn.get_execution_options().get(SKIP_OPTION):
+            return
+        conn.info.setdefault("query_start_times", []).append(time.perf_counter())
+
+    def _finish(self, conn) -> Optional[float]:
+        start_times = conn.info.get("query_start_times")
+        if not start_times:
+            return None
+        elapsed = time.perf_counter() - start_times.pop()
+        request = current_request.get()
+        if request is not None:
+            request.count += 1
+            request.seconds += elapsed
+        return elapsed
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = self._finish(conn)
+        if elapsed is None:
+            return
+        stats = self._stats_for(statement)
+        stats.calls += 1
+        stats.total += elapsed
+        stats.max = max(stats.max, elapsed)
+        if cursor is not None and cursor.rowcount and cursor.rowcount > 0:
+            stats.rows += cursor.rowcount
+        if elapsed * 1000 >= settings.DATABASE_SLOW_QUERY_MS:
+            stats.slow += 1
+            self._log_slow(conn, statement, parameters, executemany, elapsed)
+
+    def _handle_error(self, context) -> None:
+        conn = context.connection
+        if conn is None or self._finish(conn) is None or context.statement is None:
+            return
+        stats = self._stats_for(context.statement)
+        stats.calls += 1
+        stats.errors += 1
+
+    def _log_slow(self, conn, statement: str, parameters: Any, executemany: bool, elapsed: float) -> None:
+        redacted = redact_parameters(parameters, executemany)
+        logger.warning(
+            f"Slow query ({elapsed * 1000:.1f} ms): {_WHITESPACE.sub(' ', statement)[:STATEMENT_PREVIEW]} "
+            f"parameters={redacted}"
+        )
+        if (
+            not executemany
+            and settings.DATABASE_SLOW_QUERY_EXPLAIN_RATE > 0
+            and not self._explaining
+            and statement.lstrip()[:6].upper() == "SELECT"
+            and not _UNSAFE_TO_ANALYZE.search(statement)
+            and random.random() < settings.DATABASE_SLOW_QUERY_EXPLAIN_RATE
+        ):
+            engine = conn.engine
+            self._explaining = True
+            task = asyncio.get_running_loop().create_task(self._explain(engine, statement, parameters, elapsed))
+            self._explain_tasks.add(task)
+            task.add_done_callback(self._explain_tasks.discard)
+
+    async def _explain(self, sync_engine, statement: str, parameters: Any, elapsed: float) -> None:
+        """Log the plan of a slow statement, one at a time."""
+        try:
+            engine = AsyncEngine(sync_engine)
+            async with engine.connect() as connection:
+                connection = await connection.execution_options(
+                    **{SKIP_OPTION: True}, isolation_level="READ COMMITTED", postgresql_readonly=True
+                )
+                async with connection.begin() as transaction:
+                    result = await connection.exec_driver_sql(f"EXPLAIN (ANALYZE, BUFFERS) {statement}", parameters)
+                    plan = "\n".join(row[0] for row in result)
+                    await transaction.rollback()
+            logger.warning(
+                f"Plan of slow query ({elapsed * 1000:.1f} ms): {_WHITESPACE.sub(' ', statement)[:STATEMENT_PREVIEW]}\n{plan}"
+            )
+        except Exception as e:
+            logger.error(f"Error explaining slow query: {str(e)}")
+        finally:
+            self._explaining = False
+
+    def record_request(self, route: str, request: RequestQueries) -> None:
+        stats = self._routes.get(route)
+        if stats is None:
+            if len(self._routes) >= MAX_STATEMENTS:
+                return
+            stats = self._routes[route] = _RouteStats()
+        stats.requests += 1
+        stats.queries += request.count
+        stats.max_queries = max(stats.max_queries, request.count)
+        stats.seconds += request.seconds
+
+    def get_statements(self, order_by: str = "total_ms", limit: int = 50) -> List[Dict[str, Any]]:
+        statements = [
+            {
+                "statement": statement,
+                "calls": stats.calls,
+                "errors": stats.errors,
+                "slow": stats.slow,
+                "rows": stats.rows,
+                "total_ms": stats.total * 1000,
+                "mean_ms": stats.total * 1000 / stats.calls if stats.calls else 0.0,
+                "max_ms": stats.max * 1000
+            }
+            for statement, stats in self._statements.items()
+        ]
+        statements.sort(key=lambda statement: statement[order_by], reverse=True)
+        return statements[:limit]
+
+    def get_routes(self) -> List[Dict[str, Any]]:
+        routes = [
+            {
+                "route": route,
+                "requests": stats.requests,
+                "queries": stats.queries,
+                "mean_queries": stats.queries / stats.requests,
+                "max_queries": stats.max_queries,
+                "db_ms": stats.seconds * 1000
+            }
+            for route, stats in self._routes.items()
+        ]
+        routes.sort(key=lambda route: route["queries"], reverse=True)
+        return routes
+
+    def reset(self) -> None:
+        self._statements.clear()
+        self._routes.clear()
+        self.started_at = time.time()
+
+query_stats = QueryStats()
+
+class QueryCountMiddleware:
+    """
+    ASGI middleware counting each request's statements: reported to the
+    client in a Server-Timing header (statements run before the response
+    started) and aggregated per route once the request is done.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        request = RequestQueries()
+        token = current_request.set(request)
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                timing = f'db;dur={request.seconds * 1000:.1f};desc="{request.count} queries"'
+                message = {**message, "headers": [*message.get("headers", []), (b"server-timing", timing.encode())]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            current_request.reset(token)
+            route = scope.get("route")
+            if route is not None and request.count:
+                query_stats.record_request(f"{scope['method']} {route.path}", request)
@@ -0,0 +1,128 @@
+from sqlalchemy import text, exc
+from sqlalchemy.ext.asyncio import AsyncEngine
+from typing import List, Optional
+import asyncio
+import itertools
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Seconds the replica is behind the primary: 0 when it has replayed all the
+# WAL it received (an idle primary sends none, so the last replayed
+# transaction's age is no measure), and 0 on a server that is not a replica
+_REPLICATION_LAG = text(
+    "SELECT CASE "
+    "WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+)
+
+def is_disconnect(error: BaseException) -> bool:
+    """Whether a database error means the server could not be reached."""
+    if isinstance(error, exc.DBAPIError):
+        return error.connection_invalidated
+    return isinstance(error, (OSError, asyncio.TimeoutError))
+
+# SQLSTATEs of reads a replica fails that the primary would not:
+# serialization_failure and query_canceled, which a conflict with recovery
+# raises
+_RETRYABLE_SQLSTATES = {"40001", "57014"}
+
+def is_retryable_on_primary(error: BaseException) -> bool:
+    """
+    Whether a read that failed on a replica can be retried on the primary:
+    lost connections, and queries cancelled by a conflict with recovery.
+
+    The asyncpg dialect raises the latter as plain DBAPIErrors, so they
+    are told apart by the SQLSTATE of the driver's error.
+    """
+    if is_disconnect(error):
+        return True
+    return isinstance(error, exc.DBAPIError) and getattr(error.orig, "sqlstate", None) in _RETRYABLE_SQLSTATES
+
+class Replica:
+    def __init__(self, name: str, engine: AsyncEngine):
+        self.name = name
+        self.engine = engine
+        self.healthy = True
+        self.lag: Optional[float] = None
+        self.checked_at: Optional[float] = None
+        self.error: Optional[str] = None
+
+class ReplicaRouter:
+    """
+    Picks the replica for each read-only session, round-robin over the
+    healthy ones.
+
+    A replica is taken out of rotation when a health check fails or finds
+    it more than max_lag seconds behind, and when a session loses its
+    connection to it; the next passing check puts it back. With no healthy
+    replica, pick() returns None and reads go to the primary.
+    """
+
+    def __init__(self, replicas: List[Replica], max_lag: float, check_timeout: float = 2.0):
+        self.replicas = replicas
+        self.max_lag = max_lag
+        self.check_timeout = check_timeout
+        self._next = itertools.cycle(range(len(replicas))) if replicas else None
+
+    def pick(self) -> Optional[Replica]:
+        for _ in range(len(self.replicas)):
+            replica = self.replicas[next(self._next)]
+            if replica.healthy:
+                return replica
+        return None
+
+    def mark_down(self, replica: Replica, reason: str) -> None:
+        if replica.healthy:
+            logger.error(f"Database replica {replica.name} taken out of rotation: {reason}")
+        replica.healthy = False
+        replica.error = reason
+
+    async def _lag(self, replica: Replica) -> Optional[float]:
+        async with replica.engine.connect() as connection:
+            return await connection.scalar(_REPLICATION_LAG)
+
+    async def check(self, replica: Replica) -> bool:
+        """Check a replica's connectivity and lag, updating whether it is in rotation."""
+        try:
+            lag = await asyncio.wait_for(self._lag(replica), self.check_timeout)
+        except Exception as e:
+            self.mark_down(replica, str(e) or type(e).__name__)
+            return False
+        finally:
+            replica.checked_at = time.time()
+        replica.lag = float(lag or 0)
+        if replica.lag > self.max_lag:
+            self.mark_down(replica, f"{replica.lag:.1f}s behind the primary")
+            return False
+        if not replica.healthy:
+            logger.info(f"Database replica {replica.name} back in rotation")
+        replica.healthy = True
+        replica.error = None
+        return True
+
+    async def check_all(self) -> None:
+        await asyncio.gather(*(self.check(replica) for replica in self.replicas))
+
+    async def run_health_checks(self, interval: float) -> None:
+        """Check every replica every interval seconds, forever."""
+        while True:
+            await asyncio.sleep(interval)
+            await self.check_all()
+
+    def get_status(self) -> List[dict]:
+        return [
+            {
+                "name": replica.name,
+                "healthy": replica.healthy,
+                "lag_seconds": replica.lag,
+                "checked_at": replica.checked_at,
+                "error": replica.error
+            }
+            for replica in self.replicas
+        ]
+
+    async def dispose(self) -> None:
+        for replica in self.replicas:
+            await replica.engine.dispose()
@@ -38,6 +38,10 @@ class Book(BookBase):
     created_at: datetime
     updated_at: Optional[datetime] = None
     author: Optional[str] = None  # Use the property from the model
+    cover_placeholder: Optional[str] = None
+    cover_color: Optional[str] = None
+    cover_width: Optional[int] = None
+    cover_height: Optional[int] = None
 
     class Config:
         from_attributes = True
@@ -69,6 +73,31 @@ class TypeaheadSuggestion(BaseModel):
     title: str
     author: Optional[str] = None
     cover_image_url: Optional[str] = None
+    cover_placeholder: Optional[str] = None
+    cover_color: Optional[str] = None
+    cover_width: Optional[int] = None
+    cover_height: Optional[int] = None
+
+class VisitRecorded(BaseModel):
+    """A visit accepted into the write-behind buffer."""
+    book_id: int
+    visit_date: date
+    visit_count: int = 1
+
+class EventIn(BaseModel):
+    """One analytics event as sent by a client."""
+    event_type: str = Field(pattern=r"^[a-z][a-z0-9_.]{0,63}$")
+    book_id: Optional[int] = None
+    session_id: Optional[str] = Field(default=None, max_length=64)
+    occurred_at: Optional[datetime] = None  # Defaults to when the server received it
+    metadata: Optional[Dict[str, Any]] = None
+
+class EventBatch(BaseModel):
+    events: List[EventIn] = Field(min_length=1)
+
+class EventsAccepted(BaseModel):
+    accepted: int
+    dropped: int = 0
 
 class VisitBase(BaseModel):
     book_id: int
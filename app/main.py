@@ -1,11 +1,19 @@
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, Request, HTTPException
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, FileResponse
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
-from app.db.database import engine, Base
+from app.db.database import engine, Base, SessionLocal, replica_router
+from app.db.query_stats import QueryCountMiddleware
+from app.core.config import settings
 from app.api import books, analytics, admin, search, llm, images
+from app.services import book_service, analytics_service
+from app.services.image_cache_service import image_cache
+from app.services.cover_refresh_service import cover_refresh_job
+from app.services.event_service import event_buffer
+from app.services.response_cache_service import response_cache
+import asyncio
 import os
 from pathlib import Path
 import logging
@@ -37,6 +45,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Count each request's database statements
+app.add_middleware(QueryCountMiddleware)
+
 # Create database tables
 @app.on_event("startup")
 async def init_db():
@@ -50,6 +61,96 @@ async def init_db():
         logger.error(f"Error creating database tables: {str(e)}")
         raise  # Raise the error to prevent app from starting with broken DB
 
+async def load_pinned_cover_keys():
+    """Covers referenced by books, which the image cache sweeper must keep"""
+    async with SessionLocal() as db:
+        return await book_service.get_pinned_cover_keys(db)
+
+@app.on_event("startup")
+async def start_replica_health_checks():
+    """Check the read replicas, if any, before serving and then periodically"""
+    if replica_router.replicas:
+        await replica_router.check_all()
+        app.state.replica_health_checks = asyncio.create_task(
+            replica_router.run_health_checks(settings.DATABASE_REPLICA_HEALTH_INTERVAL)
+        )
+
+@app.on_event("shutdown")
+async def close_replicas():
+    """Stop the replica health checks and close the replicas' connections"""
+    checks = getattr(app.state, "replica_health_checks", None)
+    if checks:
+        checks.cancel()
+    await replica_router.dispose()
+
+@app.on_event("startup")
+async def start_image_cache_sweeper():
+    """Start the background task that keeps the image cache within its byte budget"""
+    app.state.image_cache_sweeper = asyncio.create_task(image_cache.run_sweeper(load_pinned_cover_keys))
+
+@app.on_event("startup")
+async def start_visit_flusher():
+    """Start the background task that writes buffered visit counts"""
+    app.state.visit_flusher = asyncio.create_task(analytics_service.visit_buffer.run_flusher())
+
+@app.on_event("shutdown")
+async def flush_visits():
+    """Stop the visit flusher and write any counts still buffered"""
+    flusher = getattr(app.state, "visit_flusher", None)
+    if flusher:
+        flusher.cancel()
+    try:
+        await analytics_service.visit_buffer.flush()
+    except Exception:
+        logger.error("Buffered visit counts were lost on shutdown")
+
+@app.on_event("startup")
+async def start_event_flusher():
+    """Create the event log's partitions and start the task that writes buffered events"""
+    try:
+        await event_buffer.ensure_partitions()
+    except Exception as e:
+        # Retried by the first flush
+        logger.error(f"Error creating analytics event partitions: {str(e)}")
+    app.state.event_flusher = asyncio.create_task(event_buffer.run_flusher())
+
+@app.on_event("shutdown")
+async def flush_events():
+    """Stop the event flusher and write any events still buffered"""
+    flusher = getattr(app.state, "event_flusher", None)
+    if flusher:
+        flusher.cancel()
+    try:
+        await event_buffer.flush()
+    except Exception:
+        logger.error("Buffered analytics events were lost on shutdown")
+
+@app.on_event("shutdown")
+async def close_response_cache():
+    """Cancel response cache refreshes and close its Redis connections"""
+    await response_cache.close()
+
+@app.on_event("startup")
+async def resume_cover_refresh():
+    """Resume a bulk cover refresh that was interrupted by a restart, in one worker"""
+    try:
+        await cover_refresh_job.resume()
+    except Exception as e:
+        logger.error(f"Error resuming cover refresh: {str(e)}")
+
+@app.on_event("shutdown")
+async def stop_cover_refresh():
+    """Stop the bulk cover refresh, keeping its checkpoint to resume from"""
+    await cover_refresh_job.stop()
+
+@app.on_event("shutdown")
+async def close_image_cache():
+    """Stop the sweeper and close the image cache's pooled HTTP session on shutdown"""
+    sweeper = getattr(app.state, "image_cache_sweeper", None)
+    if sweeper:
+        sweeper.cancel()
+    await image_cache.close()
+
 # Custom middleware to handle static file URLs
 @app.middleware("http")
 async def rewrite_static_urls(request: Request, call_next):
@@ -80,6 +181,20 @@ async def rewrite_static_urls(request: Request, call_next):
     
     return response
 
+# Registered ahead of the static mounts so cached covers go through content negotiation
+@app.get("/cache/images/{filename:path}")
+async def serve_cached_image(request: Request, filename: str):
+    """Serve a cached cover, upgrading JPEG to WebP/AVIF when the browser accepts it"""
+    resolved = await image_cache.get_variant_file(filename, request.headers.get("accept", ""))
+    if not resolved:
+        raise HTTPException(status_code=404, detail="Image not found")
+    path, media_type = resolved
+    return FileResponse(
+        path,
+        media_type=media_type,
+        headers={"Vary": "Accept", "Cache-Control": "public, max-age=86400"}
+    )
+
 # Ensure static directories exist and mount them
 base_dir = Path(__file__).resolve().parent.parent
 static_dir = base_dir / "static"
@@ -97,8 +212,6 @@ for directory in [static_dir, js_dir, css_dir, cache_dir, cache_images_dir]:
     try:
         directory.mkdir(parents=True, exist_ok=True)
         logger.info(f"Created/verified directory: {directory}")
-        # Log directory permissions
-        logger.info(f"Directory permissions for {directory}: {oct(directory.stat().st_mode)[-3:]}")
     except Exception as e:
         logger.error(f"Error creating directory {directory}: {str(e)}")
 
@@ -107,7 +220,6 @@ try:
     app.mount("/static", StaticFiles(directory=static_dir), name="static")
     app.mount("/js", StaticFiles(directory=js_dir), name="js")
     app.mount("/css", StaticFiles(directory=css_dir), name="css")
-    app.mount("/cache/images", StaticFiles(directory=cache_images_dir), name="cache_images")
     logger.info("Successfully mounted all static directories")
     
     # Configure templates
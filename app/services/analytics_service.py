@@ -1,24 +1,36 @@
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func, desc
-from sqlalchemy.orm import selectinload, Session
-from datetime import datetime, timedelta
-from typing import List, Optional, Tuple, Union, Dict, Any
+from sqlalchemy import select, func, desc, text, tuple_
+from sqlalchemy.orm import contains_eager, Session
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone, date
+from typing import List, Optional, Tuple, Union, Dict, Any, Set
 import asyncio
 
 from app.db import models, schemas
+from app.db.database import SessionLocal
+from app.core.config import settings
 from app.core.exceptions import BookNotFoundError
+from app.core.hyperloglog import HyperLogLog
 from app.services.image_cache_service import image_cache
+from app.services.book_service import fill_cover_details
+from app.services import popularity_service
 import logging
 
 logger = logging.getLogger(__name__)
 
-async def _process_book_for_response(book: models.Book) -> Dict[str, Any]:
-    """Process a book for API response, including cached image URL."""
+# Rows per upsert statement, keeping bind parameters well under asyncpg's 32767
+VISIT_UPSERT_CHUNK = 5000
+
+async def _process_book_for_response(book: models.Book, size: str = "L") -> Dict[str, Any]:
+    """Process a book for API response, including cached image URL of the given size."""
     original_url = book.cover_image_url
     if original_url:
-        cached_url = await image_cache.get_cached_url(original_url)
-        book.cover_image_url = cached_url
-    return book
+        cached_url = await image_cache.get_cached_url(original_url, size=size)
+        # Set without marking the book dirty so sized URLs are never persisted
+        set_committed_value(book, "_image_url", cached_url)
+    return await fill_cover_details(book)
 
 async def _cache_book_cover(book: models.Book) -> None:
     """Cache a book's cover image in the background."""
@@ -28,48 +40,192 @@ async def _cache_book_cover(book: models.Book) -> None:
         except Exception as e:
             logger.error(f"Error caching cover for book {book.id}: {str(e)}")
 
-async def record_visit(db: Session, book_id: int) -> models.Visit:
-    # Check if book exists
-    result = await db.execute(
-        select(models.Book).where(models.Book.id == book_id)
-    )
-    book = result.scalar_one_or_none()
-    if not book:
-        raise BookNotFoundError(f"Book with id {book_id} not found")
+class VisitBuffer:
+    """
+    Write-behind buffer of visit counts keyed by (book_id, visit_date).
 
-    today = datetime.now().date()
-    result = await db.execute(
-        select(models.Visit).where(
-            models.Visit.book_id == book_id,
-            models.Visit.visit_date == today
-        )
-    )
-    visit = result.scalar_one_or_none()
-    
-    if visit:
-        visit.visit_count += 1
-        visit.updated_at = datetime.utcnow()
-    else:
-        visit = models.Visit(
-            book_id=book_id,
-            visit_date=today,
-            visit_count=1,
-            created_at=datetime.utcnow(),
-            updated_at=datetime.utcnow()
-        )
-        db.add(visit)
-    
-    await db.commit()
-    return visit
+    Recording a visit only increments an in-memory counter, and adds the
+    visitor to that day's HyperLogLog sketch of unique visitors. The counters are
+    flushed every VISIT_FLUSH_INTERVAL seconds, and on shutdown, as one
+    multi-row INSERT ... ON CONFLICT DO UPDATE, so concurrent views never
+    lose increments and page views never wait on a write. The popularity
+    rollups and trending scores are updated in the same transaction, and the
+    rollups are rolled over to the new day by the first flush after
+    midnight even when nothing was visited.
+    """
 
-async def get_popular_books(
-    db: AsyncSession, 
-    days: int = 7, 
-    limit: int = 12,
-    offset: int = 0,
-    get_total: bool = False
-) -> Union[List[Tuple[models.Book, int]], Tuple[List[Tuple[models.Book, int]], int]]:
-    """Get the most visited books in the last N days with their visit counts."""
+    def __init__(self):
+        self._counts: Dict[Tuple[int, date], int] = defaultdict(int)
+        self._sketches: Dict[Tuple[int, date], HyperLogLog] = {}
+        # Books known to exist, so repeat visits skip the existence check
+        self._known_books: Set[int] = set()
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._flush_lock_loop: Optional[asyncio.AbstractEventLoop] = None
+        # Day the popularity rollups were last brought up to date for
+        self._rollups_as_of: Optional[date] = None
+        self.stats = {"recorded": 0, "flushes": 0, "flushed_rows": 0, "flush_errors": 0}
+
+    def add(
+        self,
+        book_id: int,
+        count: int = 1,
+        visit_date: Optional[date] = None,
+        visitor: Optional[int] = None
+    ) -> None:
+        """Count visits to a book that is known to exist, by the visitor with the given hash if known."""
+        key = (book_id, visit_date or datetime.now().date())
+        self._counts[key] += count
+        if visitor is not None:
+            sketch = self._sketches.get(key)
+            if sketch is None:
+                sketch = self._sketches[key] = HyperLogLog(settings.VISIT_HLL_PRECISION)
+            sketch.add_hash(visitor)
+        self._known_books.add(book_id)
+        self.stats["recorded"] += count
+
+    def pending(self) -> int:
+        """Number of buffered (book, day) counters."""
+        return len(self._counts)
+
+    async def book_exists(self, db: AsyncSession, book_id: int) -> bool:
+        if book_id in self._known_books:
+            return True
+        exists = await db.scalar(select(models.Book.id).where(models.Book.id == book_id))
+        if exists is None:
+            return False
+        self._known_books.add(book_id)
+        return True
+
+    def _get_flush_lock(self) -> asyncio.Lock:
+        loop = asyncio.get_running_loop()
+        if self._flush_lock is None or self._flush_lock_loop is not loop:
+            self._flush_lock = asyncio.Lock()
+            self._flush_lock_loop = loop
+        return self._flush_lock
+
+    async def flush(self) -> int:
+        """Write buffered counts to the database. Returns the number of rows upserted."""
+        async with self._get_flush_lock():
+            now = datetime.now(timezone.utc)
+            today = datetime.now().date()
+            if not self._counts and self._rollups_as_of == today:
+                return 0
+            counts, self._counts = self._counts, defaultdict(int)
+            sketches, self._sketches = self._sketches, {}
+            # Sorted so concurrent flushes from other processes lock rows in the same order
+            rows = [
+                {
+                    "book_id": book_id,
+                    "visit_date": visit_date,
+                    "visit_count": count,
+                    "visitor_sketch": sketches.get((book_id, visit_date))
+                }
+                for (book_id, visit_date), count in sorted(counts.items())
+            ]
+            try:
+                async with SessionLocal() as db:
+                    async with db.begin():
+                        if rows:
+                            await self._write_batch(db, rows)
+                        await popularity_service.apply_visits(db, rows, today)
+                        if rows:
+                            await popularity_service.apply_trending(db, self._per_book(rows), now)
+            except Exception as e:
+                # Put the counts and visitors back so the next flush retries them
+                for key, count in counts.items():
+                    self._counts[key] += count
+                for key, sketch in sketches.items():
+                    if key in self._sketches:
+                        sketch.merge(self._sketches[key])
+                    self._sketches[key] = sketch
+                self.stats["flush_errors"] += 1
+                logger.error(f"Error flushing {len(rows)} visit counters: {str(e)}")
+                raise
+            self._rollups_as_of = today
+            self.stats["flushes"] += 1
+            self.stats["flushed_rows"] += len(rows)
+            return len(rows)
+
+    @staticmethod
+    def _per_book(rows: List[Dict[str, Any]]) -> Dict[int, int]:
+        counts: Dict[int, int] = defaultdict(int)
+        for row in rows:
+            counts[row["book_id"]] += row["visit_count"]
+        return counts
+
+    async def _merge_stored_sketches(self, db: AsyncSession, rows: List[Dict[str, Any]]) -> None:
+        """
+        Replace each row's buffered visitor sketch by its union with the
+        stored one, serialised, ready to be written back.
+        """
+        keys = [(row["book_id"], row["visit_date"]) for row in rows if row["visitor_sketch"] is not None]
+        stored = {}
+        for start in range(0, len(keys), VISIT_UPSERT_CHUNK):
+            result = await db.execute(
+                select(models.Visit.book_id, models.Visit.visit_date, models.Visit.visitor_sketch)
+                .where(
+                    tuple_(models.Visit.book_id, models.Visit.visit_date).in_(keys[start:start + VISIT_UPSERT_CHUNK]),
+                    models.Visit.visitor_sketch.isnot(None)
+                )
+            )
+            stored.update({(book_id, visit_date): sketch for book_id, visit_date, sketch in result.all()})
+        for row in rows:
+            sketch = row["visitor_sketch"]
+            if sketch is not None:
+                existing = stored.get((row["book_id"], row["visit_date"]))
+                if existing:
+                    sketch = sketch.copy().merge(HyperLogLog.from_bytes(existing))
+                row["visitor_sketch"] = sketch.to_bytes()
+
+    async def _write_batch(self, db: AsyncSession, rows: List[Dict[str, Any]]) -> None:
+        """Upsert one batch of visit counts and visitor sketches inside the caller's transaction."""
+        # Sketches are merged in Python, so flushes from all processes take turns
+        await db.execute(text("SELECT pg_advisory_xact_lock(hashtext('visits'))"))
+        await self._merge_stored_sketches(db, rows)
+        now = func.now()
+        for start in range(0, len(rows), VISIT_UPSERT_CHUNK):
+            statement = pg_insert(models.Visit).values([
+                {**row, "created_at": now, "updated_at": now}
+                for row in rows[start:start + VISIT_UPSERT_CHUNK]
+            ])
+            await db.execute(
+                statement.on_conflict_do_update(
+                    index_elements=[models.Visit.book_id, models.Visit.visit_date],
+                    set_={
+                        "visit_count": models.Visit.visit_count + statement.excluded.visit_count,
+                        "visitor_sketch": func.coalesce(statement.excluded.visitor_sketch, models.Visit.visitor_sketch),
+                        "updated_at": now
+                    }
+                )
+            )
+
+    async def run_flusher(self) -> None:
+        """Flush every VISIT_FLUSH_INTERVAL seconds, forever."""
+        while True:
+            await asyncio.sleep(settings.VISIT_FLUSH_INTERVAL)
+            try:
+                await self.flush()
+            except Exception:
+                pass  # Logged by flush; the counts are retried next time
+
+visit_buffer = VisitBuffer()
+
+async def record_visit(db: AsyncSession, book_id: int, visitor: Optional[int] = None) -> Dict[str, Any]:
+    """Record a visit to a book. The count is buffered and written in the next flush."""
+    if not await visit_buffer.book_exists(db, book_id):
+        raise BookNotFoundError(f"Book with id {book_id} not found")
+    visit_date = datetime.now().date()
+    visit_buffer.add(book_id, visit_date=visit_date, visitor=visitor)
+    return {"book_id": book_id, "visit_date": visit_date, "visit_count": 1}
+
+async def _aggregate_popular_books(
+    db: AsyncSession,
+    days: int,
+    limit: int,
+    offset: int,
+    get_total: bool
+) -> Tuple[List[Tuple[models.Book, int, int]], Optional[int]]:
+    """Rank books by summing their visits over the last N days."""
     cutoff_date = datetime.now().date() - timedelta(days=days)
     
     # Build subquery to get visit counts
@@ -88,7 +244,7 @@ async def get_popular_books(
         select(models.Book, visit_counts.c.total_visits)
         .join(visit_counts, models.Book.id == visit_counts.c.book_id)
         .join(models.Author)
-        .options(selectinload(models.Book.author))
+        .options(contains_eager(models.Book.author))
         .order_by(desc(visit_counts.c.total_visits))
     )
     
@@ -104,11 +260,64 @@ async def get_popular_books(
         # Get results with limit only (original behavior)
         results = await db.execute(query.limit(limit))
         books_with_visits = results.all()
-    
+
+    # Unique visitors of just this page's books, from their daily sketches
+    sketches = await popularity_service.day_visitor_sketches(
+        db, [book.id for book, _ in books_with_visits], cutoff_date
+    ) if books_with_visits else {}
+    books_with_visits = [
+        (book, visits, sketches[book.id].count()) for book, visits in books_with_visits
+    ]
+    return books_with_visits, (total if get_total else None)
+
+async def get_popular_books(
+    db: AsyncSession, 
+    days: int = 7, 
+    limit: int = 12,
+    offset: int = 0,
+    get_total: bool = False,
+    rank_by: str = "visits"
+) -> Union[List[Tuple[models.Book, int, int]], Tuple[List[Tuple[models.Book, int, int]], int]]:
+    """
+    Get the most visited books in the last N days with their visit counts
+    and estimated unique visitors, ranked by rank_by ("visits" or
+    "unique_visitors").
+
+    The standard windows are read from the precomputed popularity rollups;
+    other look-backs aggregate the visits table and can only be ranked by
+    visits.
+    """
+    window = await popularity_service.get_window(db, days)
+    if window is not None:
+        total = window.book_count
+        books_with_visits = await popularity_service.get_ranked_books(
+            db, days, limit, offset if get_total else 0, rank_by
+        )
+    elif rank_by == "unique_visitors":
+        raise ValueError(
+            f"Ranking by unique visitors needs one of the windows {popularity_service.POPULARITY_WINDOWS}"
+        )
+    else:
+        books_with_visits, total = await _aggregate_popular_books(db, days, limit, offset, get_total)
+
     # Process books to use cached URLs
     processed_books_with_visits = []
-    for book, visits in books_with_visits:
-        processed_book = await _process_book_for_response(book)
-        processed_books_with_visits.append((processed_book, visits))
+    for book, visits, unique_visitors in books_with_visits:
+        processed_book = await _process_book_for_response(book, size="M")
+        processed_books_with_visits.append((processed_book, visits, unique_visitors))
     
     return (processed_books_with_visits, total) if get_total else processed_books_with_visits
+
+async def get_trending_books(
+    db: AsyncSession,
+    limit: int = 12,
+    cursor: Optional[str] = None
+) -> Tuple[List[Tuple[models.Book, float]], Optional[str]]:
+    """Get a page of books by current trending score, and the cursor of the next page."""
+    books, next_cursor = await popularity_service.get_trending_books(db, limit, cursor)
+    now = datetime.now(timezone.utc)
+    books_with_scores = []
+    for book in books:
+        score = popularity_service.current_trending_score(book, now)
+        books_with_scores.append((await _process_book_for_response(book, size="M"), score))
+    return books_with_scores, next_cursor
@@ -1,27 +1,56 @@
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, or_, func
-from sqlalchemy.orm import selectinload
+from sqlalchemy import select, update, or_, func
+from sqlalchemy.orm import contains_eager
+from sqlalchemy.orm.attributes import set_committed_value
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, Set
 import json
 import httpx
 
 from app.db import models, schemas
+from app.db.database import SessionLocal, engine
+from app.db.locks import release_session_lock, try_session_lock
 from app.services import llm_service
 from app.core.utils import clean_json_string, validate_book_metadata, create_amazon_affiliate_link
 from app.api.llm import generate_book_digest_prompt
 from app.services.image_cache_service import image_cache
+from app.core.rate_limit import HostRateLimiter
 import logging
 import asyncio
 
 logger = logging.getLogger(__name__)
 
-async def _process_book_for_response(book: models.Book) -> models.Book:
-    """Process a book for API response, including cached image URL."""
+async def _process_book_for_response(book: models.Book, persist: bool = True) -> models.Book:
+    """
+    Process a book for API response, including cached image URL. Without
+    persist the URL is set without marking the book dirty, as reads must.
+    """
     original_url = book.cover_image_url
     if original_url:
         cached_url = await image_cache.get_cached_url(original_url)
-        book.cover_image_url = cached_url
+        if persist:
+            book.cover_image_url = cached_url
+        else:
+            set_committed_value(book, "_image_url", cached_url)
+    return book
+
+def _set_cover_details(book: models.Book, details: Dict[str, Any]) -> None:
+    book.cover_placeholder = details["placeholder"]
+    book.cover_color = details["color"]
+    book.cover_width = details["width"]
+    book.cover_height = details["height"]
+
+async def fill_cover_details(book: models.Book, compute: bool = True) -> models.Book:
+    """
+    Fill in a book's cover placeholder, colour and size from the image cache
+    when its row has none yet, without marking the book dirty.
+    """
+    if book.cover_placeholder or not book.cover_image_url:
+        return book
+    details = await image_cache.get_cover_details(book.cover_image_url, compute)
+    if details:
+        for field, value in details.items():
+            set_committed_value(book, f"cover_{field}", value)
     return book
 
 async def get_book(db: AsyncSession, book_id: int) -> models.Book:
@@ -29,13 +58,13 @@ async def get_book(db: AsyncSession, book_id: int) -> models.Book:
     result = await db.execute(
         select(models.Book)
         .join(models.Author)
-        .options(selectinload(models.Book.author))
+        .options(contains_eager(models.Book.author))
         .where(models.Book.id == book_id)
     )
     book = result.scalar_one_or_none()
     if not book:
         raise ValueError(f"Book with id {book_id} not found")
-    return await _process_book_for_response(book)
+    return await fill_cover_details(await _process_book_for_response(book, persist=False))
 
 async def create_book_with_author(
     db: AsyncSession,
@@ -84,21 +113,32 @@ async def create_book_with_author(
     await db.commit()
     await db.refresh(book)
     
-    return await _process_book_for_response(book)
-
-async def refresh_book_digest(db: AsyncSession, book_id: int, provider: str = "gemini") -> models.Book:
-    """Update a book's AI-generated content using the specified LLM provider."""
-    book = await get_book(db, book_id)
+    book = await _process_book_for_response(book)
     
+    # Store the placeholder shown while the cover loads
+    details = await image_cache.get_cover_details(book.cover_image_url)
+    if details:
+        _set_cover_details(book, details)
+        await db.commit()
+    return book
+
+# In-flight digest refreshes keyed by book id, shared by concurrent callers
+_digest_refreshes: Dict[int, asyncio.Task] = {}
+
+# First key of the two-int advisory lock that serialises digest refreshes
+# of the same book across workers
+_DIGEST_LOCK_NAMESPACE = 0x6467
+# Seconds between checks of a worker waiting on another one's refresh
+_DIGEST_POLL_SECONDS = 0.5
+
+async def _generate_book_digest(book: models.Book, provider: str) -> Dict[str, Any]:
+    """Query the LLM for a book's digest and validate it against the book."""
     # Generate prompt and get LLM response
     prompt = generate_book_digest_prompt(book.title, book.author.name)
     print(f"Generated prompt: {prompt}")  # Debug log
     
     try:
-        if provider == "gemini":
-            response = await llm_service.query_gemini(prompt)
-        else:  # ChatGPT
-            response = await llm_service.query_chatgpt(prompt)
+        response = await llm_service.query_llm(prompt, provider)
         print(f"Raw LLM response: {response}")  # Debug log
     except Exception as e:
         print(f"LLM service error: {str(e)}")  # Debug log
@@ -110,38 +150,90 @@ async def refresh_book_digest(db: AsyncSession, book_id: int, provider: str = "g
     
     try:
         digest = json.loads(cleaned_response)
-        print(f"Parsed digest: {json.dumps(digest, indent=2)}")  # Debug log
-        
-        # Validate book metadata to prevent hallucination
-        is_valid, error_message = validate_book_metadata(
-            digest,
-            book.title,
-            book.author.name
-        )
-        print(f"Validation result: valid={is_valid}, message={error_message}")  # Debug log
-        
-        if not is_valid:
-            raise ValueError(f"LLM response validation failed: {error_message}")
-        
-        # Refresh the book object
-        await db.refresh(book)
-        
-        # Update book with the parsed response
-        book.summary = digest.get("summary")
-        book.questions_and_answers = json.dumps(digest.get("questions_and_answers"))
-        book.updated_at = datetime.utcnow()
-        
-        # Explicitly add the book to the session
-        db.add(book)
-        await db.flush()
-        await db.commit()
-        
-        # Refresh one final time to ensure we have the latest data
-        await db.refresh(book)
-        return await _process_book_for_response(book)
     except json.JSONDecodeError as e:
         print(f"JSON decode error: {str(e)}, Response: {cleaned_response}")  # Debug log
         raise ValueError(f"Failed to parse LLM response as JSON: {str(e)}")
+    print(f"Parsed digest: {json.dumps(digest, indent=2)}")  # Debug log
+    
+    # Validate book metadata to prevent hallucination
+    is_valid, error_message = validate_book_metadata(
+        digest,
+        book.title,
+        book.author.name
+    )
+    print(f"Validation result: valid={is_valid}, message={error_message}")  # Debug log
+    
+    if not is_valid:
+        raise ValueError(f"LLM response validation failed: {error_message}")
+    return digest
+
+async def _refresh_book_digest_once(book_id: int, provider: str) -> None:
+    """
+    Generate and store a book's digest while holding its advisory lock.
+
+    Runs in its own sessions so it can outlive any single caller. The lock
+    is a session lock on an autocommit connection, held across the LLM
+    call without holding a transaction open. Workers that find it taken
+    poll until the digest is stored, skipping the LLM call entirely, or
+    until the lock is free without one, then refresh it themselves.
+    """
+    async with SessionLocal() as session:
+        requested_at = await session.scalar(select(func.clock_timestamp()))
+    while True:
+        claim = await try_session_lock(engine, _DIGEST_LOCK_NAMESPACE, book_id)
+        async with SessionLocal() as session:
+            async with session.begin():
+                result = await session.execute(
+                    select(models.Book)
+                    .where(models.Book.id == book_id)
+                )
+                book = result.scalar_one_or_none()
+        if not book or (book.updated_at and book.updated_at > requested_at):
+            await release_session_lock(claim, _DIGEST_LOCK_NAMESPACE, book_id)
+            if not book:
+                raise ValueError(f"Book with id {book_id} not found")
+            logger.info(f"Digest for book {book_id} was refreshed by another worker")
+            return
+        if claim is not None:
+            break
+        await asyncio.sleep(_DIGEST_POLL_SECONDS)
+
+    try:
+        digest = await _generate_book_digest(book, provider)
+        async with SessionLocal() as session:
+            async with session.begin():
+                await session.execute(
+                    update(models.Book)
+                    .where(models.Book.id == book_id)
+                    .values(
+                        summary=digest.get("summary"),
+                        questions_and_answers=json.dumps(digest.get("questions_and_answers")),
+                        updated_at=func.clock_timestamp()
+                    )
+                    .execution_options(synchronize_session=False)
+                )
+    finally:
+        await release_session_lock(claim, _DIGEST_LOCK_NAMESPACE, book_id)
+
+async def refresh_book_digest(db: AsyncSession, book_id: int, provider: str = "gemini") -> models.Book:
+    """
+    Update a book's AI-generated content using the specified LLM provider.
+
+    Concurrent refreshes of the same book share one in-flight generation;
+    every caller gets the freshly stored digest.
+    """
+    task = _digest_refreshes.get(book_id)
+    if task is None:
+        task = asyncio.ensure_future(_refresh_book_digest_once(book_id, provider))
+        _digest_refreshes[book_id] = task
+        task.add_done_callback(lambda _: _digest_refreshes.pop(book_id, None))
+    
+    # Shield the shared refresh from cancellation of any single caller
+    await asyncio.shield(task)
+    
+    # Drop anything the caller's session already loaded so the book is re-read
+    db.expire_all()
+    return await get_book(db, book_id)
 
 async def get_book_summary(db: AsyncSession, book_id: int) -> Dict[str, str]:
     """Get a book's summary."""
@@ -195,14 +287,14 @@ async def get_book_by_open_library_key(
     result = await db.execute(
         select(models.Book)
         .join(models.Author, isouter=True)
-        .options(selectinload(models.Book.author))
+        .options(contains_eager(models.Book.author))
         .where(models.Book.open_library_key == open_library_key)
     )
     book = result.scalar_one_or_none()
     
     if book:
         print(f"[DEBUG] Found existing book: {book.title}")
-        return await _process_book_for_response(book)
+        return await fill_cover_details(await _process_book_for_response(book, persist=False))
     else:
         print(f"[DEBUG] No book found with key: {open_library_key}")
         return None
@@ -275,6 +367,49 @@ async def post_book_by_open_library_key(
             print(f"[DEBUG] Error creating book: {str(e)}")
             raise
 
+async def get_pinned_cover_keys(db: AsyncSession) -> Set[str]:
+    """Image cache keys of every cover referenced by a book, which must never be evicted."""
+    result = await db.execute(
+        select(models.Book._image_url, models.Book.cover_image_open_library_url)
+    )
+    keys = set()
+    for urls in result.all():
+        for url in urls:
+            key = image_cache.get_cache_key(url)
+            if key:
+                keys.add(key)
+    return keys
+
+async def find_cover_url(
+    client: httpx.AsyncClient,
+    open_library_key: str,
+    title: str,
+    rate_limiter: Optional[HostRateLimiter] = None
+) -> Optional[str]:
+    """
+    Find a book's Open Library cover URL. Uses the work's own covers field,
+    falling back to a title search only when the work has no cover.
+    """
+    async def get_json(url: str, **params) -> Optional[Dict[str, Any]]:
+        if rate_limiter:
+            await rate_limiter.acquire(url)
+        response = await client.get(url, params=params or None)
+        if response.status_code != 200:
+            logger.warning(f"Open Library request failed ({response.status_code}): {url}")
+            return None
+        return response.json()
+
+    work = await get_json(f"https://openlibrary.org/works/{open_library_key}.json")
+    cover_id = next((c for c in (work or {}).get('covers') or [] if c and c > 0), None)
+    if not cover_id:
+        logger.info(f"Work {open_library_key} has no covers, searching by title '{title}'")
+        data = await get_json("https://openlibrary.org/search.json", q=title)
+        docs = (data or {}).get('docs') or []
+        cover_id = docs[0].get('cover_i') if docs else None
+    if not cover_id:
+        return None
+    return f"https://covers.openlibrary.org/b/id/{cover_id}-L.jpg"
+
 async def refresh_book_cover(db: AsyncSession, book_id: int) -> models.Book:
     """Refresh a book's cover image by re-fetching from OpenLibrary."""
     # Get the book
@@ -289,77 +424,27 @@ async def refresh_book_cover(db: AsyncSession, book_id: int) -> models.Book:
         raise ValueError(f"Book {book_id} has no OpenLibrary key")
         
     try:
-        # Search OpenLibrary by title to get cover_i
-        search_url = f"https://openlibrary.org/search.json?q={book.title}"
-        logger.info(f"Searching OpenLibrary: {search_url}")
-        
         async with httpx.AsyncClient() as client:
-            response = await client.get(search_url)
-            if response.status_code != 200:
-                raise ValueError(f"Failed to search OpenLibrary: {response.status_code}")
-                
-            data = response.json()
-            if not data.get('docs'):
-                raise ValueError(f"No search results found for book '{book.title}'")
-                
-            # Get cover_i from first result
-            first_result = data['docs'][0]
-            cover_i = first_result.get('cover_i')
-            if not cover_i:
-                raise ValueError(f"No cover found for book '{book.title}'")
-                
-            # Construct cover URL
-            cover_url = f"https://covers.openlibrary.org/b/id/{cover_i}-L.jpg"
-            logger.info(f"Found cover URL: {cover_url}")
+            cover_url = await find_cover_url(client, book.open_library_key, book.title)
+        if not cover_url:
+            raise ValueError(f"No cover found for book '{book.title}'")
+        logger.info(f"Found cover URL: {cover_url}")
             
-            # Cache the new image
-            cached_url = await image_cache.get_cached_url(cover_url)
-            if not cached_url or cached_url == cover_url:
-                raise ValueError(f"Failed to cache image from {cover_url}")
-                
-            # Update book's cover URLs
-            book.cover_image_url = cached_url
-            book.cover_image_open_library_url = cover_url
-            await db.commit()
+        # Cache the new image
+        cached_url = await image_cache.get_cached_url(cover_url)
+        if not cached_url or cached_url == cover_url:
+            raise ValueError(f"Failed to cache image from {cover_url}")
             
-            return await _process_book_for_response(book)
+        # Update book's cover URLs and placeholder
+        book.cover_image_url = cached_url
+        book.cover_image_open_library_url = cover_url
+        details = await image_cache.get_cover_details(cached_url)
+        if details:
+            _set_cover_details(book, details)
+        await db.commit()
+        
+        return await _process_book_for_response(book)
             
     except Exception as e:
         logger.error(f"Error refreshing cover for book {book_id}: {str(e)}")
         raise ValueError(f"Failed to refresh book cover: {str(e)}")
-
-async def refresh_all_book_covers(db: AsyncSession) -> Dict[str, Any]:
-    """Refresh cover images for all books with OpenLibrary keys."""
-    # Get all books with OpenLibrary keys
-    result = await db.execute(
-        select(models.Book)
-        .where(models.Book.open_library_key.isnot(None))
-    )
-    books = result.scalars().all()
-    
-    total = len(books)
-    success = 0
-    failed = 0
-    errors = []
-    
-    # Process each book
-    for book in books:
-        try:
-            await refresh_book_cover(db, book.id)
-            success += 1
-            logger.info(f"Successfully refreshed cover for book {book.id}")
-        except Exception as e:
-            failed += 1
-            error_msg = f"Failed to refresh cover for book {book.id}: {str(e)}"
-            errors.append(error_msg)
-            logger.error(error_msg)
-            
-        # Sleep briefly to avoid overwhelming the OpenLibrary API
-        await asyncio.sleep(0.5)
-    
-    return {
-        "total_books": total,
-        "successful": success,
-        "failed": failed,
-        "errors": errors
-    }
\ No newline at end of file
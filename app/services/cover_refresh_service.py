@@ -0,0 +1,320 @@
+from sqlalchemy import select, update, func, bindparam, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import datetime, timezone
+from typing import Optional, Dict, Any
+import asyncio
+import logging
+import time
+import httpx
+
+from app.core.config import settings
+from app.core.rate_limit import HostRateLimiter
+from app.db import models
+from app.db.database import SessionLocal, engine
+from app.db.locks import release_session_lock, try_session_lock
+from app.services import book_service
+from app.services.image_cache_service import image_cache, COVER_DETAIL_FIELDS
+
+logger = logging.getLogger(__name__)
+
+# Errors kept in the checkpoint for the status endpoint
+MAX_RECENT_ERRORS = 20
+
+# Keys of the session advisory lock held by the one process running the job
+_LOCK_NAMESPACE = 0x6372
+_LOCK_KEY = 1
+
+# The job's one cover_refresh_checkpoints row
+_CHECKPOINT_ID = 1
+
+def _new_state() -> Dict[str, Any]:
+    return {
+        "status": "idle",
+        "started_at": None,
+        "finished_at": None,
+        "last_book_id": 0,
+        "total": 0,
+        "processed": 0,
+        "updated": 0,
+        "unchanged": 0,
+        "skipped": 0,
+        "failed": 0,
+        "recent_errors": [],
+        "error": None
+    }
+
+class CoverRefreshJob:
+    """
+    Re-fetches the cover of every book from Open Library.
+
+    Books are walked in id order, one batch at a time. Within a batch up to
+    COVER_REFRESH_CONCURRENCY books are refreshed at once, with requests to
+    each host rate limited by a token bucket. Each batch's cover URLs are
+    written in one transaction with the job's position and counters, in the
+    cover_refresh_checkpoints row, so an interrupted job resumes where it
+    left off without redoing or skipping books.
+
+    Only one process runs the job: it holds a session advisory lock for the
+    whole run, and the others leave starting and resuming to it, reporting
+    its progress from the checkpoint.
+    """
+
+    def __init__(self):
+        self.state = _new_state()
+        self._task: Optional[asyncio.Task] = None
+        # Connection holding the advisory lock while this process runs the job
+        self._lock_connection = None
+        # Books processed and start time of the current run, for throughput
+        self._run_processed = 0
+        self._run_started: Optional[float] = None
+
+    async def _load_checkpoint(self) -> Dict[str, Any]:
+        checkpoints = models.CoverRefreshCheckpoint.__table__
+        async with SessionLocal() as db:
+            result = await db.execute(select(checkpoints).where(checkpoints.c.id == _CHECKPOINT_ID))
+            row = result.mappings().first()
+        if row is None:
+            return _new_state()
+        state = _new_state()
+        return {**state, **{field: row[field] for field in state}}
+
+    async def _write_checkpoint(self, db: AsyncSession) -> None:
+        """Upsert the checkpoint row inside the caller's transaction."""
+        state = {field: self.state[field] for field in _new_state()}
+        statement = pg_insert(models.CoverRefreshCheckpoint).values(id=_CHECKPOINT_ID, **state)
+        await db.execute(
+            statement.on_conflict_do_update(
+                index_elements=[models.CoverRefreshCheckpoint.id],
+                set_={**{field: statement.excluded[field] for field in state}, "updated_at": func.now()}
+            )
+        )
+
+    async def _save_checkpoint(self) -> None:
+        async with SessionLocal() as db:
+            await self._write_checkpoint(db)
+            await db.commit()
+
+    def is_running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def _acquire_lock(self) -> bool:
+        """
+        Take the job's advisory lock unless another process holds it, then
+        load the state from the checkpoint its previous holder left.
+        """
+        self._lock_connection = await try_session_lock(engine, _LOCK_NAMESPACE, _LOCK_KEY)
+        if self._lock_connection is None:
+            return False
+        self.state = await self._load_checkpoint()
+        return True
+
+    async def _release_lock(self) -> None:
+        connection, self._lock_connection = self._lock_connection, None
+        await release_session_lock(connection, _LOCK_NAMESPACE, _LOCK_KEY)
+
+    async def _locked_elsewhere(self) -> bool:
+        async with engine.connect() as connection:
+            return await connection.scalar(
+                text(
+                    "SELECT EXISTS (SELECT 1 FROM pg_locks WHERE locktype = 'advisory' AND granted "
+                    "AND classid = :namespace AND objid = :key AND objsubid = 2)"
+                ),
+                {"namespace": _LOCK_NAMESPACE, "key": _LOCK_KEY}
+            )
+
+    def _begin(self, restart: bool = False) -> None:
+        if restart or self.state["status"] != "running":
+            self.state = _new_state()
+            self.state["started_at"] = datetime.now(timezone.utc)
+        self.state["status"] = "running"
+        self._task = asyncio.create_task(self._run())
+
+    async def start(self, restart: bool = False) -> Dict[str, Any]:
+        """
+        Start the job, resuming an interrupted run unless restart is set.
+        Does nothing if it is already running, here or in another process.
+        """
+        if not self.is_running():
+            if await self._acquire_lock():
+                self._begin(restart)
+            else:
+                logger.info("Cover refresh is already running in another process")
+        return await self.get_status()
+
+    async def resume(self) -> None:
+        """Resume a run interrupted by a restart, if there is one and no other process has."""
+        if self.is_running() or not await self._acquire_lock():
+            return
+        if self.state["status"] != "running":
+            await self._release_lock()
+            return
+        logger.info(f"Resuming cover refresh after book {self.state['last_book_id']}")
+        self._begin()
+
+    async def stop(self) -> None:
+        """Stop the job, leaving its checkpoint to resume from."""
+        if self.is_running():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def get_status(self) -> Dict[str, Any]:
+        """
+        Progress counters, throughput of the current run and estimated time
+        remaining. When another process runs the job, its progress as of
+        the last checkpoint, without throughput.
+        """
+        running = self.is_running()
+        if not running:
+            self.state = await self._load_checkpoint()
+            running = await self._locked_elsewhere()
+        throughput = None
+        if self.is_running() and self._run_started is not None:
+            elapsed = time.monotonic() - self._run_started
+            throughput = self._run_processed / elapsed if elapsed > 0 else None
+        remaining = max(self.state["total"] - self.state["processed"], 0)
+        return {
+            **self.state,
+            "running": running,
+            "throughput_per_second": throughput,
+            "eta_seconds": remaining / throughput if throughput else None
+        }
+
+    def _record_error(self, book_id: int, message: str) -> None:
+        logger.error(f"Failed to refresh cover for book {book_id}: {message}")
+        self.state["failed"] += 1
+        errors = self.state["recent_errors"]
+        errors.append({"book_id": book_id, "error": message})
+        del errors[:-MAX_RECENT_ERRORS]
+
+    async def _refresh_one(
+        self,
+        client: httpx.AsyncClient,
+        rate_limiter: HostRateLimiter,
+        slots: asyncio.Semaphore,
+        book: Any
+    ) -> Optional[Dict[str, Any]]:
+        """Find and cache one book's cover. Returns the column values to update, if any."""
+        async with slots:
+            try:
+                cover_url = await book_service.find_cover_url(
+                    client, book.open_library_key, book.title, rate_limiter
+                )
+                if not cover_url:
+                    self.state["skipped"] += 1
+                    return None
+                cached_url = await image_cache.get_cached_url(cover_url, cache_if_missing=False)
+                if cached_url == cover_url:
+                    await rate_limiter.acquire(cover_url)
+                    cached_url = await image_cache.get_cached_url(cover_url)
+                if cached_url == cover_url:
+                    self._record_error(book.id, f"Failed to cache image from {cover_url}")
+                    return None
+                if (cached_url == book.cover_image_url and cover_url == book.cover_image_open_library_url
+                        and book.cover_placeholder):
+                    self.state["unchanged"] += 1
+                    return None
+                details = await image_cache.get_cover_details(cached_url) or {}
+                self.state["updated"] += 1
+                return {
+                    "book_id": book.id,
+                    "cover_url": cached_url,
+                    "open_library_url": cover_url,
+                    **{f"cover_{field}": details.get(field) for field in COVER_DETAIL_FIELDS}
+                }
+            except Exception as e:
+                self._record_error(book.id, str(e))
+                return None
+            finally:
+                self.state["processed"] += 1
+                self._run_processed += 1
+
+    async def _run(self) -> None:
+        self._run_processed = 0
+        self._run_started = time.monotonic()
+        books = models.Book.__table__
+        rate_limiter = HostRateLimiter(settings.COVER_REFRESH_RATE_PER_HOST, settings.COVER_REFRESH_BURST)
+        slots = asyncio.Semaphore(settings.COVER_REFRESH_CONCURRENCY)
+        checkpoint = dict(self.state, recent_errors=list(self.state["recent_errors"]))
+        try:
+            async with SessionLocal() as db:
+                self.state["total"] = await db.scalar(
+                    select(func.count()).select_from(books).where(books.c.open_library_key.isnot(None))
+                )
+            checkpoint["total"] = self.state["total"]
+            # For the status of the other processes
+            await self._save_checkpoint()
+
+            limits = httpx.Limits(max_connections=settings.COVER_REFRESH_CONCURRENCY)
+            async with httpx.AsyncClient(timeout=30.0, limits=limits) as client:
+                while True:
+                    async with SessionLocal() as db:
+                        result = await db.execute(
+                            select(
+                                books.c.id,
+                                books.c.open_library_key,
+                                books.c.title,
+                                books.c.cover_image_url,
+                                books.c.cover_image_open_library_url,
+                                books.c.cover_placeholder
+                            )
+                            .where(
+                                books.c.open_library_key.isnot(None),
+                                books.c.id > self.state["last_book_id"]
+                            )
+                            .order_by(books.c.id)
+                            .limit(settings.COVER_REFRESH_BATCH_SIZE)
+                        )
+                        batch = result.all()
+                    if not batch:
+                        break
+
+                    results = await asyncio.gather(*(
+                        self._refresh_one(client, rate_limiter, slots, book) for book in batch
+                    ))
+                    changes = [change for change in results if change]
+                    self.state["last_book_id"] = batch[-1].id
+                    async with SessionLocal() as db:
+                        if changes:
+                            await db.execute(
+                                update(books)
+                                .where(books.c.id == bindparam("book_id"))
+                                .values(
+                                    cover_image_url=bindparam("cover_url"),
+                                    cover_image_open_library_url=bindparam("open_library_url"),
+                                    **{
+                                        f"cover_{field}": bindparam(f"cover_{field}")
+                                        for field in COVER_DETAIL_FIELDS
+                                    }
+                                ),
+                                changes
+                            )
+                        await self._write_checkpoint(db)
+                        await db.commit()
+                    checkpoint = dict(self.state, recent_errors=list(self.state["recent_errors"]))
+
+            self.state["status"] = "completed"
+            self.state["finished_at"] = datetime.now(timezone.utc)
+            logger.info(f"Cover refresh completed: {self.state['processed']} books processed")
+        except asyncio.CancelledError:
+            # Roll back to the last checkpoint so the interrupted batch is redone on resume
+            self.state = checkpoint
+            raise
+        except Exception as e:
+            logger.error(f"Cover refresh failed: {str(e)}")
+            self.state = dict(
+                checkpoint,
+                status="failed",
+                error=str(e),
+                finished_at=datetime.now(timezone.utc)
+            )
+        finally:
+            try:
+                await self._save_checkpoint()
+            finally:
+                await self._release_lock()
+
+cover_refresh_job = CoverRefreshJob()
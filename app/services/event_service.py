@@ -0,0 +1,208 @@
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import text
+from datetime import date, datetime, timedelta, timezone
+from typing import List, Optional, Set, Tuple
+import asyncio
+import json
+import logging
+
+from app.core.config import settings
+from app.db import models, schemas
+from app.db.database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+EVENTS_TABLE = models.AnalyticsEvent.__tablename__
+# Column order of the buffered records, as copied into the table
+EVENT_COLUMNS = ("occurred_at", "received_at", "event_type", "book_id", "session_id", "metadata")
+# Client timestamps further from the server's clock than this are replaced
+# by the time the event was received, so every event lands in the current
+# (or, just after midnight on the 1st, the previous) month's partition
+MAX_EVENT_AGE = timedelta(days=1)
+MAX_EVENT_SKEW = timedelta(minutes=5)
+# Months ahead of the current one that always have a partition
+PARTITION_MONTHS_AHEAD = 1
+
+EventRecord = Tuple[datetime, datetime, str, Optional[int], Optional[str], Optional[str]]
+
+def month_start(day: date) -> date:
+    return day.replace(day=1)
+
+def next_month(month: date) -> date:
+    return (month.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+def partition_name(month: date) -> str:
+    return f"{EVENTS_TABLE}_{month:%Y_%m}"
+
+def partition_months(today: date, months_ahead: int = PARTITION_MONTHS_AHEAD) -> List[date]:
+    """Months that need a partition today: from the oldest accepted event's to months_ahead ahead."""
+    month = month_start(today - MAX_EVENT_AGE)
+    last = month_start(today)
+    for _ in range(months_ahead):
+        last = next_month(last)
+    months = [month]
+    while month < last:
+        month = next_month(month)
+        months.append(month)
+    return months
+
+async def ensure_partitions(db: AsyncSession, today: date) -> List[str]:
+    """
+    Create any missing partitions among partition_months(today), inside the
+    caller's transaction. Returns their names.
+    """
+    # Serialise with other processes doing the same at startup
+    await db.execute(text("SELECT pg_advisory_xact_lock(hashtext(:name))"), {"name": EVENTS_TABLE})
+    names = []
+    for month in partition_months(today):
+        name = partition_name(month)
+        # Bounds are UTC midnights, whatever the server's time zone
+        await db.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {EVENTS_TABLE} "
+            f"FOR VALUES FROM ('{month.isoformat()} 00:00:00+00') TO ('{next_month(month).isoformat()} 00:00:00+00')"
+        ))
+        names.append(name)
+    return names
+
+async def list_partitions(db: AsyncSession) -> List[Tuple[str, date]]:
+    """The attached monthly partitions and their months, oldest first."""
+    result = await db.execute(text(
+        "SELECT child.relname FROM pg_inherits "
+        "JOIN pg_class AS parent ON parent.oid = pg_inherits.inhparent "
+        "JOIN pg_class AS child ON child.oid = pg_inherits.inhrelid "
+        "WHERE parent.relname = :table"
+    ), {"table": EVENTS_TABLE})
+    partitions = []
+    prefix = f"{EVENTS_TABLE}_"
+    for name in result.scalars():
+        try:
+            month = datetime.strptime(name[len(prefix):], "%Y_%m").date()
+        except ValueError:
+            continue  # Not one of ours
+        partitions.append((name, month))
+    return sorted(partitions, key=lambda partition: partition[1])
+
+async def detach_partitions_before(db: AsyncSession, cutoff: date, drop: bool = False) -> List[str]:
+    """
+    Detach the partitions of months that ended on or before cutoff, inside
+    the caller's transaction. Detached partitions are plain tables that can
+    be archived, or dropped with drop. Returns their names.
+    """
+    detached = []
+    for name, month in await list_partitions(db):
+        if next_month(month) > cutoff:
+            break
+        await db.execute(text(f"ALTER TABLE {EVENTS_TABLE} DETACH PARTITION {name}"))
+        if drop:
+            await db.execute(text(f"DROP TABLE {name}"))
+        detached.append(name)
+    return detached
+
+class EventBuffer:
+    """
+    Buffer of analytics events, bulk loaded into the event log with COPY
+    every EVENT_FLUSH_INTERVAL seconds and on shutdown. At most
+    EVENT_BUFFER_MAX_EVENTS are held; while the database is unreachable,
+    newer events are dropped and counted rather than growing without bound.
+    """
+
+    def __init__(self):
+        self._records: List[EventRecord] = []
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._flush_lock_loop: Optional[asyncio.AbstractEventLoop] = None
+        # Months whose partitions are known to exist
+        self._partitioned_months: Set[date] = set()
+        self.stats = {"accepted": 0, "dropped": 0, "flushes": 0, "flushed_events": 0, "flush_errors": 0}
+
+    def _to_record(self, event: schemas.EventIn, received_at: datetime) -> Optional[EventRecord]:
+        metadata = None
+        if event.metadata is not None:
+            metadata = json.dumps(event.metadata, separators=(",", ":"), default=str)
+            if len(metadata) > settings.EVENT_METADATA_MAX_BYTES:
+                return None
+        occurred_at = event.occurred_at
+        if occurred_at is not None and occurred_at.tzinfo is None:
+            occurred_at = occurred_at.replace(tzinfo=timezone.utc)
+        if occurred_at is None or not (
+            received_at - MAX_EVENT_AGE <= occurred_at <= received_at + MAX_EVENT_SKEW
+        ):
+            occurred_at = received_at
+        return (occurred_at, received_at, event.event_type, event.book_id, event.session_id, metadata)
+
+    def add(self, events: List[schemas.EventIn], received_at: Optional[datetime] = None) -> Tuple[int, int]:
+        """Buffer a batch of events. Returns how many were accepted and dropped."""
+        received_at = received_at or datetime.now(timezone.utc)
+        accepted = 0
+        for event in events:
+            record = self._to_record(event, received_at)
+            if record is None or len(self._records) >= settings.EVENT_BUFFER_MAX_EVENTS:
+                continue
+            self._records.append(record)
+            accepted += 1
+        dropped = len(events) - accepted
+        self.stats["accepted"] += accepted
+        self.stats["dropped"] += dropped
+        return accepted, dropped
+
+    def pending(self) -> int:
+        return len(self._records)
+
+    def _get_flush_lock(self) -> asyncio.Lock:
+        loop = asyncio.get_running_loop()
+        if self._flush_lock is None or self._flush_lock_loop is not loop:
+            self._flush_lock = asyncio.Lock()
+            self._flush_lock_loop = loop
+        return self._flush_lock
+
+    async def ensure_partitions(self, today: Optional[date] = None) -> None:
+        """Create the partitions events can currently land in, unless already done."""
+        today = today or datetime.now(timezone.utc).date()
+        months = partition_months(today)
+        if self._partitioned_months.issuperset(months):
+            return
+        async with SessionLocal() as db:
+            async with db.begin():
+                await ensure_partitions(db, today)
+        self._partitioned_months.update(months)
+
+    async def flush(self) -> int:
+        """COPY the buffered events into the event log. Returns the number written."""
+        async with self._get_flush_lock():
+            if not self._records:
+                return 0
+            records, self._records = self._records, []
+            try:
+                await self.ensure_partitions()
+                async with SessionLocal() as db:
+                    async with db.begin():
+                        await self._copy(db, records)
+            except Exception as e:
+                # Keep the events for the next flush, within the buffer limit
+                room = max(settings.EVENT_BUFFER_MAX_EVENTS - len(self._records), 0)
+                self._records[:0] = records[-room:] if room else []
+                self.stats["dropped"] += len(records) - min(room, len(records))
+                self.stats["flush_errors"] += 1
+                logger.error(f"Error flushing {len(records)} analytics events: {str(e)}")
+                raise
+            self.stats["flushes"] += 1
+            self.stats["flushed_events"] += len(records)
+            return len(records)
+
+    async def _copy(self, db: AsyncSession, records: List[EventRecord]) -> None:
+        """Bulk load records over the session's asyncpg connection."""
+        connection = await db.connection()
+        raw = await connection.get_raw_connection()
+        await raw.driver_connection.copy_records_to_table(
+            EVENTS_TABLE, records=records, columns=EVENT_COLUMNS
+        )
+
+    async def run_flusher(self) -> None:
+        """Flush every EVENT_FLUSH_INTERVAL seconds, forever."""
+        while True:
+            await asyncio.sleep(settings.EVENT_FLUSH_INTERVAL)
+            try:
+                await self.flush()
+            except Exception:
+                pass  # Logged by flush; the events are retried next time
+
+event_buffer = EventBuffer()
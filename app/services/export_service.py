@@ -0,0 +1,168 @@
+from sqlalchemy import select, func
+from sqlalchemy.sql import Select
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Any, AsyncIterator, List, Optional, Sequence, Tuple
+import asyncio
+import csv
+import io
+import json
+import logging
+import zlib
+
+from app.core.config import settings
+from app.db import models
+from app.db.database import ReadSessionLocal
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+_encode_json = json.JSONEncoder(separators=(",", ":"), default=str).encode
+
+# Dates and times are formatted by the database: building datetime objects
+# and calling isoformat() on them was most of the export's CPU time
+def _iso_date(column):
+    return func.to_char(column, "YYYY-MM-DD").label(column.name)
+
+def _iso_timestamp(column):
+    return func.to_char(func.timezone("UTC", column), 'YYYY-MM-DD"T"HH24:MI:SS.US"Z"').label(column.name)
+
+def _visits_query(start: Optional[date], end: Optional[date], book_ids: Optional[List[int]]) -> Select:
+    visits, books = models.Visit, models.Book
+    query = (
+        select(
+            visits.book_id,
+            books.title,
+            books.open_library_key,
+            _iso_date(visits.visit_date),
+            visits.visit_count,
+            _iso_timestamp(visits.created_at),
+            _iso_timestamp(visits.updated_at)
+        )
+        .join(books, books.id == visits.book_id)
+        .order_by(visits.visit_date, visits.book_id)
+    )
+    if start is not None:
+        query = query.where(visits.visit_date >= start)
+    if end is not None:
+        query = query.where(visits.visit_date <= end)
+    if book_ids:
+        query = query.where(visits.book_id.in_(book_ids))
+    return query
+
+def _events_query(start: Optional[date], end: Optional[date], book_ids: Optional[List[int]]) -> Select:
+    events = models.AnalyticsEvent
+    query = select(
+        _iso_timestamp(events.occurred_at),
+        _iso_timestamp(events.received_at),
+        events.event_type,
+        events.book_id,
+        events.session_id,
+        events.event_metadata.label("metadata")
+    ).order_by(events.occurred_at, events.id)
+    # Whole UTC days, which lets the planner skip the partitions outside them
+    if start is not None:
+        query = query.where(events.occurred_at >= datetime.combine(start, time(), timezone.utc))
+    if end is not None:
+        query = query.where(events.occurred_at < datetime.combine(end + timedelta(days=1), time(), timezone.utc))
+    if book_ids:
+        query = query.where(events.book_id.in_(book_ids))
+    return query
+
+EXPORT_DATASETS = {"visits": _visits_query, "events": _events_query}
+
+def export_query(dataset: str, start: Optional[date] = None, end: Optional[date] = None,
+                 book_ids: Optional[List[int]] = None) -> Select:
+    """The query of an export of dataset, with start and end dates both inclusive."""
+    return EXPORT_DATASETS[dataset](start, end, book_ids)
+
+def _csv_value(value: Any) -> Any:
+    # Event metadata goes into a single JSON encoded field
+    if isinstance(value, (dict, list)):
+        return _encode_json(value)
+    return value
+
+def encode_batch(columns: Sequence[str], rows: Sequence[Tuple], export_format: str) -> bytes:
+    """Encode rows as NDJSON lines or CSV records."""
+    if export_format == "ndjson":
+        return "".join(
+            _encode_json(dict(zip(columns, row))) + "\n"
+            for row in rows
+        ).encode()
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows([_csv_value(value) for value in row] for row in rows)
+    return buffer.getvalue().encode()
+
+async def encode_rows(
+    columns: Sequence[str],
+    batches: AsyncIterator[Sequence[Tuple]],
+    export_format: str,
+    compress: bool
+) -> AsyncIterator[bytes]:
+    """
+    Encode batches of rows as they arrive, gzipped on the fly when compress
+    is set. Holds one batch and the compressor's window at a time. Batches
+    are encoded in a thread, so the event loop keeps serving requests.
+    """
+    # wbits 31 writes a gzip header and trailer
+    compressor = zlib.compressobj(settings.EXPORT_GZIP_LEVEL, zlib.DEFLATED, 31) if compress else None
+
+    def output(rows: Sequence[Tuple], batch_format: str) -> bytes:
+        data = encode_batch(columns, rows, batch_format)
+        return compressor.compress(data) if compressor else data
+
+    if export_format == "csv":
+        header = output([tuple(columns)], "csv")
+        if header:
+            yield header
+    async for rows in batches:
+        chunk = await asyncio.to_thread(output, rows, export_format)
+        if chunk:
+            yield chunk
+    if compressor:
+        yield compressor.flush()
+
+async def stream_export(
+    dataset: str,
+    export_format: str,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    book_ids: Optional[List[int]] = None,
+    compress: bool = True
+) -> AsyncIterator[bytes]:
+    """
+    Export a dataset as a stream of NDJSON or CSV chunks, read through a
+    server-side cursor EXPORT_BATCH_ROWS rows at a time.
+
+    Runs in its own read-only session, on a replica when there is a healthy
+    one, since the stream outlives the request handler; the cursor holds a
+    READ ONLY transaction open until the stream ends. The response has
+    already started when the query runs, so an error ends the stream early;
+    a gzipped export then lacks its trailer.
+    """
+    query = export_query(dataset, start, end, book_ids)
+    columns = [column.name for column in query.selected_columns]
+    exported = 0
+    async with ReadSessionLocal() as db:
+        result = await db.stream(query.execution_options(yield_per=settings.EXPORT_BATCH_ROWS))
+
+        async def batches() -> AsyncIterator[Sequence[Tuple]]:
+            nonlocal exported
+            async for partition in result.partitions():
+                exported += len(partition)
+                yield partition
+
+        try:
+            async for chunk in encode_rows(columns, batches(), export_format, compress):
+                yield chunk
+        except Exception as e:
+            logger.error(f"Export of {dataset} failed after {exported} rows: {str(e)}")
+            raise
+        finally:
+            await result.close()
+    logger.info(f"Exported {exported} {dataset} rows as {export_format}")
+
+def export_filename(dataset: str, export_format: str, start: Optional[date], end: Optional[date],
+                    compress: bool) -> str:
+    name = "-".join([dataset, *(day.isoformat() for day in (start, end) if day is not None)])
+    return f"{name}.{export_format}{'.gz' if compress else ''}"
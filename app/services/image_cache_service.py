@@ -5,13 +5,58 @@ import aiohttp
 from pathlib import Path
 from PIL import Image
 from io import BytesIO
-from typing import Optional
+from typing import Optional, Dict, Tuple, Callable, Any, List, Set, Awaitable, AsyncIterator
+from urllib.parse import urlsplit
+from yarl import URL
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+import fcntl
 import logging
 import ssl
 import asyncio
+import uuid
+import re
+import struct
+import time
+import json
+import base64
+
+from app.core.config import settings
+
+try:
+    import pillow_avif  # noqa: F401 - registers the AVIF codec with Pillow
+    AVIF_SUPPORTED = True
+except ImportError:
+    AVIF_SUPPORTED = False
 
 logger = logging.getLogger(__name__)
 
+# Bounding boxes (2x the largest rendered size) for derived cover sizes.
+# "L" is the downloaded original.
+COVER_SIZES = {"S": (80, 120), "M": (360, 560)}
+COVER_SIZE_NAMES = ("S", "M", "L")
+# Bounding box of the inline placeholder image
+PLACEHOLDER_SIZE = (12, 18)
+# Per-cover details stored in the manifest and on book rows
+COVER_DETAIL_FIELDS = ("placeholder", "color", "width", "height")
+
+_PIL_FORMATS = {"jpg": "JPEG", "webp": "WEBP", "avif": "AVIF"}
+_MEDIA_TYPES = {"jpg": "image/jpeg", "webp": "image/webp", "avif": "image/avif"}
+# Persisted access index entry: raw MD5 cache key, last access time, bytes on disk
+_INDEX_ENTRY = struct.Struct("<16sdq")
+_INDEX_FILENAME = ".access-index"
+# Append-only JSON lines manifest: cache key -> source URL, content type,
+# size and fetch time. Deletions are recorded as tombstones until compaction.
+_MANIFEST_FILENAME = ".manifest.jsonl"
+# flock files shared by the workers: appends to the manifest hold a shared
+# lock and its rewrites an exclusive one; sweeps run one at a time
+_MANIFEST_LOCK_FILENAME = ".manifest.lock"
+_SWEEP_LOCK_FILENAME = ".sweep.lock"
+_REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+_MAX_REDIRECTS = 5
+_STREAM_CHUNK_SIZE = 64 * 1024
+_VARIANT_NAME = re.compile(r"^(?P<key>[0-9a-f]{32})(?:-(?P<size>[SML]))?\.(?P<fmt>jpg|webp|avif)$")
+
 def get_cache_dir() -> Path:
     """Get the cache directory path, ensuring it exists."""
     # Get the base directory (project root)
@@ -23,6 +68,91 @@ def get_cache_dir() -> Path:
     
     return cache_dir
 
+def shard_dir(cache_dir: Path, key: str) -> Path:
+    """Directory holding a cover and its variants: two levels of key prefixes."""
+    return cache_dir / key[:2] / key[2:4]
+
+def cache_url(key: str, size: str = "L", fmt: str = "jpg") -> str:
+    """Public URL of a cached cover variant."""
+    suffix = "" if size == "L" else f"-{size}"
+    return f"/cache/images/{key[:2]}/{key[2:4]}/{key}{suffix}.{fmt}"
+
+def variant_path(original: Path, size: str = "L", fmt: str = "jpg") -> Path:
+    """Path of a size/format variant stored next to an original cover."""
+    stem = original.stem if size == "L" else f"{original.stem}-{size}"
+    return original.with_name(f"{stem}.{fmt}")
+
+def _save_atomic(img: Image.Image, path: Path, fmt: str) -> None:
+    tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        img.save(tmp_path, _PIL_FORMATS[fmt], quality=80 if fmt != "jpg" else 85, optimize=fmt == "jpg")
+        os.replace(tmp_path, path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+@contextmanager
+def _flock(path: Path, operation: int):
+    """Hold an flock on path, created if missing, for the block. Blocks until granted."""
+    with open(path, "a") as f:
+        fcntl.flock(f, operation)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def build_cover_variants(original_path: str, formats: Tuple[str, ...], data: Optional[bytes] = None,
+                         source_path: Optional[str] = None) -> List[str]:
+    """
+    Decode a cover once and write its S/M/L variants in every format.
+    Reads the original from disk (or source_path) unless its bytes are
+    passed in. The original itself (L, jpg) is left to the caller. Runs in
+    the image worker pool.
+    """
+    original = Path(original_path)
+    img = Image.open(BytesIO(data) if data is not None else (source_path or original))
+    img.load()
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+
+    written = []
+    for size in COVER_SIZE_NAMES:
+        resized = img
+        if size in COVER_SIZES:
+            resized = img.copy()
+            resized.thumbnail(COVER_SIZES[size], Image.LANCZOS)
+        for fmt in ("jpg",) + tuple(formats):
+            if size == "L" and fmt == "jpg":
+                continue
+            path = variant_path(original, size, fmt)
+            _save_atomic(resized, path, fmt)
+            written.append(str(path))
+    return written
+
+def describe_cover(path: str) -> Dict[str, Any]:
+    """
+    Intrinsic size, dominant colour and a tiny inline WebP placeholder
+    (a few hundred bytes as a data URI) of a cover. JPEGs are decoded at
+    reduced scale, so this is cheap. Runs in the image worker pool.
+    """
+    img = Image.open(path)
+    width, height = img.size
+    img.draft("RGB", (PLACEHOLDER_SIZE[0] * 8, PLACEHOLDER_SIZE[1] * 8))
+    img = img.convert("RGB")
+    img.thumbnail(PLACEHOLDER_SIZE, Image.LANCZOS)
+
+    buffer = BytesIO()
+    img.save(buffer, "WEBP", quality=40)
+    palette = img.quantize(colors=4)
+    _, index = max(palette.getcolors())
+    r, g, b = palette.getpalette()[index * 3:index * 3 + 3]
+    return {
+        "placeholder": "data:image/webp;base64," + base64.b64encode(buffer.getvalue()).decode(),
+        "color": f"#{r:02x}{g:02x}{b:02x}",
+        "width": width,
+        "height": height
+    }
+
 class ImageCache:
     def __init__(self, cache_dir: Optional[Path] = None):
         self.cache_dir = cache_dir or get_cache_dir()
@@ -31,12 +161,363 @@ class ImageCache:
         self.ssl_context = ssl.create_default_context()
         self.ssl_context.check_hostname = False
         self.ssl_context.verify_mode = ssl.CERT_NONE
+        # Shared HTTP session, created lazily on the running event loop
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._session_loop: Optional[asyncio.AbstractEventLoop] = None
+        # In-flight downloads keyed by source URL
+        self._downloads: Dict[str, asyncio.Task] = {}
+        # In-flight variant builds for already cached originals
+        self._variant_jobs: Dict[Path, asyncio.Task] = {}
+        # Extra encodings generated for every size, besides JPEG
+        self.formats = tuple(
+            fmt for fmt in (f.strip() for f in settings.IMAGE_CACHE_FORMATS.split(","))
+            if fmt == "webp" or (fmt == "avif" and AVIF_SUPPORTED)
+        )
+        # Worker pool for CPU-bound image work, bounded by a semaphore
+        self._executor: Optional[Executor] = None
+        self._jobs: Optional[asyncio.Semaphore] = None
+        self._jobs_loop: Optional[asyncio.AbstractEventLoop] = None
+        # Manifest of cached covers, also the in-memory existence index
+        self._manifest: Dict[str, Dict[str, Any]] = {}
+        # Negative cache: source URL -> time after which a failed download may be retried
+        self._failures: Dict[str, float] = {}
+        # LRU access index: cache key -> [last access time, bytes on disk].
+        # Size -1 means not measured yet; the sweeper fills it in.
+        self._index: Dict[str, List[float]] = {}
+        self.stats = {"hits": 0, "misses": 0, "negative_hits": 0, "evictions": 0, "evicted_bytes": 0}
+        self._load_manifest()
+        self._load_index()
         logger.info(f"Initialized image cache at {self.cache_dir}")
 
+    def _get_session(self) -> aiohttp.ClientSession:
+        """Get the pooled HTTP session, creating it on first use."""
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._session_loop is not loop:
+            connector = aiohttp.TCPConnector(
+                ssl=self.ssl_context,
+                limit=settings.IMAGE_CACHE_MAX_CONNECTIONS,
+                limit_per_host=settings.IMAGE_CACHE_MAX_CONNECTIONS_PER_HOST,
+                ttl_dns_cache=300
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=settings.IMAGE_CACHE_DOWNLOAD_TIMEOUT)
+            )
+            self._session_loop = loop
+        return self._session
+
+    def _get_executor(self) -> Executor:
+        """Get the image worker pool, creating it on first use."""
+        if self._executor is None:
+            workers = settings.IMAGE_WORKERS or os.cpu_count() or 1
+            if settings.IMAGE_WORKER_POOL == "process":
+                self._executor = ProcessPoolExecutor(max_workers=workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="image-worker")
+        return self._executor
+
+    async def run_image_job(self, func: Callable[..., Any], *args: Any) -> Any:
+        """
+        Run CPU-bound image work in the worker pool.
+
+        At most IMAGE_WORKER_MAX_PENDING jobs are queued or running at once;
+        further callers wait here instead of piling work onto the pool.
+        """
+        loop = asyncio.get_running_loop()
+        if self._jobs is None or self._jobs_loop is not loop:
+            self._jobs = asyncio.Semaphore(settings.IMAGE_WORKER_MAX_PENDING)
+            self._jobs_loop = loop
+        async with self._jobs:
+            return await loop.run_in_executor(self._get_executor(), func, *args)
+
+    async def close(self) -> None:
+        """Persist the access index, close the pooled HTTP session and shut down the worker pool."""
+        await asyncio.to_thread(self._save_index, list(self._index.items()))
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+        self._session_loop = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def _load_index(self) -> None:
+        """Load the persisted access index, if any."""
+        index_path = self.cache_dir / _INDEX_FILENAME
+        try:
+            data = index_path.read_bytes()
+        except FileNotFoundError:
+            return
+        for raw_key, accessed_at, size in _INDEX_ENTRY.iter_unpack(data[: len(data) - len(data) % _INDEX_ENTRY.size]):
+            self._index[raw_key.hex()] = [accessed_at, size]
+
+    def _save_index(self, entries: List[Tuple[str, List[float]]]) -> None:
+        """Atomically write the access index. Runs in a thread."""
+        index_path = self.cache_dir / _INDEX_FILENAME
+        tmp_path = index_path.with_name(f"{_INDEX_FILENAME}.{uuid.uuid4().hex}.tmp")
+        with open(tmp_path, "wb") as f:
+            for key, (accessed_at, size) in entries:
+                f.write(_INDEX_ENTRY.pack(bytes.fromhex(key), accessed_at, int(size)))
+        os.replace(tmp_path, index_path)
+
+    def _read_manifest(self) -> Optional[Dict[str, Dict[str, Any]]]:
+        """Replay the manifest file, or return None if there is none."""
+        manifest_path = self.cache_dir / _MANIFEST_FILENAME
+        try:
+            with open(manifest_path, "r") as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return None
+        manifest = {}
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # Torn write from a crash
+            key = entry.pop("key", None)
+            if not key:
+                continue
+            if entry.get("deleted"):
+                manifest.pop(key, None)
+            else:
+                manifest[key] = entry
+        return manifest
+
+    def _write_manifest(self, manifest: Dict[str, Dict[str, Any]]) -> None:
+        """Atomically rewrite the manifest without tombstones."""
+        manifest_path = self.cache_dir / _MANIFEST_FILENAME
+        tmp_path = manifest_path.with_name(f"{_MANIFEST_FILENAME}.{uuid.uuid4().hex}.tmp")
+        with open(tmp_path, "w") as f:
+            for key, entry in manifest.items():
+                f.write(json.dumps({"key": key, **entry}) + "\n")
+        os.replace(tmp_path, manifest_path)
+
+    def _load_manifest(self) -> None:
+        """
+        Load the manifest into memory. Caches that predate the manifest are
+        scanned once; their entries have no source URL.
+        """
+        manifest = self._read_manifest()
+        if manifest is None:
+            manifest = {
+                key: {"url": None, "content_type": "image/jpeg", "size": -1, "fetched_at": mtime}
+                for key, (mtime, _) in self._scan_cache_dir().items()
+            }
+            if manifest:
+                with _flock(self.cache_dir / _MANIFEST_LOCK_FILENAME, fcntl.LOCK_EX):
+                    self._write_manifest(manifest)
+        self._manifest = manifest
+
+    def _compact_manifest(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Merge entries appended by every worker and drop tombstones. Runs in a
+        thread. Appends wait while the manifest is read and replaced, so
+        none is lost to the rewrite.
+        """
+        with _flock(self.cache_dir / _MANIFEST_LOCK_FILENAME, fcntl.LOCK_EX):
+            manifest = self._read_manifest() or {}
+            self._write_manifest(manifest)
+        return manifest
+
+    def _append_line(self, line: str) -> None:
+        """Append a line to the manifest. Runs in a thread."""
+        with _flock(self.cache_dir / _MANIFEST_LOCK_FILENAME, fcntl.LOCK_SH):
+            with open(self.cache_dir / _MANIFEST_FILENAME, "a") as f:
+                f.write(line)
+
+    async def _append_manifest(self, key: str, entry: Dict[str, Any]) -> None:
+        await asyncio.to_thread(self._append_line, json.dumps({"key": key, **entry}) + "\n")
+
+    async def _record(self, key: str, url: str, content_type: str, size: int, sha256: Optional[str] = None,
+                      details: Optional[Dict[str, Any]] = None) -> None:
+        """Add a freshly downloaded cover to the manifest."""
+        entry = {"url": url, "content_type": content_type, "size": size, "fetched_at": time.time(), "sha256": sha256}
+        entry.update(details or {})
+        self._manifest[key] = entry
+        await self._append_manifest(key, entry)
+
+    async def _forget(self, key: str) -> None:
+        """Remove a cover from the manifest."""
+        if self._manifest.pop(key, None) is not None:
+            await self._append_manifest(key, {"deleted": True})
+
+    def _scan_cache_dir(self) -> Dict[str, List[float]]:
+        """Build index entries from the files on disk. Runs in a thread."""
+        entries: Dict[str, List[float]] = {}
+        for dirpath, dirnames, filenames in os.walk(self.cache_dir):
+            for name in filenames:
+                match = _VARIANT_NAME.match(name)
+                if not match:
+                    continue
+                stat = os.stat(os.path.join(dirpath, name))
+                accessed_at, size = entries.setdefault(match.group("key"), [0.0, 0])
+                entries[match.group("key")] = [max(accessed_at, stat.st_mtime), size + stat.st_size]
+        return entries
+
+    def shard_legacy_files(self) -> int:
+        """
+        Move covers left in the cache root by the old flat layout into their
+        shard directories. Returns the number of files moved.
+        """
+        with os.scandir(self.cache_dir) as it:
+            names = [entry.name for entry in it if entry.is_file() and _VARIANT_NAME.match(entry.name)]
+        for name in names:
+            target_dir = shard_dir(self.cache_dir, name[:32])
+            target_dir.mkdir(parents=True, exist_ok=True)
+            os.replace(self.cache_dir / name, target_dir / name)
+        return len(names)
+
+    def _original_path(self, key: str) -> Path:
+        """
+        Path of a cached original cover: in its shard directory, or in the
+        cache root for a cover shard_legacy_files has not moved yet.
+        """
+        path = shard_dir(self.cache_dir, key) / f"{key}.jpg"
+        if not path.exists():
+            legacy_path = self.cache_dir / path.name
+            if legacy_path.exists():
+                return legacy_path
+        return path
+
+    def _variant_paths(self, key: str) -> List[Path]:
+        """Every file a cover may occupy on disk: the original and its variants."""
+        original = self._original_path(key)
+        return [
+            variant_path(original, size, fmt)
+            for size in COVER_SIZE_NAMES
+            for fmt in ("jpg", "webp", "avif")
+        ]
+
+    def _measure(self, keys: List[str]) -> Dict[str, int]:
+        """Total bytes on disk per cache key. Runs in a thread."""
+        sizes = {}
+        for key in keys:
+            sizes[key] = sum(path.stat().st_size for path in self._variant_paths(key) if path.exists())
+        return sizes
+
+    def _delete(self, keys: List[str]) -> None:
+        """Remove a cover and all its variants. Runs in a thread."""
+        for key in keys:
+            for path in self._variant_paths(key):
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+
+    def _touch(self, key: Optional[str], size: Optional[int] = None) -> None:
+        """Record an access to a cached cover."""
+        if not key:
+            return
+        entry = self._index.get(key)
+        if entry is None:
+            self._index[key] = [time.time(), size if size is not None else -1]
+        else:
+            entry[0] = time.time()
+            if size is not None:
+                entry[1] = size
+
+    def get_cache_key(self, url: Optional[str]) -> Optional[str]:
+        """Cache key of a cover: the MD5 of its source URL, or the key in a cached URL."""
+        if not url:
+            return None
+        if url.startswith('/cache/images/'):
+            match = _VARIANT_NAME.match(Path(url).name)
+            return match.group("key") if match else None
+        return hashlib.md5(url.encode()).hexdigest()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Cache size, eviction and hit-ratio metrics."""
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            "entries": len(self._index),
+            "size_bytes": sum(size for _, size in self._index.values() if size > 0),
+            "budget_bytes": settings.IMAGE_CACHE_MAX_BYTES,
+            **self.stats,
+            "hit_ratio": self.stats["hits"] / lookups if lookups else None
+        }
+
+    async def sweep(self, pinned_keys: Set[str]) -> int:
+        """
+        Evict least-recently-used covers until the cache fits its byte budget.
+        Covers in pinned_keys (referenced by books) are never evicted.
+        Returns the number of bytes freed. Waits for any other worker's
+        sweep to finish first.
+        """
+        sweep_lock = await asyncio.to_thread(self._lock_sweep)
+        try:
+            return await self._sweep(pinned_keys)
+        finally:
+            sweep_lock.close()
+
+    def _lock_sweep(self):
+        """Open and exclusively flock the sweep lock file; closing it releases the lock. Runs in a thread."""
+        f = open(self.cache_dir / _SWEEP_LOCK_FILENAME, "a")
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        except BaseException:
+            f.close()
+            raise
+        return f
+
+    async def _sweep(self, pinned_keys: Set[str]) -> int:
+        # Pick up covers other workers added and drop ones they evicted,
+        # keeping any recorded here while the manifest was being rewritten
+        started = time.time()
+        manifest = await asyncio.to_thread(self._compact_manifest)
+        for key, entry in self._manifest.items():
+            if key not in manifest and entry["fetched_at"] >= started:
+                manifest[key] = entry
+                await self._append_manifest(key, entry)
+        self._manifest = manifest
+        for key, entry in self._manifest.items():
+            self._index.setdefault(key, [entry["fetched_at"], -1])
+        for key in [key for key in self._index if key not in self._manifest]:
+            del self._index[key]
+        now = time.time()
+        self._failures = {url: retry_at for url, retry_at in self._failures.items() if retry_at > now}
+
+        unmeasured = [key for key, (_, size) in self._index.items() if size < 0]
+        if unmeasured:
+            for key, size in (await asyncio.to_thread(self._measure, unmeasured)).items():
+                if key in self._index:
+                    self._index[key][1] = size
+
+        total = sum(size for _, size in self._index.values() if size > 0)
+        freed = 0
+        if total > settings.IMAGE_CACHE_MAX_BYTES:
+            target = settings.IMAGE_CACHE_MAX_BYTES * settings.IMAGE_CACHE_SWEEP_TARGET
+            victims = []
+            for accessed_at, key in sorted((entry[0], key) for key, entry in self._index.items()):
+                if total - freed <= target:
+                    break
+                if key in pinned_keys:
+                    continue
+                victims.append(key)
+                freed += max(self._index[key][1], 0)
+            await asyncio.to_thread(self._delete, victims)
+            for key in victims:
+                self._index.pop(key, None)
+                await self._forget(key)
+            self.stats["evictions"] += len(victims)
+            self.stats["evicted_bytes"] += freed
+            logger.info(f"Evicted {len(victims)} covers ({freed} bytes) from the image cache")
+
+        await asyncio.to_thread(self._save_index, list(self._index.items()))
+        return freed
+
+    async def run_sweeper(self, load_pinned_keys: Callable[[], Awaitable[Set[str]]]) -> None:
+        """Sweep the cache every IMAGE_CACHE_SWEEP_INTERVAL seconds, forever."""
+        while True:
+            await asyncio.sleep(settings.IMAGE_CACHE_SWEEP_INTERVAL)
+            try:
+                await self.sweep(await load_pinned_keys())
+            except Exception as e:
+                logger.error(f"Error sweeping image cache: {str(e)}")
+
     def _get_cache_path(self, url: str) -> Path:
         """Generate a cache file path from URL using MD5 hash"""
         url_hash = hashlib.md5(url.encode()).hexdigest()
-        return self.cache_dir / f"{url_hash}.jpg"
+        return self._original_path(url_hash)
 
     def _get_openlibrary_url(self, book_key: str) -> str:
         """Generate OpenLibrary URL from book key"""
@@ -48,7 +529,9 @@ class ImageCache:
         This doesn't download the image - use ensure_cached() for that.
         """
         cache_path = self._get_cache_path(url)
-        if cache_path.exists():
+        if cache_path.stem in self._manifest:
+            self.stats["hits"] += 1
+            self._touch(cache_path.stem)
             return str(cache_path)
         return None
 
@@ -60,71 +543,363 @@ class ImageCache:
         if not url:
             return None
             
-        # If it's a cached URL, extract the book key and get the OpenLibrary URL
+        # If it's a cached URL, look up the source URL it was downloaded from
         if url.startswith('/cache/images/'):
-            # Try to extract book key from URL pattern in database
-            try:
-                filename = Path(url).name
-                book_key = filename.split('.')[0]  # Remove .jpg
-                url = self._get_openlibrary_url(book_key)
-            except Exception as e:
-                logger.error(f"Failed to extract book key from cached URL {url}: {str(e)}")
+            key = self.get_cache_key(url)
+            entry = self._manifest.get(key) if key else None
+            if not entry or not entry.get("url"):
+                logger.error(f"No source URL recorded for cached URL {url}")
                 return None
+            url = entry["url"]
                 
         cache_path = self._get_cache_path(url)
         
         # Return cached path if exists
-        if cache_path.exists():
+        if cache_path.stem in self._manifest:
+            self._touch(cache_path.stem)
             return str(cache_path)
             
+        # Skip URLs that failed recently
+        retry_at = self._failures.get(url)
+        if retry_at is not None and retry_at > time.time():
+            self.stats["negative_hits"] += 1
+            return None
+            
+        # Coalesce concurrent requests for the same image onto one download
+        self.stats["misses"] += 1
+        task = self._downloads.get(url)
+        if task is None:
+            task = asyncio.ensure_future(self._download(url, cache_path))
+            self._downloads[url] = task
+            task.add_done_callback(lambda _: self._downloads.pop(url, None))
+        return await asyncio.shield(task)
+
+    async def _download(self, url: str, cache_path: Path) -> Optional[str]:
+        """Download an image, atomically move it into the cache and record it."""
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        result = await self._fetch(url, cache_path)
+        if result is None:
+            self._failures[url] = time.time() + settings.IMAGE_CACHE_NEGATIVE_TTL
+        else:
+            self._failures.pop(url, None)
+        return result
+
+    async def _fetch(self, url: str, cache_path: Path) -> Optional[str]:
+        tmp_path = cache_path.with_name(f".{cache_path.name}.{uuid.uuid4().hex}.tmp")
         try:
-            # Download and cache the image
-            connector = aiohttp.TCPConnector(ssl=self.ssl_context)
-            async with aiohttp.ClientSession(connector=connector) as session:
-                async with session.get(url) as response:
-                    if response.status != 200:
-                        logger.error(f"Failed to download image from {url}: {response.status}")
-                        return None
-                        
-                    data = await response.read()
+            async with self._get_session().get(url) as response:
+                if response.status != 200:
+                    logger.error(f"Failed to download image from {url}: {response.status}")
+                    return None
                     
-                    # Verify it's a valid image
-                    try:
-                        img = Image.open(BytesIO(data))
-                        
-                        # Save the image
-                        async with aiofiles.open(cache_path, 'wb') as f:
-                            await f.write(data)
-                            
-                        logger.info(f"Successfully cached image from {url} to {cache_path}")
-                        return str(cache_path)
-                        
-                    except Exception as e:
-                        logger.error(f"Invalid image data from {url}: {str(e)}")
-                        return None
+                data = await response.read()
+                content_type = response.headers.get("Content-Type", "image/jpeg")
+                
+            # Verify the image and derive its variants off the event loop.
+            # Variants are written before the original so that an existing
+            # original always has its variants too.
+            try:
+                written = await self.run_image_job(build_cover_variants, str(cache_path), self.formats, data)
+            except Exception as e:
+                logger.error(f"Invalid image data from {url}: {str(e)}")
+                return None
+                
+            # Write to a temp file and rename so readers never see a partial image
+            async with aiofiles.open(tmp_path, 'wb') as f:
+                await f.write(data)
+            os.replace(tmp_path, cache_path)
+            self._touch(cache_path.stem, len(data) + sum(os.path.getsize(path) for path in written))
+            await self._record(
+                cache_path.stem, url, content_type, len(data), hashlib.sha256(data).hexdigest(),
+                await self._describe(cache_path)
+            )
+            
+            logger.info(f"Successfully cached image from {url} to {cache_path}")
+            return str(cache_path)
                         
         except Exception as e:
             logger.error(f"Error caching image from {url}: {str(e)}")
             return None
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+
+    def is_proxy_allowed(self, url: str) -> bool:
+        """Whether the proxy may fetch from this URL's host (IMAGE_PROXY_ALLOWED_HOSTS or a subdomain)."""
+        try:
+            parts = urlsplit(url)
+        except ValueError:
+            return False
+        host = (parts.hostname or "").lower()
+        if parts.scheme not in ("http", "https") or not host:
+            return False
+        allowed_hosts = [h.strip().lower() for h in settings.IMAGE_PROXY_ALLOWED_HOSTS.split(",") if h.strip()]
+        return any(host == allowed or host.endswith(f".{allowed}") for allowed in allowed_hosts)
+
+    async def get_proxy_file(self, url: str) -> Optional[Tuple[str, str]]:
+        """Cache key and SHA-256 of a cached proxied image, or None on a miss."""
+        cached_path = await self.get_cached_image_path(url)
+        if not cached_path:
+            return None
+        key = Path(cached_path).stem
+        sha256 = await self.get_content_hash(key)
+        if not sha256:
+            return None
+        return key, sha256
+
+    async def get_hashed_file(self, key: str) -> Optional[Tuple[Path, str, str]]:
+        """Path, content type and current SHA-256 of a cached image by its cache key, or None."""
+        sha256 = await self.get_content_hash(key)
+        if not sha256:
+            return None
+        self._touch(key)
+        return self._original_path(key), self._manifest[key].get("content_type") or "image/jpeg", sha256
+
+    async def _describe(self, cache_path: Path) -> Optional[Dict[str, Any]]:
+        try:
+            return await self.run_image_job(describe_cover, str(cache_path))
+        except Exception as e:
+            logger.error(f"Failed to describe cover {cache_path}: {str(e)}")
+            return None
+
+    async def get_cover_details(self, url: Optional[str], compute: bool = True) -> Optional[Dict[str, Any]]:
+        """
+        Placeholder, dominant colour and intrinsic size of a cached cover,
+        given its source or cached URL. Covers cached before these were
+        recorded are described on first request if compute is set.
+        Returns None if the cover is not cached.
+        """
+        key = self.get_cache_key(url)
+        entry = self._manifest.get(key) if key else None
+        if entry is None:
+            return None
+        if "placeholder" not in entry:
+            if not compute:
+                return None
+            details = await self._describe(self._original_path(key))
+            if not details:
+                return None
+            entry.update(details)
+            await self._append_manifest(key, entry)
+        return {field: entry[field] for field in COVER_DETAIL_FIELDS}
+
+    async def get_content_hash(self, key: str) -> Optional[str]:
+        """SHA-256 of a cached original, hashing the file once for entries recorded without one."""
+        entry = self._manifest.get(key)
+        if entry is None:
+            return None
+        if not entry.get("sha256"):
+            path = self._original_path(key)
+            try:
+                data = await asyncio.to_thread(path.read_bytes)
+            except FileNotFoundError:
+                return None
+            entry["sha256"] = hashlib.sha256(data).hexdigest()
+            await self._append_manifest(key, entry)
+        return entry["sha256"]
+
+    async def _open_upstream(self, url: str) -> Optional[aiohttp.ClientResponse]:
+        """
+        GET a proxied URL, following redirects only to allowed hosts.
+        Returns the open response, which the caller must release.
+        """
+        for _ in range(_MAX_REDIRECTS + 1):
+            response = await self._get_session().get(url, allow_redirects=False)
+            if response.status not in _REDIRECT_STATUSES:
+                return response
+            location = response.headers.get("Location")
+            response.release()
+            if not location:
+                return None
+            url = str(response.url.join(URL(location)))
+            if not self.is_proxy_allowed(url):
+                logger.warning(f"Refusing proxy redirect to disallowed host: {url}")
+                return None
+        logger.error(f"Too many redirects proxying {url}")
+        return None
+
+    async def stream_upstream(self, url: str) -> Optional[Tuple[str, AsyncIterator[bytes]]]:
+        """
+        Open a proxied image upstream and return its content type and a
+        chunk iterator. The bytes are teed into a temp file as they are
+        streamed; once the body is complete it is validated and moved into
+        the cache in the background, without holding up the client. Nothing
+        is buffered in memory beyond one chunk. Returns None if the upstream
+        fails.
+        """
+        retry_at = self._failures.get(url)
+        if retry_at is not None and retry_at > time.time():
+            self.stats["negative_hits"] += 1
+            return None
+        self.stats["misses"] += 1
+        try:
+            response = await self._open_upstream(url)
+        except Exception as e:
+            logger.error(f"Error proxying image from {url}: {str(e)}")
+            response = None
+        if response is None or response.status != 200:
+            if response is not None:
+                logger.error(f"Failed to proxy image from {url}: {response.status}")
+                response.release()
+            self._failures[url] = time.time() + settings.IMAGE_CACHE_NEGATIVE_TTL
+            return None
 
-    async def get_cached_url(self, original_url: str, cache_if_missing: bool = True) -> str:
+        if (response.content_length or 0) > settings.IMAGE_PROXY_MAX_BYTES:
+            logger.error(f"Proxied image from {url} exceeds {settings.IMAGE_PROXY_MAX_BYTES} bytes")
+            response.release()
+            self._failures[url] = time.time() + settings.IMAGE_CACHE_NEGATIVE_TTL
+            return None
+
+        content_type = response.headers.get("Content-Type", "image/jpeg")
+        cache_path = self._get_cache_path(url)
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+
+        async def body() -> AsyncIterator[bytes]:
+            tmp_path = cache_path.with_name(f".{cache_path.name}.{uuid.uuid4().hex}.tmp")
+            digest = hashlib.sha256()
+            size = 0
+            complete = False
+            try:
+                async with aiofiles.open(tmp_path, "wb") as f:
+                    async for chunk in response.content.iter_chunked(_STREAM_CHUNK_SIZE):
+                        size += len(chunk)
+                        if size > settings.IMAGE_PROXY_MAX_BYTES:
+                            logger.error(f"Proxied image from {url} exceeds {settings.IMAGE_PROXY_MAX_BYTES} bytes")
+                            self._failures[url] = time.time() + settings.IMAGE_CACHE_NEGATIVE_TTL
+                            return
+                        digest.update(chunk)
+                        await f.write(chunk)
+                        yield chunk
+                complete = True
+            finally:
+                response.release()
+                if not complete and tmp_path.exists():
+                    tmp_path.unlink()
+            # Waiters in ensure_cached coalesce onto the store like onto a download
+            if url not in self._downloads:
+                task = asyncio.ensure_future(
+                    self._store_streamed(url, cache_path, tmp_path, content_type, size, digest.hexdigest())
+                )
+                self._downloads[url] = task
+                task.add_done_callback(lambda _: self._downloads.pop(url, None))
+            else:
+                tmp_path.unlink()
+
+        return content_type, body()
+
+    async def _store_streamed(self, url: str, cache_path: Path, tmp_path: Path,
+                              content_type: str, size: int, sha256: str) -> Optional[str]:
+        """Validate a fully streamed image, build its variants and move it into the cache."""
+        try:
+            written = await self.run_image_job(
+                build_cover_variants, str(cache_path), self.formats, None, str(tmp_path)
+            )
+            os.replace(tmp_path, cache_path)
+        except Exception as e:
+            logger.error(f"Invalid image data from {url}: {str(e)}")
+            self._failures[url] = time.time() + settings.IMAGE_CACHE_NEGATIVE_TTL
+            return None
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+        self._failures.pop(url, None)
+        self._touch(cache_path.stem, size + sum(os.path.getsize(path) for path in written))
+        await self._record(cache_path.stem, url, content_type, size, sha256, await self._describe(cache_path))
+        logger.info(f"Cached proxied image from {url} to {cache_path}")
+        return str(cache_path)
+
+    async def ensure_variants(self, cache_path: Path) -> None:
+        """Build missing variants for an original cached before they existed."""
+        task = self._variant_jobs.get(cache_path)
+        if task is None:
+            task = asyncio.ensure_future(
+                self.run_image_job(build_cover_variants, str(cache_path), self.formats)
+            )
+            self._variant_jobs[cache_path] = task
+            task.add_done_callback(lambda _: self._variant_jobs.pop(cache_path, None))
+        try:
+            await asyncio.shield(task)
+        except Exception as e:
+            logger.error(f"Failed to build variants for {cache_path}: {str(e)}")
+
+    async def _recover(self, key: str) -> bool:
+        """Re-download a cover whose files were lost, using its manifest entry."""
+        entry = self._manifest.get(key)
+        if not entry or not entry.get("url"):
+            return False
+        logger.warning(f"Cached cover {key} is missing on disk, re-downloading from {entry['url']}")
+        await self._forget(key)
+        return await self.ensure_cached(entry["url"]) is not None
+
+    def get_variant_url(self, url: Optional[str], size: str = "L") -> Optional[str]:
+        """
+        Point a cover URL at the requested size. Works for cached URLs, in
+        the sharded or the old flat layout, and Open Library cover URLs.
+        """
+        if not url:
+            return url
+        if url.startswith('/cache/images/'):
+            match = _VARIANT_NAME.match(Path(url).name)
+            if not match:
+                return url
+            return cache_url(match.group("key"), size)
+        return re.sub(r'-[SML]\.jpg$', f'-{size}.jpg', url)
+
+    async def get_variant_file(self, filename: str, accept: str = "") -> Optional[Tuple[Path, str]]:
+        """
+        Resolve a cached cover path (relative to /cache/images/) to the file
+        to serve and its media type. The location is computed from the key,
+        so old flat URLs keep working. JPEG requests are upgraded to AVIF or
+        WebP when the client accepts them.
+        """
+        match = _VARIANT_NAME.match(Path(filename).name)
+        if not match:
+            return None
+        key = match.group("key")
+        if filename not in (match.group(0), f"{key[:2]}/{key[2:4]}/{match.group(0)}"):
+            return None
+        original = self._original_path(key)
+        size = match.group("size") or "L"
+        fmt = match.group("fmt")
+        if fmt == "jpg":
+            for candidate in ("avif", "webp"):
+                if candidate in self.formats and f"image/{candidate}" in accept:
+                    fmt = candidate
+                    break
+
+        path = variant_path(original, size, fmt)
+        self._touch(original.stem)
+        if not path.exists():
+            if not original.exists() and not await self._recover(original.stem):
+                return None
+            await self.ensure_variants(original)
+            if not path.exists():
+                # Fall back to the original rather than failing the request
+                return original, _MEDIA_TYPES["jpg"]
+        return path, _MEDIA_TYPES[fmt]
+
+    async def get_cached_url(self, original_url: str, cache_if_missing: bool = True, size: str = "L") -> str:
         """
         Get the URL for a cached image. If the image isn't cached and cache_if_missing is True,
-        it will be cached. Returns the cached URL if available, otherwise returns the original URL.
+        it will be cached. Returns the cached URL (of the requested size) if available,
+        otherwise returns the original URL.
         """
+        return self.get_variant_url(await self._get_cached_original_url(original_url, cache_if_missing), size)
+
+    async def _get_cached_original_url(self, original_url: str, cache_if_missing: bool) -> str:
         if not original_url:
             return ""
             
         # If URL is already in cached format, check if file exists
         if original_url.startswith('/cache/images/'):
             logger.info(f"URL already in cache format: {original_url}")
-            cache_path = self.cache_dir / Path(original_url).name
-            if not cache_path.exists():
-                logger.warning(f"Cache file does not exist: {cache_path}")
-                # Try to re-cache from OpenLibrary
-                cached_path = await self.ensure_cached(original_url)
-                if cached_path:
-                    return f"/cache/images/{Path(cached_path).name}"
+            original_url = self.get_variant_url(original_url, "L")
+            key = self.get_cache_key(original_url)
+            if key in self._manifest:
+                self.stats["hits"] += 1
+                self._touch(key)
+            else:
+                logger.warning(f"Cache file is not in the manifest: {original_url}")
             return original_url
             
         try:
@@ -134,8 +909,7 @@ class ImageCache:
             
             if cached_path:
                 # Convert to URL path - always use /cache/images/
-                filename = Path(cached_path).name
-                cached_url = f"/cache/images/{filename}"
+                cached_url = cache_url(Path(cached_path).stem)
                 logger.info(f"Generated cached URL: {cached_url}")
                 return cached_url
             
@@ -145,8 +919,7 @@ class ImageCache:
                 logger.info(f"Starting immediate caching for: {original_url}")
                 cached_path = await self.ensure_cached(original_url)
                 if cached_path:
-                    filename = Path(cached_path).name
-                    return f"/cache/images/{filename}"
+                    return cache_url(Path(cached_path).stem)
                 logger.warning(f"Failed to cache image: {original_url}")
             
             # Return original URL if caching failed
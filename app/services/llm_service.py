@@ -1,14 +1,24 @@
+from abc import ABC, abstractmethod
 import google.generativeai as genai
 from openai import AsyncOpenAI
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, AsyncIterator
 import os
 from dotenv import load_dotenv
 import json
 
+from app.core.config import settings
+
 load_dotenv()
 
-# Configure OpenAI
-openai_client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# Configure OpenAI lazily so the app can start without an API key
+# (e.g. when running against the local stand-in provider)
+openai_client: Optional[AsyncOpenAI] = None
+
+def _get_openai_client() -> AsyncOpenAI:
+    global openai_client
+    if openai_client is None:
+        openai_client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    return openai_client
 
 # Configure Gemini
 api_key = os.getenv("GOOGLE_API_KEY")
@@ -50,7 +60,7 @@ async def query_chatgpt(prompt: str) -> str:
     system_prompt = format_system_prompt()
     
     try:
-        response = await openai_client.chat.completions.create(
+        response = await _get_openai_client().chat.completions.create(
             model="gpt-3.5-turbo-1106",  # Using JSON mode capable model
             response_format={ "type": "json_object" },  # Enforce JSON response
             messages=[
@@ -63,6 +73,73 @@ async def query_chatgpt(prompt: str) -> str:
     except Exception as e:
         raise Exception(f"Error querying ChatGPT: {str(e)}")
 
+class LLMProvider(ABC):
+    """
+    Interface for LLM backends used by the digest pipeline.
+
+    Providers only need to implement ``complete``; ``stream`` falls back to
+    yielding the full completion as a single chunk.
+    """
+    name: str = ""
+
+    @abstractmethod
+    async def complete(self, prompt: str) -> str:
+        ...
+
+    async def stream(self, prompt: str) -> AsyncIterator[str]:
+        yield await self.complete(prompt)
+
+class GeminiProvider(LLMProvider):
+    name = "gemini"
+
+    async def complete(self, prompt: str) -> str:
+        return await query_gemini(prompt)
+
+class ChatGPTProvider(LLMProvider):
+    name = "chatgpt"
+
+    async def complete(self, prompt: str) -> str:
+        return await query_chatgpt(prompt)
+
+_providers: Dict[str, LLMProvider] = {
+    GeminiProvider.name: GeminiProvider(),
+    ChatGPTProvider.name: ChatGPTProvider(),
+}
+
+def register_provider(provider: LLMProvider) -> None:
+    """Register (or replace) an LLM provider under its name."""
+    _providers[provider.name] = provider
+
+def local_provider_enabled() -> bool:
+    """
+    Whether the local stand-in may be used: when ``settings.LLM_PROVIDER``
+    selects it, or when callers may select it themselves in DEBUG.
+    """
+    return settings.DEBUG or (settings.LLM_PROVIDER or "").lower() == "local"
+
+def get_provider(name: Optional[str] = None) -> LLMProvider:
+    """
+    Resolve the provider to use for a request.
+
+    ``settings.LLM_PROVIDER`` takes precedence over the caller's choice so a
+    whole deployment (or a benchmark run) can be pointed at one backend.
+    """
+    name = (settings.LLM_PROVIDER or name or "gemini").lower()
+    if name == "local" and not local_provider_enabled():
+        raise ValueError("The local LLM provider is not enabled")
+    if name == "local" and name not in _providers:
+        # Imported lazily to keep the stand-in out of production start-up
+        from app.services.local_llm_service import LocalLLMProvider
+        register_provider(LocalLLMProvider())
+    provider = _providers.get(name)
+    if provider is None:
+        raise ValueError(f"Unknown LLM provider: {name}")
+    return provider
+
+async def query_llm(prompt: str, provider: Optional[str] = None) -> str:
+    """Query the configured LLM provider and return the raw response text."""
+    return await get_provider(provider).complete(prompt)
+
 def generate_book_prompts(book: Dict[str, Any]) -> Dict[str, str]:
     """
     Generate prompts for book summary and Q&A.
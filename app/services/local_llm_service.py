@@ -0,0 +1,123 @@
+import asyncio
+import hashlib
+import json
+import math
+import random
+import re
+from typing import AsyncIterator, Optional, Tuple
+
+from app.core.config import settings
+from app.services.llm_service import LLMProvider
+
+# Vocabulary for generated digests. The content is meaningless but the word
+# lengths roughly match English prose so payload sizes stay realistic.
+_WORDS = (
+    "the story follows a young protagonist through loss memory and hope while "
+    "the author explores power family identity and the cost of ambition across "
+    "generations of characters whose choices shape a changing society where "
+    "themes of justice freedom love and betrayal unfold against a vivid setting "
+    "readers discover how courage grows from doubt and how small acts of "
+    "kindness reveal the moral center of the narrative through careful prose"
+).split()
+
+_QUESTIONS = (
+    "What is the central theme of the book?",
+    "How does the main character change over the course of the story?",
+    "What role does the setting play in the narrative?",
+    "Which conflict drives the plot forward?",
+    "What message does the author leave the reader with?",
+    "How do the secondary characters shape the protagonist?",
+)
+
+_BOOK_PATTERN = re.compile(r"analyze the book '(?P<title>.*?)' by (?P<author>.*?) and provide")
+
+class LocalLLMProvider(LLMProvider):
+    """
+    Deterministic stand-in for the hosted LLMs.
+
+    The digest content is derived from a hash of the prompt, so the same book
+    always gets the same digest. Latency, failures and malformed output are
+    drawn from a separate random stream configured through the
+    ``LOCAL_LLM_*`` settings.
+    """
+    name = "local"
+
+    def __init__(self, seed: Optional[int] = None):
+        self._rng = random.Random(seed if seed is not None else settings.LOCAL_LLM_SEED)
+
+    def _sample_latency(self) -> float:
+        """Sample time to first token in seconds."""
+        median = max(settings.LOCAL_LLM_LATENCY_MS, 0.0) / 1000.0
+        jitter = max(settings.LOCAL_LLM_LATENCY_JITTER, 0.0)
+        distribution = settings.LOCAL_LLM_LATENCY_DISTRIBUTION.lower()
+        if distribution == "uniform":
+            return max(0.0, self._rng.uniform(median * (1 - jitter), median * (1 + jitter)))
+        if distribution == "lognormal" and median > 0:
+            return self._rng.lognormvariate(math.log(median), jitter)
+        return median
+
+    def _parse_prompt(self, prompt: str) -> Tuple[str, str]:
+        match = _BOOK_PATTERN.search(prompt)
+        if match:
+            return match.group("title"), match.group("author")
+        return "Unknown Title", "Unknown Author"
+
+    def _sentence(self, rng: random.Random, words: int) -> str:
+        text = " ".join(rng.choice(_WORDS) for _ in range(words))
+        return text[0].upper() + text[1:] + "."
+
+    def generate_digest(self, prompt: str) -> str:
+        """Build the digest JSON for a prompt. Pure function of the prompt."""
+        seed = int(hashlib.sha256(prompt.encode()).hexdigest()[:16], 16)
+        rng = random.Random(seed)
+        title, author = self._parse_prompt(prompt)
+
+        # Roughly 250-350 words of summary and 5 Q&A pairs, in line with
+        # what Gemini returns for the digest prompt
+        summary = " ".join(self._sentence(rng, rng.randint(12, 24)) for _ in range(rng.randint(14, 18)))
+        questions = rng.sample(_QUESTIONS, 5)
+        qa = [
+            {
+                "question": question,
+                "answer": " ".join(self._sentence(rng, rng.randint(10, 20)) for _ in range(rng.randint(2, 4)))
+            }
+            for question in questions
+        ]
+        return json.dumps({
+            "title": title,
+            "author": author,
+            "summary": summary,
+            "questions_and_answers": qa
+        })
+
+    def _malform(self, response: str) -> str:
+        """Damage a response in one of the ways real providers do."""
+        choice = self._rng.randrange(3)
+        if choice == 0:
+            return response[: len(response) // 2]  # Truncated output
+        if choice == 1:
+            return "Here is the digest you asked for: " + response.replace('"', "'")
+        return "null"
+
+    async def stream(self, prompt: str) -> AsyncIterator[str]:
+        await asyncio.sleep(self._sample_latency())
+        if self._rng.random() < settings.LOCAL_LLM_ERROR_RATE:
+            raise Exception("Error querying local LLM: simulated provider failure")
+
+        response = self.generate_digest(prompt)
+        if self._rng.random() < settings.LOCAL_LLM_MALFORMED_RATE:
+            response = self._malform(response)
+
+        # Emit one word per chunk at the configured token rate
+        tokens = re.findall(r"\S*\s*", response)
+        tokens_per_second = settings.LOCAL_LLM_TOKENS_PER_SECOND
+        delay = 1.0 / tokens_per_second if tokens_per_second > 0 else 0.0
+        for token in tokens:
+            if not token:
+                continue
+            if delay:
+                await asyncio.sleep(delay)
+            yield token
+
+    async def complete(self, prompt: str) -> str:
+        return "".join([chunk async for chunk in self.stream(prompt)])
@@ -0,0 +1,417 @@
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, update, delete, func, literal_column, bindparam, tuple_, Float, DateTime
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from collections import defaultdict
+from datetime import date, datetime, timedelta, timezone
+from typing import List, Optional, Tuple, Dict, Any
+import base64
+import binascii
+import logging
+import math
+
+from app.core.config import settings
+from app.core.exceptions import InvalidCursorError
+from app.core.hyperloglog import HyperLogLog
+from app.db import models
+
+logger = logging.getLogger(__name__)
+
+# Look-back windows, in days, kept as precomputed rollups. A window of N
+# days covers visit dates from N days ago up to today, as the live query did.
+POPULARITY_WINDOWS = (1, 7, 30, 365)
+
+# Trending keys are ln(score) plus the decay accrued since this instant
+TRENDING_EPOCH = datetime(2024, 1, 1, tzinfo=timezone.utc)
+# Ids per IN list, keeping bind parameters well under asyncpg's 32767
+_IN_CHUNK = 5000
+# exp() of anything lower underflows, which PostgreSQL reports as an error
+_MIN_EXPONENT = -700.0
+
+def window_deltas(
+    rows: List[Dict[str, Any]],
+    windows: Dict[int, date]
+) -> Dict[int, Dict[int, int]]:
+    """
+    Sum visit count rows into per-window, per-book increments.
+
+    windows maps each window to the date it is current as of; rows dated
+    before the start of a window are not counted in it.
+    """
+    deltas: Dict[int, Dict[int, int]] = {}
+    for window, as_of in windows.items():
+        start = as_of - timedelta(days=window)
+        counts: Dict[int, int] = defaultdict(int)
+        for row in rows:
+            if row["visit_date"] >= start:
+                counts[row["book_id"]] += row["visit_count"]
+        if counts:
+            deltas[window] = counts
+    return deltas
+
+def window_visitor_sketches(
+    rows: List[Dict[str, Any]],
+    windows: Dict[int, date]
+) -> Dict[int, Dict[int, HyperLogLog]]:
+    """Union of the rows' serialised visitor sketches per window and book, like window_deltas."""
+    sketches: Dict[int, Dict[int, HyperLogLog]] = {}
+    for window, as_of in windows.items():
+        start = as_of - timedelta(days=window)
+        by_book: Dict[int, HyperLogLog] = {}
+        for row in rows:
+            data = row.get("visitor_sketch")
+            if data and row["visit_date"] >= start:
+                sketch = by_book.setdefault(row["book_id"], HyperLogLog(settings.VISIT_HLL_PRECISION))
+                sketch.merge(HyperLogLog.from_bytes(data))
+        if by_book:
+            sketches[window] = by_book
+    return sketches
+
+async def _write_visitor_sketches(
+    db: AsyncSession,
+    window_days: int,
+    sketches: Dict[int, HyperLogLog],
+    merge: bool = True
+) -> None:
+    """Store books' window visitor sketches and estimates, merged into the stored ones unless merge is False."""
+    rollups = models.PopularityRollup
+    if merge:
+        book_ids = list(sketches)
+        for start in range(0, len(book_ids), _IN_CHUNK):
+            result = await db.execute(
+                select(rollups.book_id, rollups.visitor_sketch).where(
+                    rollups.window_days == window_days,
+                    rollups.book_id.in_(book_ids[start:start + _IN_CHUNK]),
+                    rollups.visitor_sketch.isnot(None)
+                )
+            )
+            for book_id, data in result.all():
+                sketches[book_id] = sketches[book_id].copy().merge(HyperLogLog.from_bytes(data))
+    table = rollups.__table__
+    await db.execute(
+        update(table)
+        .where(table.c.window_days == window_days, table.c.book_id == bindparam("rollup_book_id"))
+        .values(visitor_sketch=bindparam("sketch"), unique_visitors=bindparam("unique"))
+        .execution_options(synchronize_session=False),
+        [
+            {
+                "rollup_book_id": book_id,
+                "sketch": sketch.to_bytes() if sketch.count() else None,
+                "unique": sketch.count()
+            }
+            for book_id, sketch in sorted(sketches.items())
+        ]
+    )
+
+async def _lock_windows(db: AsyncSession) -> List[models.PopularityWindow]:
+    """Lock the window rows, serialising rollup maintenance across processes."""
+    result = await db.execute(
+        select(models.PopularityWindow)
+        .order_by(models.PopularityWindow.window_days)
+        .with_for_update()
+    )
+    return result.scalars().all()
+
+async def _roll_over(db: AsyncSession, window: models.PopularityWindow, today: date) -> None:
+    """Subtract the visits of the days that have left the window since window.as_of."""
+    rollups = models.PopularityRollup
+    visits = models.Visit
+    expired = (
+        select(visits.book_id, func.sum(visits.visit_count).label("total"))
+        .where(
+            visits.visit_date >= window.as_of - timedelta(days=window.window_days),
+            visits.visit_date < today - timedelta(days=window.window_days)
+        )
+        .group_by(visits.book_id)
+        .subquery()
+    )
+    changed = await db.execute(
+        update(rollups)
+        .where(rollups.window_days == window.window_days, rollups.book_id == expired.c.book_id)
+        .values(visit_count=rollups.visit_count - expired.c.total)
+        .returning(rollups.book_id)
+        .execution_options(synchronize_session=False)
+    )
+    changed_books = set(changed.scalars().all())
+    removed = await db.execute(
+        delete(rollups)
+        .where(rollups.window_days == window.window_days, rollups.visit_count <= 0)
+        .returning(rollups.book_id)
+        .execution_options(synchronize_session=False)
+    )
+    removed_books = set(removed.scalars().all())
+    window.book_count -= len(removed_books)
+    window.as_of = today
+
+    # Sketches cannot forget visitors, so rebuild those of the books that lost days
+    remaining = sorted(changed_books - removed_books)
+    if remaining:
+        await _write_visitor_sketches(
+            db,
+            window.window_days,
+            await day_visitor_sketches(db, remaining, today - timedelta(days=window.window_days)),
+            merge=False
+        )
+
+async def day_visitor_sketches(db: AsyncSession, book_ids: List[int], start: date) -> Dict[int, HyperLogLog]:
+    """Union of the daily visitor sketches of each book since start."""
+    visits = models.Visit
+    sketches = {book_id: HyperLogLog(settings.VISIT_HLL_PRECISION) for book_id in book_ids}
+    for offset in range(0, len(book_ids), _IN_CHUNK):
+        result = await db.stream(
+            select(visits.book_id, visits.visitor_sketch).where(
+                visits.book_id.in_(book_ids[offset:offset + _IN_CHUNK]),
+                visits.visit_date >= start,
+                visits.visitor_sketch.isnot(None)
+            )
+        )
+        async for book_id, data in result:
+            sketches[book_id].merge(HyperLogLog.from_bytes(data))
+    return sketches
+
+async def _add(db: AsyncSession, window: models.PopularityWindow, counts: Dict[int, int]) -> None:
+    """Add per-book visit increments to a window."""
+    rollups = models.PopularityRollup
+    statement = pg_insert(rollups).values([
+        {"window_days": window.window_days, "book_id": book_id, "visit_count": count}
+        for book_id, count in sorted(counts.items())
+    ])
+    result = await db.execute(
+        statement.on_conflict_do_update(
+            index_elements=[rollups.window_days, rollups.book_id],
+            set_={"visit_count": rollups.visit_count + statement.excluded.visit_count}
+        )
+        # xmax is 0 only on freshly inserted rows
+        .returning(literal_column("xmax = 0"))
+    )
+    window.book_count += sum(1 for inserted, in result.all() if inserted)
+
+async def apply_visits(db: AsyncSession, rows: List[Dict[str, Any]], today: date) -> None:
+    """
+    Bring the rollups up to date with a batch of visit counts and visitor
+    sketches, inside the caller's transaction. Windows are first rolled over
+    to today, then the batch is added to every window it falls in. An empty
+    batch only rolls the windows over.
+    """
+    windows = await _lock_windows(db)
+    for window in windows:
+        if window.as_of < today:
+            await _roll_over(db, window, today)
+    as_of = {window.window_days: window.as_of for window in windows}
+    deltas = window_deltas(rows, as_of)
+    sketches = window_visitor_sketches(rows, as_of)
+    for window in windows:
+        if window.window_days in deltas:
+            await _add(db, window, deltas[window.window_days])
+        if window.window_days in sketches:
+            await _write_visitor_sketches(db, window.window_days, sketches[window.window_days])
+
+async def rebuild(db: AsyncSession, today: date) -> None:
+    """Recompute every window from the visits table, inside the caller's transaction."""
+    rollups = models.PopularityRollup
+    windows = models.PopularityWindow
+    visits = models.Visit
+    await db.execute(select(windows.window_days).with_for_update())
+    await db.execute(delete(rollups).execution_options(synchronize_session=False))
+    for window in POPULARITY_WINDOWS:
+        totals = (
+            select(
+                literal_column(str(window)),
+                visits.book_id,
+                func.sum(visits.visit_count)
+            )
+            .where(visits.visit_date >= today - timedelta(days=window))
+            .group_by(visits.book_id)
+            .having(func.sum(visits.visit_count) > 0)
+        )
+        result = await db.execute(
+            pg_insert(rollups)
+            .from_select(["window_days", "book_id", "visit_count"], totals)
+            .returning(rollups.book_id)
+        )
+        book_ids = sorted(result.scalars().all())
+        if book_ids:
+            await _write_visitor_sketches(
+                db, window, await day_visitor_sketches(db, book_ids, today - timedelta(days=window)), merge=False
+            )
+        statement = pg_insert(windows).values(window_days=window, as_of=today, book_count=len(book_ids))
+        await db.execute(
+            statement.on_conflict_do_update(
+                index_elements=[windows.window_days],
+                set_={"as_of": statement.excluded.as_of, "book_count": statement.excluded.book_count}
+            )
+        )
+
+async def get_window(db: AsyncSession, days: int) -> Optional[models.PopularityWindow]:
+    """The maintained window of exactly `days` days, if there is one."""
+    if days not in POPULARITY_WINDOWS:
+        return None
+    return await db.get(models.PopularityWindow, days)
+
+async def get_ranked_books(
+    db: AsyncSession,
+    window: int,
+    limit: int,
+    offset: int = 0,
+    rank_by: str = "visits"
+) -> List[Tuple[models.Book, int, int]]:
+    """
+    A page of a window's books with their visit counts and unique visitors,
+    ranked by either, read from the matching window rank index.
+    """
+    rollups = models.PopularityRollup
+    rank = rollups.unique_visitors if rank_by == "unique_visitors" else rollups.visit_count
+    result = await db.execute(
+        select(models.Book, rollups.visit_count, rollups.unique_visitors)
+        .join(rollups, rollups.book_id == models.Book.id)
+        .where(rollups.window_days == window)
+        .order_by(rank.desc(), rollups.book_id)
+        .offset(offset)
+        .limit(limit)
+    )
+    return result.all()
+
+def trending_decay_rate() -> float:
+    """Decay constant lambda, per second, for TRENDING_HALF_LIFE_DAYS."""
+    return math.log(2) / (settings.TRENDING_HALF_LIFE_DAYS * 86400)
+
+def trending_key(score: float, at: datetime) -> float:
+    """
+    ln(score) plus the decay accrued between TRENDING_EPOCH and `at`.
+
+    All scores decay at the same rate, so comparing keys compares the
+    scores decayed to any common instant, and the order never needs
+    refreshing as time passes.
+    """
+    return math.log(score) + trending_decay_rate() * (at - TRENDING_EPOCH).total_seconds()
+
+def current_trending_score(book: models.Book, now: Optional[datetime] = None) -> Optional[float]:
+    """A book's stored trending score decayed to now."""
+    if book.trending_score is None or book.trending_updated_at is None:
+        return None
+    now = now or datetime.now(timezone.utc)
+    elapsed = max((now - book.trending_updated_at).total_seconds(), 0.0)
+    return book.trending_score * math.exp(-trending_decay_rate() * elapsed)
+
+async def apply_trending(db: AsyncSession, counts: Dict[int, int], now: datetime) -> None:
+    """
+    Decay the trending scores of the visited books to now and add their new
+    visits (score = score * e^(-lambda * dt) + n), inside the caller's
+    transaction. One row per book, whatever its visit history.
+    """
+    books = models.Book.__table__
+    now_param = bindparam("now", type_=DateTime(timezone=True))
+    decay = func.exp(func.greatest(
+        -trending_decay_rate() * func.extract("epoch", now_param - books.c.trending_updated_at),
+        _MIN_EXPONENT
+    ))
+    score = func.coalesce(books.c.trending_score * decay, 0.0) + bindparam("visits", type_=Float)
+    await db.execute(
+        update(books)
+        .where(books.c.id == bindparam("book_id"))
+        .values(
+            trending_score=score,
+            trending_updated_at=now_param,
+            trending_key=func.ln(score) + bindparam("key_offset", type_=Float),
+            # Visits are not edits of the book
+            updated_at=books.c.updated_at
+        ),
+        [
+            {
+                "book_id": book_id,
+                "visits": float(count),
+                "now": now,
+                "key_offset": trending_key(1.0, now)
+            }
+            for book_id, count in sorted(counts.items())
+        ]
+    )
+
+async def recompute_trending(db: AsyncSession, now: datetime, apply: bool = False) -> Dict[int, float]:
+    """
+    Trending scores recomputed from the visits table, by book id.
+
+    Each day's visits are taken to have happened at midday UTC (or now, for
+    today's visits before midday), so the result is the incremental scores
+    give or take the spread of visit times within a day. With apply, the
+    stored scores are replaced by the recomputed ones inside the caller's
+    transaction.
+    """
+    visits = models.Visit
+    if apply:
+        # Flushes finishing after this point add their visits on top of the recomputed scores
+        await _lock_windows(db)
+    today = now.date()
+    since_midday = (now - datetime.combine(today, datetime.min.time(), timezone.utc)).total_seconds() - 43200
+    age = (today - visits.visit_date) * 86400 + max(since_midday, 0.0)
+    result = await db.execute(
+        select(
+            visits.book_id,
+            func.sum(visits.visit_count * func.exp(func.greatest(-trending_decay_rate() * age, _MIN_EXPONENT)))
+        )
+        .where(visits.visit_date <= today)
+        .group_by(visits.book_id)
+        .having(func.sum(visits.visit_count) > 0)
+    )
+    scores = {book_id: float(score) for book_id, score in result.all() if score > 0}
+
+    if apply:
+        books = models.Book.__table__
+        await db.execute(
+            update(books)
+            .where(books.c.trending_score.isnot(None))
+            .values(
+                trending_score=None,
+                trending_updated_at=None,
+                trending_key=None,
+                updated_at=books.c.updated_at
+            )
+        )
+        if scores:
+            await db.execute(
+                update(books)
+                .where(books.c.id == bindparam("book_id"))
+                .values(
+                    trending_score=bindparam("score"),
+                    trending_updated_at=bindparam("now"),
+                    trending_key=bindparam("key"),
+                    updated_at=books.c.updated_at
+                ),
+                [
+                    {"book_id": book_id, "score": score, "now": now, "key": trending_key(score, now)}
+                    for book_id, score in sorted(scores.items())
+                ]
+            )
+    return scores
+
+def encode_cursor(book: models.Book) -> str:
+    """Opaque cursor for the trending page after `book`."""
+    return base64.urlsafe_b64encode(f"{book.trending_key!r}:{book.id}".encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[float, int]:
+    try:
+        key, book_id = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode().split(":")
+        return float(key), int(book_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError) as e:
+        raise InvalidCursorError(f"Invalid cursor: {cursor}") from e
+
+async def get_trending_books(
+    db: AsyncSession,
+    limit: int,
+    cursor: Optional[str] = None
+) -> Tuple[List[models.Book], Optional[str]]:
+    """
+    A page of books by current trending score, and the cursor of the next
+    page (None on the last). Pages are read from the trending index, so
+    deep pages cost the same as the first.
+    """
+    books = models.Book
+    query = select(books).where(books.trending_key.isnot(None))
+    if cursor:
+        key, book_id = decode_cursor(cursor)
+        query = query.where(tuple_(books.trending_key, books.id) < tuple_(key, book_id))
+    result = await db.execute(
+        query.order_by(books.trending_key.desc(), books.id.desc()).limit(limit + 1)
+    )
+    page = result.unique().scalars().all()
+    next_cursor = encode_cursor(page[limit - 1]) if len(page) > limit else None
+    return page[:limit], next_cursor
@@ -0,0 +1,208 @@
+from typing import Awaitable, Callable, Dict, Optional, Set, Tuple
+import asyncio
+import logging
+import struct
+import time
+
+import redis.asyncio as redis
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Stored entries are the time they go stale (a big-endian double of Unix
+# seconds, so every process agrees on it) followed by the response body
+_ENTRY_HEADER = struct.Struct(">d")
+# How long a cache miss waits for a render already running in another process
+LOCK_WAIT = 2.0
+LOCK_POLL_INTERVAL = 0.05
+
+class MemoryCacheStore:
+    """
+    In-process store with the same interface as RedisCacheStore. Used when
+    Redis is not configured or unreachable, and as Redis' stand-in in tests
+    (pass a clock to control expiry).
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self._clock = clock
+        self._entries: Dict[str, Tuple[bytes, float]] = {}
+
+    def _live(self, key: str) -> Optional[bytes]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if self._clock() >= expires_at:
+            del self._entries[key]
+            return None
+        return value
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return self._live(key)
+
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        self._entries[key] = (value, self._clock() + ttl)
+
+    async def add(self, key: str, value: bytes, ttl: float) -> bool:
+        """Set key unless it already exists. Returns whether it was set."""
+        if self._live(key) is not None:
+            return False
+        await self.set(key, value, ttl)
+        return True
+
+    async def close(self) -> None:
+        self._entries.clear()
+
+class RedisCacheStore:
+    """Entries shared by every worker process, with expiry left to Redis."""
+
+    def __init__(self, url: str):
+        self._client = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await self._client.get(key)
+
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        await self._client.set(key, value, px=max(int(ttl * 1000), 1))
+
+    async def add(self, key: str, value: bytes, ttl: float) -> bool:
+        """Set key unless it already exists. Returns whether it was set."""
+        return bool(await self._client.set(key, value, px=max(int(ttl * 1000), 1), nx=True))
+
+    async def close(self) -> None:
+        await self._client.close()
+
+def _default_store():
+    if settings.REDIS_URL and not settings.REDIS_URL.startswith("memory:"):
+        return RedisCacheStore(settings.REDIS_URL)
+    return MemoryCacheStore()
+
+class ResponseCache:
+    """
+    Cache of serialised responses with stale-while-revalidate refreshes.
+
+    An entry is served as is for RESPONSE_CACHE_TTL seconds. For up to
+    RESPONSE_CACHE_STALE_TTL seconds after that it is still served, while
+    one background task re-renders it. Only a miss waits for a render.
+    Renders of the same key are deduplicated within the process, and
+    across processes by a short-lived lock entry in the store: a miss
+    waits briefly for the holder's result, a stale refresh is left to it.
+
+    While the store (Redis) is failing, entries are kept in an in-process
+    fallback store and Redis is retried every RESPONSE_CACHE_RETRY_INTERVAL
+    seconds.
+    """
+
+    def __init__(self, store=None, fallback: Optional[MemoryCacheStore] = None,
+                 clock: Callable[[], float] = time.time):
+        self._primary = store
+        self._fallback = fallback or MemoryCacheStore()
+        self._clock = clock
+        # Monotonic time until which the primary store is skipped
+        self._primary_down_until = 0.0
+        self._renders: Dict[str, asyncio.Task] = {}
+        self._background: Set[asyncio.Task] = set()
+        self.stats = {"hits": 0, "stale_hits": 0, "misses": 0, "renders": 0, "render_errors": 0, "store_errors": 0}
+
+    def _get_primary(self):
+        if self._primary is None:
+            self._primary = _default_store()
+        return self._primary
+
+    async def _call(self, method: str, *args):
+        """Call a store method on the primary store, or the fallback while it is failing."""
+        if time.monotonic() >= self._primary_down_until:
+            try:
+                return await getattr(self._get_primary(), method)(*args)
+            except (redis.RedisError, OSError) as e:
+                self.stats["store_errors"] += 1
+                self._primary_down_until = time.monotonic() + settings.RESPONSE_CACHE_RETRY_INTERVAL
+                logger.error(f"Response cache store failed, using the in-process cache: {str(e)}")
+        return await getattr(self._fallback, method)(*args)
+
+    async def _read(self, key: str) -> Optional[Tuple[float, bytes]]:
+        data = await self._call("get", key)
+        if not data or len(data) < _ENTRY_HEADER.size:
+            return None
+        return _ENTRY_HEADER.unpack_from(data)[0], data[_ENTRY_HEADER.size:]
+
+    async def get(self, key: str, render: Callable[[], Awaitable[bytes]]) -> bytes:
+        """The cached body for key, rendering and storing it if missing."""
+        entry = await self._read(key)
+        if entry is not None:
+            stale_at, body = entry
+            if self._clock() < stale_at:
+                self.stats["hits"] += 1
+            else:
+                self.stats["stale_hits"] += 1
+                self._refresh_in_background(key, render)
+            return body
+        self.stats["misses"] += 1
+        while True:
+            task = self._start_render(key, render, wait_for_lock=True)
+            # Shield the shared render from cancellation of any single caller
+            body = await asyncio.shield(task)
+            if body is not None:
+                return body
+            # Joined a background refresh that left the render to another process
+
+    def _start_render(self, key: str, render: Callable[[], Awaitable[bytes]], wait_for_lock: bool) -> asyncio.Task:
+        task = self._renders.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._render(key, render, wait_for_lock))
+            self._renders[key] = task
+            task.add_done_callback(lambda _: self._renders.pop(key, None))
+        return task
+
+    def _refresh_in_background(self, key: str, render: Callable[[], Awaitable[bytes]]) -> None:
+        if key in self._renders:
+            return
+        task = self._start_render(key, render, wait_for_lock=False)
+        self._background.add(task)
+        task.add_done_callback(self._background_done)
+
+    def _background_done(self, task: asyncio.Task) -> None:
+        self._background.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Error refreshing cached response: {str(task.exception())}")
+
+    async def _render(self, key: str, render: Callable[[], Awaitable[bytes]], wait_for_lock: bool) -> Optional[bytes]:
+        # The lock is left to expire rather than deleted, so it can never
+        # release a lock another process took after ours expired. It lasts
+        # less than the entry stays fresh, so it never delays the next refresh.
+        lock_ttl = min(settings.RESPONSE_CACHE_LOCK_TTL, settings.RESPONSE_CACHE_TTL)
+        if not await self._call("add", f"{key}:lock", b"1", lock_ttl):
+            if not wait_for_lock:
+                return None  # Another process is refreshing it
+            deadline = time.monotonic() + LOCK_WAIT
+            while time.monotonic() < deadline:
+                await asyncio.sleep(LOCK_POLL_INTERVAL)
+                entry = await self._read(key)
+                if entry is not None:
+                    return entry[1]
+            # The other render is slow or died; render it here too
+        self.stats["renders"] += 1
+        try:
+            body = await render()
+        except Exception:
+            self.stats["render_errors"] += 1
+            raise
+        stale_at = self._clock() + settings.RESPONSE_CACHE_TTL
+        await self._call(
+            "set", key, _ENTRY_HEADER.pack(stale_at) + body,
+            settings.RESPONSE_CACHE_TTL + settings.RESPONSE_CACHE_STALE_TTL
+        )
+        return body
+
+    async def close(self) -> None:
+        """Cancel background refreshes and close the store's connections."""
+        for task in list(self._background):
+            task.cancel()
+        if self._primary is not None:
+            try:
+                await self._primary.close()
+            except Exception as e:
+                logger.error(f"Error closing the response cache store: {str(e)}")
+
+response_cache = ResponseCache()
@@ -6,9 +6,11 @@ from typing import List, Dict, Any, Optional
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import or_, func, case
 from sqlalchemy import select
+from sqlalchemy.orm import contains_eager
 from app.db import models, schemas
 import asyncio
 from app.services.image_cache_service import image_cache
+from app.services.book_service import fill_cover_details
 import logging
 
 logger = logging.getLogger(__name__)
@@ -37,6 +39,7 @@ async def get_typeahead_suggestions(db: AsyncSession, query: str, limit: int = 1
     result = await db.execute(
         select(models.Book, models.Author)
         .join(models.Author)
+        .options(contains_eager(models.Book.author))
         .where(
             or_(
                 # Title matches
@@ -66,20 +69,26 @@ async def get_typeahead_suggestions(db: AsyncSession, query: str, limit: int = 1
     
     # Format results
     for book, author in matches:
+        # Only use details already in the cache; typeahead must stay fast
+        await fill_cover_details(book, compute=False)
         suggestions.append(schemas.TypeaheadSuggestion(
             id=book.id,
             title=book.title,
             author=author.name if author else None,
-            cover_image_url=await convert_to_small_cover(book.cover_image_url)
+            cover_image_url=await convert_to_small_cover(book.cover_image_url),
+            cover_placeholder=book.cover_placeholder,
+            cover_color=book.cover_color,
+            cover_width=book.cover_width,
+            cover_height=book.cover_height
         ))
     
     return suggestions
 
 async def convert_to_small_cover(url: Optional[str]) -> Optional[str]:
-    """Convert an OpenLibrary cover URL to use the small (-S) size."""
+    """Convert a cached or OpenLibrary cover URL to use the small (-S) size."""
     if not url:
         return None
-    return re.sub(r'-[LM]\.jpg$', '-S.jpg', url)
+    return image_cache.get_variant_url(url, "S")
 
 async def _cache_cover_image(cover_url: str) -> None:
     """Cache a cover image in the background without blocking."""
@@ -145,9 +154,9 @@ async def search_books(db: AsyncSession, query: str, page: int = 1, per_page: in
                 cover_id = doc.get('cover_i')
                 cover_url = f"https://covers.openlibrary.org/b/id/{cover_id}-L.jpg" if cover_id and cover_id > 0 else None
                 
-                # Get cached URL if available
+                # Get cached URL if available, sized for result cards
                 if cover_url:
-                    cover_url = await image_cache.get_cached_url(cover_url)
+                    cover_url = await image_cache.get_cached_url(cover_url, size="M")
                 
                 result = {
                     'title': doc['title'],
@@ -0,0 +1,103 @@
+"""
+Benchmark analytics event ingestion against the database in DATABASE_URL.
+
+Writes --events synthetic events three ways and reports events per second:
+
+    python scripts/benchmark_event_ingest.py --events 100000
+
+"orm-per-row" adds and commits one AnalyticsEvent at a time, as a
+straightforward endpoint would. "orm-batched" adds a whole batch and
+commits once. "copy" is the EventBuffer path: buffered records bulk loaded
+with asyncpg's copy_records_to_table. The per-row mode is capped at
+--per-row-events to keep the run short. The benchmark's events are deleted
+afterwards.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from datetime import datetime, timezone
+
+# Add the project root to Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import delete
+from app.core.config import settings
+from app.db import schemas
+from app.db.database import SessionLocal, engine
+from app.db.models import AnalyticsEvent
+from app.services.event_service import EventBuffer
+
+EVENT_TYPE = "benchmark"
+
+def _events(count: int):
+    return [
+        schemas.EventIn(
+            event_type=EVENT_TYPE,
+            book_id=i % 1000,
+            session_id=f"session-{i % 5000}",
+            metadata={"query": f"query {i}", "results": i % 20}
+        )
+        for i in range(count)
+    ]
+
+async def orm_per_row(events) -> None:
+    async with SessionLocal() as db:
+        for event in events:
+            db.add(AnalyticsEvent(
+                occurred_at=datetime.now(timezone.utc),
+                event_type=event.event_type,
+                book_id=event.book_id,
+                session_id=event.session_id,
+                event_metadata=event.metadata
+            ))
+            await db.commit()
+
+async def orm_batched(events) -> None:
+    async with SessionLocal() as db:
+        db.add_all([
+            AnalyticsEvent(
+                occurred_at=datetime.now(timezone.utc),
+                event_type=event.event_type,
+                book_id=event.book_id,
+                session_id=event.session_id,
+                event_metadata=event.metadata
+            )
+            for event in events
+        ])
+        await db.commit()
+
+async def copy(events) -> None:
+    buffer = EventBuffer()
+    settings.EVENT_BUFFER_MAX_EVENTS = max(settings.EVENT_BUFFER_MAX_EVENTS, len(events))
+    buffer.add(events)
+    await buffer.flush()
+
+async def run(label: str, ingest, events) -> None:
+    start = time.perf_counter()
+    await ingest(events)
+    elapsed = time.perf_counter() - start
+    print(f"  {label:<12} {len(events):8d} events in {elapsed:7.2f}s  {len(events) / elapsed:10.0f} events/s")
+
+async def main(count: int, per_row_count: int) -> None:
+    engine.echo = False
+    await EventBuffer().ensure_partitions()
+    events = _events(count)
+    print(f"Ingesting {count} events")
+    try:
+        await run("orm-per-row", orm_per_row, events[:per_row_count])
+        await run("orm-batched", orm_batched, events)
+        await run("copy", copy, events)
+    finally:
+        async with SessionLocal() as db:
+            await db.execute(delete(AnalyticsEvent).where(AnalyticsEvent.event_type == EVENT_TYPE))
+            await db.commit()
+        await engine.dispose()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=100000)
+    parser.add_argument("--per-row-events", type=int, default=5000)
+    args = parser.parse_args()
+    asyncio.run(main(args.events, args.per_row_events))
@@ -0,0 +1,89 @@
+"""
+Benchmark memory use and throughput of the streaming analytics export.
+
+By default exports --rows synthetic visit rows through the export's
+encoder (no database needed), discarding the output:
+
+    python scripts/benchmark_export.py --rows 50000000 --format csv
+
+With --database it streams the real export of the visits table in
+DATABASE_URL instead, through the server-side cursor.
+
+Peak resident memory is reported at every tenth of the export: if the
+export streams, it stays flat however many rows have gone through.
+"""
+import argparse
+import asyncio
+import os
+import resource
+import sys
+import time
+from datetime import date, timedelta
+
+# Add the project root to Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core.config import settings
+from app.services import export_service
+
+def _peak_rss_mib() -> float:
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+async def _synthetic_batches(rows: int, batch_rows: int):
+    """
+    Visit rows as the visits export's query returns them, dates already
+    formatted by the database, for 10000 books a day.
+    """
+    first_day = date(2020, 1, 1)
+    for offset in range(0, rows, batch_rows):
+        batch = []
+        for row in range(offset, min(offset + batch_rows, rows)):
+            book_id = row % 10000 + 1
+            day = (first_day + timedelta(days=row // 10000)).isoformat()
+            timestamp = f"{day}T00:00:{row % 60:02d}.{row % 1000000:06d}Z"
+            batch.append((
+                book_id, f"Synthetic Book {book_id}", f"/works/OL{book_id}W",
+                day, row % 97 + 1, timestamp, timestamp
+            ))
+        yield batch
+        # Hand control back to the loop between batches, like the cursor does
+        await asyncio.sleep(0)
+
+async def main(rows: int, export_format: str, compress: bool, database: bool) -> None:
+    if database:
+        stream = export_service.stream_export("visits", export_format, compress=compress)
+    else:
+        columns = [column.name for column in export_service.export_query("visits").selected_columns]
+        stream = export_service.encode_rows(
+            columns, _synthetic_batches(rows, settings.EXPORT_BATCH_ROWS), export_format, compress
+        )
+    source = "database" if database else f"{rows} synthetic"
+    print(f"Exporting {source} visit rows as {export_format}{' gzipped' if compress else ''}")
+    print(f"  before export: peak RSS {_peak_rss_mib():7.1f} MiB")
+    start = time.perf_counter()
+    written = 0
+    next_report = 1
+    chunks = 0
+    async for chunk in stream:
+        written += len(chunk)
+        chunks += 1
+        # Report roughly every tenth of the synthetic rows
+        if not database and chunks * settings.EXPORT_BATCH_ROWS >= next_report * rows / 10:
+            print(f"  {next_report * 10:3d}% exported: peak RSS {_peak_rss_mib():7.1f} MiB, "
+                  f"{written / 1024 ** 2:8.1f} MiB written")
+            next_report += 1
+    elapsed = time.perf_counter() - start
+    print(f"  done in {elapsed:.1f}s: {written / 1024 ** 2:.1f} MiB written, "
+          f"peak RSS {_peak_rss_mib():.1f} MiB")
+    if not database:
+        print(f"  {rows / elapsed:,.0f} rows/s")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=50_000_000)
+    parser.add_argument("--format", choices=sorted(export_service.EXPORT_FORMATS), default="ndjson")
+    parser.add_argument("--no-gzip", action="store_true")
+    parser.add_argument("--database", action="store_true", help="Export the visits table in DATABASE_URL")
+    args = parser.parse_args()
+    asyncio.run(main(args.rows, args.format, not args.no_gzip, args.database))
@@ -0,0 +1,70 @@
+"""
+Measure HyperLogLog error against memory at different precisions.
+
+For each cardinality, adds that many distinct visitor ids to a sketch
+(--trials times, with different ids) and reports the mean and worst
+relative error of the estimate and the serialised size. Also checks that
+merging per-day sketches matches one sketch over the whole window, and
+times adding ids:
+
+    python scripts/benchmark_hyperloglog.py --precisions 12 14
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+# Add the project root to Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core.hyperloglog import HyperLogLog, hash_visitor
+
+def measure(precision: int, cardinality: int, trials: int):
+    errors = []
+    size = 0
+    for trial in range(trials):
+        sketch = HyperLogLog(precision)
+        for i in range(cardinality):
+            sketch.add_hash(hash_visitor(f"visitor-{trial}-{i}"))
+        errors.append(abs(sketch.count() - cardinality) / cardinality)
+        size = len(sketch.to_bytes())
+    return statistics.mean(errors), max(errors), size
+
+def merged_error(precision: int, visitors_per_day: int, days: int) -> float:
+    """Error of merging daily sketches where half of each day's visitors return the next day."""
+    merged = HyperLogLog(precision)
+    distinct = set()
+    for day in range(days):
+        sketch = HyperLogLog(precision)
+        for i in range(visitors_per_day):
+            visitor = f"visitor-{day * visitors_per_day // 2 + i}"
+            distinct.add(visitor)
+            sketch.add(visitor)
+        merged.merge(HyperLogLog.from_bytes(sketch.to_bytes()))
+    return abs(merged.count() - len(distinct)) / len(distinct)
+
+def main(precisions, cardinalities, trials: int) -> None:
+    for precision in precisions:
+        m = 1 << precision
+        print(f"precision {precision}: {m} registers, {m + 1} bytes dense, "
+              f"expected standard error {1.04 / m ** 0.5:.2%}")
+        for cardinality in cardinalities:
+            mean, worst, size = measure(precision, cardinality, trials)
+            print(f"  {cardinality:>9} visitors  mean error {mean:6.2%}  worst {worst:6.2%}  {size:>6} bytes")
+        print(f"  30 merged days of 2000 visitors: error {merged_error(precision, 2000, 30):.2%}")
+
+    sketch = HyperLogLog(precisions[0])
+    ids = [f"visitor-{i}" for i in range(200000)]
+    start = time.perf_counter()
+    for visitor in ids:
+        sketch.add(visitor)
+    print(f"Adding ids: {len(ids) / (time.perf_counter() - start):,.0f} per second")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--precisions", type=int, nargs="+", default=[12, 14])
+    parser.add_argument("--cardinalities", type=int, nargs="+", default=[10, 100, 1000, 10000, 100000, 1000000])
+    parser.add_argument("--trials", type=int, default=5)
+    args = parser.parse_args()
+    main(args.precisions, args.cardinalities, args.trials)
@@ -0,0 +1,153 @@
+"""
+Benchmark concurrent cold-cache popular-page loads against ImageCache.
+
+Starts a local cover server (no network needed) that serves generated JPEGs
+with a fixed delay, then simulates many visitors loading the popular page
+at once, each resolving the same set of cover URLs through a fresh cache:
+
+    python scripts/benchmark_image_cache.py --pages 50 --covers 12
+
+With --burst N it instead fetches N distinct cold covers at once. Both modes
+report event-loop lag, sampled by a ticker that should wake every 10ms.
+
+--report-bytes prints the cover bytes a homepage (12 cards) and a typeahead
+render (5 thumbnails) transfer when served full-size JPEG originals versus
+the sized WebP variants.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+from io import BytesIO
+from pathlib import Path
+
+# Add the project root to Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiohttp import web
+from PIL import Image
+
+from app.services.image_cache_service import ImageCache, build_cover_variants, variant_path
+
+def _make_jpeg(width: int = 500, height: int = 750) -> bytes:
+    buffer = BytesIO()
+    Image.effect_noise((width, height), 64).convert("RGB").save(buffer, "JPEG", quality=85)
+    return buffer.getvalue()
+
+def _make_cover(width: int = 400, height: int = 600) -> bytes:
+    """A cover-like JPEG: colour gradient, title blocks and light grain."""
+    gradient = Image.linear_gradient("L").resize((width, height))
+    cover = Image.merge("RGB", (gradient, gradient.rotate(90), Image.new("L", (width, height), 96)))
+    grain = Image.effect_noise((width, height), 12).convert("RGB")
+    cover = Image.blend(cover, grain, 0.15)
+    for i in range(6):
+        cover.paste((240, 240, 240), (40, 60 + i * 30, width - 40 - i * 25, 75 + i * 30))
+    buffer = BytesIO()
+    cover.save(buffer, "JPEG", quality=90)
+    return buffer.getvalue()
+
+def report_bytes() -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        original = Path(tmp) / ("0" * 32 + ".jpg")
+        data = _make_cover()
+        original.write_bytes(data)
+        build_cover_variants(str(original), ("webp",), data)
+
+        def size_of(size: str, fmt: str) -> int:
+            return variant_path(original, size, fmt).stat().st_size
+
+        print("Cover bytes per render (12 homepage cards, 5 typeahead thumbnails)")
+        print(f"  homepage  before (L jpg):  {12 * size_of('L', 'jpg') / 1024:.0f} KiB")
+        print(f"  homepage  after  (M webp): {12 * size_of('M', 'webp') / 1024:.0f} KiB")
+        print(f"  typeahead before (L jpg):  {5 * size_of('L', 'jpg') / 1024:.0f} KiB")
+        print(f"  typeahead after  (S webp): {5 * size_of('S', 'webp') / 1024:.1f} KiB")
+
+async def _start_cover_server(delay: float):
+    """Serve /b/id/<n>-L.jpg like covers.openlibrary.org, counting requests."""
+    jpeg = _make_jpeg()
+    stats = {"requests": 0}
+
+    async def cover(request):
+        stats["requests"] += 1
+        await asyncio.sleep(delay)
+        return web.Response(body=jpeg, content_type="image/jpeg")
+
+    app = web.Application()
+    app.router.add_get("/b/id/{name}", cover)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}", stats
+
+async def _monitor_loop_lag(samples: list, interval: float = 0.01) -> None:
+    """Record how late the event loop wakes a sleeping task."""
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(time.perf_counter() - start - interval)
+
+def _report_lag(samples: list) -> None:
+    if not samples:
+        return
+    samples = sorted(samples)
+    p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+    print(
+        f"  event-loop lag:    p50={statistics.median(samples) * 1000:.1f}ms "
+        f"p99={p99 * 1000:.1f}ms max={samples[-1] * 1000:.1f}ms"
+    )
+
+async def main(pages: int, covers: int, delay: float, burst: int) -> None:
+    runner, base_url, stats = await _start_cover_server(delay)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = ImageCache(cache_dir=Path(tmp))
+        lag_samples = []
+        monitor = asyncio.create_task(_monitor_loop_lag(lag_samples))
+
+        if burst:
+            urls = [f"{base_url}/b/id/{i}-L.jpg" for i in range(burst)]
+            start = time.perf_counter()
+            results = [await asyncio.gather(*(cache.get_cached_url(url) for url in urls))]
+            elapsed = time.perf_counter() - start
+            print(f"Burst of {burst} distinct cold cover fetches")
+            expected = burst
+        else:
+            urls = [f"{base_url}/b/id/{i}-L.jpg" for i in range(covers)]
+
+            async def load_page():
+                return await asyncio.gather(*(cache.get_cached_url(url) for url in urls))
+
+            start = time.perf_counter()
+            results = await asyncio.gather(*(load_page() for _ in range(pages)))
+            elapsed = time.perf_counter() - start
+            print(f"{pages} concurrent cold page loads x {covers} covers")
+            expected = pages * covers
+
+        monitor.cancel()
+        cached = sum(1 for page in results for url in page if url.startswith("/cache/images/"))
+        print(f"  elapsed:           {elapsed:.2f}s")
+        print(f"  upstream fetches:  {stats['requests']} (ideal {len(urls)})")
+        print(f"  covers resolved:   {cached}/{expected}")
+        _report_lag(lag_samples)
+
+        if hasattr(cache, "close"):
+            await cache.close()
+    await runner.cleanup()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=50)
+    parser.add_argument("--covers", type=int, default=12)
+    parser.add_argument("--delay", type=float, default=0.2, help="Upstream latency in seconds")
+    parser.add_argument("--burst", type=int, default=0, help="Fetch this many distinct covers at once instead")
+    parser.add_argument("--report-bytes", action="store_true", help="Report bytes per render instead")
+    args = parser.parse_args()
+    if args.report_bytes:
+        report_bytes()
+    else:
+        asyncio.run(main(args.pages, args.covers, args.delay, args.burst))
@@ -0,0 +1,111 @@
+"""
+Benchmark memory use of the image proxy with many concurrent large covers.
+
+Starts a local cover server (no network needed) that serves one large
+generated JPEG, then proxies it to N concurrent clients through a fresh
+cache, each under a distinct URL so every request is a miss:
+
+    python scripts/benchmark_image_proxy.py --clients 100
+
+Each client reads its response at a fixed pace (--client-delay seconds per
+64 KiB chunk). Peak Python heap (tracemalloc) is reported for the streaming
+proxy and for the previous approach of reading each upstream body fully
+into memory before sending it. Pixel decoding for variants runs in the
+worker pool after the response completes and is not counted.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from io import BytesIO
+from pathlib import Path
+
+# Add the project root to Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiohttp import web
+from PIL import Image
+
+from app.core.config import settings
+from app.services.image_cache_service import ImageCache
+
+def _make_large_cover(width: int, height: int) -> bytes:
+    buffer = BytesIO()
+    Image.effect_noise((width, height), 64).convert("RGB").save(buffer, "JPEG", quality=95)
+    return buffer.getvalue()
+
+async def _start_cover_server(cover: bytes):
+    async def serve(request):
+        response = web.StreamResponse(headers={"Content-Type": "image/jpeg"})
+        response.content_length = len(cover)
+        await response.prepare(request)
+        for start in range(0, len(cover), 64 * 1024):
+            await response.write(cover[start:start + 64 * 1024])
+        return response
+
+    app = web.Application()
+    app.router.add_get("/b/id/{name}", serve)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}"
+
+async def _streamed(cache: ImageCache, url: str, client_delay: float) -> int:
+    upstream = await cache.stream_upstream(url)
+    if not upstream:
+        return 0
+    _, body = upstream
+    sent = 0
+    async for chunk in body:
+        sent += len(chunk)
+        await asyncio.sleep(client_delay)
+    return sent
+
+async def _buffered(cache: ImageCache, url: str, client_delay: float) -> int:
+    async with cache._get_session().get(url) as response:
+        data = await response.read()
+    sent = 0
+    for start in range(0, len(data), 64 * 1024):
+        sent += len(data[start:start + 64 * 1024])
+        await asyncio.sleep(client_delay)
+    return sent
+
+async def run(mode: str, base_url: str, clients: int, client_delay: float) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = ImageCache(cache_dir=Path(tmp))
+        proxy = _streamed if mode == "streaming" else _buffered
+        urls = [f"{base_url}/b/id/{mode}-{i}-L.jpg" for i in range(clients)]
+        tracemalloc.start()
+        start = time.perf_counter()
+        sizes = await asyncio.gather(*(proxy(cache, url, client_delay) for url in urls))
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        # Let background cache stores finish before the directory goes away
+        await asyncio.gather(*cache._downloads.values())
+        await cache.close()
+    print(f"  {mode:<10} peak heap {peak / 1024 ** 2:7.1f} MiB  "
+          f"({sum(sizes) / 1024 ** 2:.0f} MiB proxied in {elapsed:.2f}s)")
+
+async def main(clients: int, width: int, height: int, client_delay: float) -> None:
+    cover = _make_large_cover(width, height)
+    settings.IMAGE_PROXY_ALLOWED_HOSTS = "127.0.0.1"
+    runner, base_url = await _start_cover_server(cover)
+    print(f"{clients} concurrent proxied covers of {len(cover) / 1024 ** 2:.1f} MiB")
+    await run("buffered", base_url, clients, client_delay)
+    await run("streaming", base_url, clients, client_delay)
+    await runner.cleanup()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=100)
+    parser.add_argument("--width", type=int, default=2000)
+    parser.add_argument("--height", type=int, default=3000)
+    parser.add_argument("--client-delay", type=float, default=0.002, help="Seconds per 64 KiB chunk sent")
+    args = parser.parse_args()
+    asyncio.run(main(args.clients, args.width, args.height, args.client_delay))
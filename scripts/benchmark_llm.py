@@ -0,0 +1,88 @@
+"""
+Benchmark the LLM endpoints end to end against the local stand-in provider.
+
+Runs entirely offline (apart from the local Postgres database used by the
+refresh endpoint):
+
+    LOCAL_LLM_LATENCY_MS=800 LOCAL_LLM_ERROR_RATE=0.02 \
+        python scripts/benchmark_llm.py --requests 200 --concurrency 20
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+# Force the stand-in before the app (and its settings) are imported
+os.environ["LLM_PROVIDER"] = "local"
+
+# Add the project root to Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+from sqlalchemy import select
+
+from app.main import app
+from app.db.database import SessionLocal
+from app.db.models import Book
+
+def _report(name: str, latencies: list, errors: int, elapsed: float) -> None:
+    if not latencies:
+        print(f"{name}: no successful requests ({errors} errors)")
+        return
+    latencies.sort()
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(
+        f"{name}: {len(latencies)} ok, {errors} errors, "
+        f"{len(latencies) / elapsed:.1f} req/s, "
+        f"p50={statistics.median(latencies) * 1000:.0f}ms p99={p99 * 1000:.0f}ms"
+    )
+
+async def _run(client: httpx.AsyncClient, name: str, requests: list, concurrency: int) -> None:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+
+    async def one(method: str, url: str, payload: dict = None):
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.request(method, url, json=payload)
+            if response.status_code == 200:
+                latencies.append(time.perf_counter() - start)
+            else:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(*request) for request in requests))
+    _report(name, latencies, errors, time.perf_counter() - start)
+
+async def main(total: int, concurrency: int) -> None:
+    async with SessionLocal() as db:
+        result = await db.execute(select(Book.id).limit(total))
+        book_ids = result.scalars().all()
+
+    async with httpx.AsyncClient(app=app, base_url="http://bench", timeout=None) as client:
+        await _run(
+            client,
+            "POST /api/llm/query",
+            [("POST", "/api/llm/query", {"title": f"Book {i}", "author": f"Author {i}"}) for i in range(total)],
+            concurrency
+        )
+        if book_ids:
+            await _run(
+                client,
+                "POST /api/llm/books/{id}/refresh",
+                [("POST", f"/api/llm/books/{book_ids[i % len(book_ids)]}/refresh") for i in range(total)],
+                concurrency
+            )
+        else:
+            print("No books in database; skipping refresh benchmark")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=10)
+    args = parser.parse_args()
+    asyncio.run(main(args.requests, args.concurrency))
@@ -0,0 +1,157 @@
+"""
+Benchmark the popular books query with and without the popularity rollups.
+
+Fills the database in DATABASE_URL with synthetic books, each visited on
+every day of the last year (--rows visit rows in total, 10M by default),
+rebuilds the rollups, then times the first and a deep page of the 365 day
+popular list, with totals, both ways:
+
+    python scripts/benchmark_popular_books.py --rows 10000000
+
+"aggregate" is the previous query, which sums every visit in the window
+and counts the result again for the total. "rollup" reads the window row
+for the total and a page of the window rank index. The cost of keeping the
+rollups current is shown by timing one flush-sized batch of visits and a
+day rollover. The synthetic data is removed afterwards; run it against a
+scratch database, as the rollups are rebuilt while it runs.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+# Add the project root to Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import text
+from app.db.database import SessionLocal, engine
+from app.services import analytics_service, popularity_service
+
+KEY_PREFIX = "/works/BENCHMARK"
+DAYS = 365
+
+async def _populate(rows: int) -> int:
+    """Insert the synthetic author, books and visits. Returns the number of books."""
+    books = -(-rows // DAYS)
+    async with SessionLocal() as db:
+        author_id = await db.scalar(text(
+            "INSERT INTO authors (name, open_library_key, created_at) "
+            "VALUES ('Benchmark Author', :key, now()) RETURNING id"
+        ), {"key": f"{KEY_PREFIX}A"})
+        await db.execute(text(
+            "INSERT INTO books (title, author_id, open_library_key, created_at) "
+            "SELECT 'Benchmark book ' || i, :author_id, :prefix || i, now() "
+            "FROM generate_series(1, :books) AS i"
+        ), {"author_id": author_id, "prefix": KEY_PREFIX, "books": books})
+        # Skewed counts so the ranking is not a tie: book i gets about books/i visits a day
+        await db.execute(text(
+            "INSERT INTO visits (book_id, visit_date, visit_count, created_at) "
+            "SELECT b.id, CURRENT_DATE - d, 1 + (:books / (row_number() OVER (ORDER BY b.id)))::int, now() "
+            "FROM books AS b CROSS JOIN generate_series(0, :days - 1) AS d "
+            "WHERE b.open_library_key LIKE :pattern"
+        ), {"books": books, "days": DAYS, "pattern": f"{KEY_PREFIX}%"})
+        await db.commit()
+        await db.execute(text("ANALYZE visits"))
+        await db.execute(text("ANALYZE books"))
+    return books
+
+async def _cleanup() -> None:
+    async with SessionLocal() as db:
+        pattern = {"pattern": f"{KEY_PREFIX}%"}
+        book_ids = "SELECT id FROM books WHERE open_library_key LIKE :pattern"
+        await db.execute(text(f"DELETE FROM popularity_rollups WHERE book_id IN ({book_ids})"), pattern)
+        await db.execute(text(f"DELETE FROM visits WHERE book_id IN ({book_ids})"), pattern)
+        await db.execute(text("DELETE FROM books WHERE open_library_key LIKE :pattern"), pattern)
+        await db.execute(text("DELETE FROM authors WHERE open_library_key LIKE :pattern"), pattern)
+        await db.commit()
+    async with SessionLocal() as db:
+        async with db.begin():
+            await popularity_service.rebuild(db, datetime.now().date())
+
+async def _rollup_page(db, limit: int, offset: int):
+    window = await popularity_service.get_window(db, DAYS)
+    return await popularity_service.get_ranked_books(db, DAYS, limit, offset), window.book_count
+
+async def _time(label: str, query, repeat: int) -> None:
+    timings = []
+    for _ in range(repeat):
+        async with SessionLocal() as db:
+            start = time.perf_counter()
+            await query(db)
+            timings.append((time.perf_counter() - start) * 1000)
+    print(f"  {label:<34} median {statistics.median(timings):9.2f} ms  max {max(timings):9.2f} ms")
+
+async def main(rows: int, repeat: int, per_page: int, deep_page: int) -> None:
+    engine.echo = False
+    print(f"Inserting {rows} visit rows...")
+    start = time.perf_counter()
+    books = await _populate(rows)
+    print(f"  {books} books x {DAYS} days in {time.perf_counter() - start:.1f}s")
+    try:
+        today = datetime.now().date()
+        start = time.perf_counter()
+        async with SessionLocal() as db:
+            async with db.begin():
+                await popularity_service.rebuild(db, today)
+        print(f"  Rebuilt rollups in {time.perf_counter() - start:.1f}s")
+
+        for page in (1, deep_page):
+            offset = (page - 1) * per_page
+            await _time(
+                f"aggregate page {page}",
+                lambda db: analytics_service._aggregate_popular_books(db, DAYS, per_page, offset, True),
+                repeat
+            )
+            await _time(
+                f"rollup page {page}",
+                lambda db: _rollup_page(db, per_page, offset),
+                repeat
+            )
+
+        # The two paths must agree
+        async with SessionLocal() as db:
+            aggregated, aggregated_total = await analytics_service._aggregate_popular_books(db, DAYS, 100, 0, True)
+            window = await popularity_service.get_window(db, DAYS)
+            ranked = await popularity_service.get_ranked_books(db, DAYS, 100)
+        assert window.book_count == aggregated_total, (window.book_count, aggregated_total)
+        assert [row[1] for row in ranked] == [row[1] for row in aggregated]
+        print("  Rollup ranking matches the aggregate")
+
+        async with SessionLocal() as db:
+            result = await db.execute(text(
+                "SELECT id FROM books WHERE open_library_key LIKE :pattern ORDER BY id LIMIT 5000"
+            ), {"pattern": f"{KEY_PREFIX}%"})
+            batch = [
+                {"book_id": book_id, "visit_date": today, "visit_count": 1}
+                for book_id in result.scalars()
+            ]
+        start = time.perf_counter()
+        async with SessionLocal() as db:
+            async with db.begin():
+                await popularity_service.apply_visits(db, batch, today)
+        print(f"  Applied a flush of {len(batch)} books in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+        # Pretend the rollups were last current yesterday to time a day rollover
+        async with SessionLocal() as db:
+            await db.execute(text("UPDATE popularity_windows SET as_of = as_of - 1"))
+            await db.commit()
+        start = time.perf_counter()
+        async with SessionLocal() as db:
+            async with db.begin():
+                await popularity_service.apply_visits(db, [], today)
+        print(f"  Rolled every window over one day in {(time.perf_counter() - start) * 1000:.1f} ms")
+    finally:
+        await _cleanup()
+        await engine.dispose()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10_000_000, help="Visit rows to insert")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--per-page", type=int, default=12)
+    parser.add_argument("--deep-page", type=int, default=50)
+    args = parser.parse_args()
+    asyncio.run(main(args.rows, args.repeat, args.per_page, args.deep_page))
@@ -0,0 +1,76 @@
+"""
+Benchmark requests per second on the popular books endpoint, with and
+without the response cache.
+
+Runs the app in-process (no server needed) against the database in
+DATABASE_URL, which should already hold books and visits (for example
+from scripts/benchmark_popular_books.py or bootstrap_books.py), and sends
+the homepage's request, /api/analytics/popular?page=N&per_page=12, from
+--concurrency clients for --duration seconds, cycling through the first
+--pages pages:
+
+    python scripts/benchmark_popular_endpoint.py --concurrency 50
+
+"uncached" disables the cache (POPULAR_CACHE_PAGES=0), so every request
+queries the rollups and resolves its covers. "cached" serves the stored
+response bytes; set REDIS_URL=memory:// to measure the in-process store
+without Redis.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+# Add the project root to Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+
+from app.core.config import settings
+from app.main import app
+from app.services.response_cache_service import response_cache
+
+async def _client(client: httpx.AsyncClient, pages: int, per_page: int, deadline: float, latencies: list) -> None:
+    page = 0
+    while time.perf_counter() < deadline:
+        page = page % pages + 1
+        start = time.perf_counter()
+        response = await client.get(f"/api/analytics/popular?page={page}&per_page={per_page}")
+        response.raise_for_status()
+        latencies.append(time.perf_counter() - start)
+
+async def run(mode: str, concurrency: int, duration: float, pages: int, per_page: int) -> None:
+    settings.POPULAR_CACHE_PAGES = pages if mode == "cached" else 0
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+        # Warm up connections, and the cache when it is used
+        for page in range(1, pages + 1):
+            (await client.get(f"/api/analytics/popular?page={page}&per_page={per_page}")).raise_for_status()
+        latencies = []
+        start = time.perf_counter()
+        await asyncio.gather(*(
+            _client(client, pages, per_page, start + duration, latencies) for _ in range(concurrency)
+        ))
+        elapsed = time.perf_counter() - start
+    latencies.sort()
+    print(f"  {mode:<9} {len(latencies) / elapsed:9.0f} req/s  "
+          f"median {statistics.median(latencies) * 1000:7.2f} ms  "
+          f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:7.2f} ms")
+
+async def main(concurrency: int, duration: float, pages: int, per_page: int) -> None:
+    print(f"{concurrency} clients for {duration:.0f}s over pages 1-{pages} of {per_page}")
+    await run("uncached", concurrency, duration, pages, per_page)
+    await run("cached", concurrency, duration, pages, per_page)
+    print(f"  cache stats: {response_cache.stats}")
+    await response_cache.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--pages", type=int, default=5)
+    parser.add_argument("--per-page", type=int, default=12)
+    args = parser.parse_args()
+    asyncio.run(main(args.concurrency, args.duration, args.pages, args.per_page))
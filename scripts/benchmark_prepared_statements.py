@@ -0,0 +1,105 @@
+"""
+Benchmark server-side planning time of the hot queries in each
+DATABASE_STATEMENT_MODE.
+
+Runs get_book, typeahead and record_visit's book lookup --iterations times
+per mode, over the books in DATABASE_URL, and reports per mode the client
+side mean latency and, from pg_stat_statements, how many times the server
+planned them and the planning and execution time it spent:
+
+    python scripts/benchmark_prepared_statements.py --iterations 2000
+
+"uncached" is the previous configuration: every statement prepared anew.
+"direct" keeps prepared statements per connection. The pgbouncer modes
+connect through --pgbouncer-url when given (transaction pooling;
+"pgbouncer_prepared" needs PgBouncer >= 1.21 with max_prepared_statements
+set) and directly otherwise. Planning time needs the pg_stat_statements
+extension with pg_stat_statements.track_planning = on; statements other
+clients run meanwhile are counted too.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+# Add the project root to Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import select, text
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.db import models
+from app.db.database import DATABASE_URL, engine, engine_kwargs, statement_connect_args
+from app.services import analytics_service, book_service, search_service
+
+MODES = ["uncached", "direct", "pgbouncer", "pgbouncer_prepared"]
+TYPEAHEAD_QUERIES = ["the", "har", "lord", "dune", "a", "king", "war", "love"]
+
+_RESET_STATS = text("SELECT pg_stat_statements_reset()")
+_READ_STATS = text(
+    "SELECT COALESCE(sum(plans), 0), COALESCE(sum(total_plan_time), 0), COALESCE(sum(total_exec_time), 0) "
+    "FROM pg_stat_statements WHERE query NOT LIKE '%pg_stat_statements%'"
+)
+
+def _connect_args(mode: str) -> dict:
+    ssl = engine_kwargs["connect_args"]["ssl"]
+    if mode == "uncached":
+        return {"statement_cache_size": 0, "prepared_statement_cache_size": 0, "ssl": ssl}
+    return {**statement_connect_args(mode, 256), "ssl": ssl}
+
+async def _hot_queries(db: AsyncSession, book_id: int, query: str) -> None:
+    await book_service.get_book(db, book_id)
+    await search_service.get_typeahead_suggestions(db, query)
+    # A fresh buffer, as its known books would skip the lookup
+    await analytics_service.VisitBuffer().book_exists(db, book_id)
+
+async def run(mode: str, url: str, book_ids, iterations: int, track_planning: bool) -> None:
+    mode_engine = create_async_engine(url, pool_size=1, max_overflow=0, connect_args=_connect_args(mode))
+    Session = sessionmaker(mode_engine, class_=AsyncSession, expire_on_commit=False)
+    try:
+        # Warm the connection and the image cache's cover details
+        async with Session() as db:
+            await _hot_queries(db, book_ids[0], TYPEAHEAD_QUERIES[0])
+        if track_planning:
+            async with engine.connect() as connection:
+                await connection.execute(_RESET_STATS)
+        start = time.perf_counter()
+        for i in range(iterations):
+            async with Session() as db:
+                await _hot_queries(db, book_ids[i % len(book_ids)], TYPEAHEAD_QUERIES[i % len(TYPEAHEAD_QUERIES)])
+        elapsed = time.perf_counter() - start
+    finally:
+        await mode_engine.dispose()
+    line = f"  {mode:<19} {elapsed / iterations * 1000:7.3f} ms per iteration"
+    if track_planning:
+        async with engine.connect() as connection:
+            plans, plan_ms, exec_ms = (await connection.execute(_READ_STATS)).one()
+        line += f"  plans {int(plans):7d}  planning {plan_ms:8.1f} ms  execution {exec_ms:8.1f} ms"
+    print(line, flush=True)
+
+async def main(iterations: int, modes, pgbouncer_url) -> None:
+    async with engine.connect() as connection:
+        book_ids = (await connection.execute(select(models.Book.id).limit(200))).scalars().all()
+        try:
+            track_planning = (await connection.scalar(text("SHOW pg_stat_statements.track_planning"))) == "on"
+        except Exception:
+            track_planning = False
+    if not book_ids:
+        sys.exit("The database has no books to query")
+    if not track_planning:
+        print("pg_stat_statements with track_planning is not available: reporting client latency only")
+    print(f"{iterations} iterations of 3 hot queries per mode")
+    for mode in modes:
+        url = pgbouncer_url if pgbouncer_url and mode.startswith("pgbouncer") else DATABASE_URL
+        await run(mode, url, book_ids, iterations, track_planning)
+    await engine.dispose()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--modes", default=",".join(MODES[:3]), help=f"comma separated, of {', '.join(MODES)}")
+    parser.add_argument("--pgbouncer-url", help="postgresql+asyncpg:// URL of a PgBouncer in front of the database")
+    args = parser.parse_args()
+    asyncio.run(main(args.iterations, args.modes.split(","), args.pgbouncer_url))
@@ -0,0 +1,122 @@
+"""
+Benchmark read endpoints on the read-only session against the read-write
+session they used before.
+
+Runs the app in-process against the database in DATABASE_URL, which should
+already hold books, and sends a mix of book detail, typeahead, popular and
+trending requests from --concurrency clients (default 100, well over the
+pool's 20 + 10 overflow connections) for --duration seconds:
+
+    python scripts/benchmark_read_sessions.py --concurrency 100
+
+"read-write" serves the read endpoints with get_db, which holds its
+connection in a transaction until the response is sent and then commits.
+"read-only" uses get_read_db, which runs in autocommit and returns the
+connection to the pool after each statement. Reported per mode: requests
+per second, median and p99 latency, and the time requests spent waiting
+for a pooled connection (mean, p99 and total). The response cache is
+disabled so every popular request reaches the database.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+# Add the project root to Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+from sqlalchemy import select
+
+from app.core.config import settings
+from app.db import models
+from app.db.database import engine, get_db, get_read_db, SessionLocal
+from app.main import app
+
+TYPEAHEAD_QUERIES = ["the", "har", "lord", "dune", "a", "king", "war", "love"]
+
+class PoolWaits:
+    """Times every checkout from the engine's pool, including waits for a free connection."""
+
+    def __init__(self):
+        self.waits = []
+        pool = engine.sync_engine.pool
+        self._pool = pool
+        self._do_get = pool._do_get
+
+        def timed_do_get():
+            start = time.perf_counter()
+            try:
+                return self._do_get()
+            finally:
+                self.waits.append(time.perf_counter() - start)
+
+        pool._do_get = timed_do_get
+
+    def reset(self):
+        self.waits = []
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)] if ordered else 0.0
+
+async def _client(client: httpx.AsyncClient, paths, offset: int, deadline: float, latencies: list) -> None:
+    i = offset
+    while time.perf_counter() < deadline:
+        path = paths[i % len(paths)]
+        i += 1
+        start = time.perf_counter()
+        response = await client.get(path)
+        response.raise_for_status()
+        latencies.append(time.perf_counter() - start)
+
+async def run(mode: str, paths, concurrency: int, duration: float, pool_waits: PoolWaits) -> None:
+    if mode == "read-write":
+        app.dependency_overrides[get_read_db] = get_db
+    else:
+        app.dependency_overrides.pop(get_read_db, None)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+        for path in paths[:concurrency]:
+            (await client.get(path)).raise_for_status()
+        pool_waits.reset()
+        latencies = []
+        start = time.perf_counter()
+        await asyncio.gather(*(
+            _client(client, paths, offset, start + duration, latencies) for offset in range(concurrency)
+        ))
+        elapsed = time.perf_counter() - start
+    waits = pool_waits.waits
+    print(f"  {mode:<10} {len(latencies) / elapsed:8.0f} req/s  "
+          f"median {statistics.median(latencies) * 1000:7.2f} ms  p99 {_percentile(latencies, 0.99) * 1000:7.2f} ms  "
+          f"pool wait mean {statistics.mean(waits) * 1000 if waits else 0:6.2f} ms  "
+          f"p99 {_percentile(waits, 0.99) * 1000:7.2f} ms  total {sum(waits):6.1f} s")
+
+async def main(concurrency: int, duration: float) -> None:
+    settings.POPULAR_CACHE_PAGES = 0
+    async with SessionLocal() as db:
+        book_ids = (await db.execute(select(models.Book.id).limit(200))).scalars().all()
+    if not book_ids:
+        sys.exit("The database has no books to request")
+    paths = []
+    for i, book_id in enumerate(book_ids):
+        paths.append(f"/api/books/{book_id}")
+        paths.append(f"/api/search/typeahead?q={TYPEAHEAD_QUERIES[i % len(TYPEAHEAD_QUERIES)]}")
+        if i % 4 == 0:
+            paths.append("/api/analytics/popular?page=1&per_page=12&days=30")
+            paths.append("/api/analytics/trending?limit=12")
+    pool = engine.sync_engine.pool
+    print(f"{concurrency} clients for {duration:.0f}s, pool of {pool.size()} + {pool._max_overflow} overflow")
+    pool_waits = PoolWaits()
+    await run("read-write", paths, concurrency, duration, pool_waits)
+    await run("read-only", paths, concurrency, duration, pool_waits)
+    await engine.dispose()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--duration", type=float, default=10.0)
+    args = parser.parse_args()
+    asyncio.run(main(args.concurrency, args.duration))
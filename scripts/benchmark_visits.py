@@ -0,0 +1,145 @@
+"""
+Benchmark visit recording throughput against the database in DATABASE_URL.
+
+Offers visits at a fixed rate (--rate per second, default 5000) spread over
+--books books for --duration seconds and reports the achieved rate, latency
+percentiles and how many increments reached the visits table:
+
+    python scripts/benchmark_visits.py --rate 5000 --duration 10
+
+"legacy" is the previous path: SELECT the book, SELECT today's visit row,
+increment it and commit, once per visit. "buffered" is record_visit, which
+counts in memory while the background flusher upserts every
+VISIT_FLUSH_INTERVAL seconds. Needs a migrated database with at least
+--books books; the visits written for today are deleted afterwards.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from datetime import datetime
+
+# Add the project root to Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import select, delete, func
+from app.db.database import SessionLocal, engine
+from app.db.models import Book, Visit
+from app.services import analytics_service
+
+async def _legacy_record_visit(book_id: int) -> None:
+    async with SessionLocal() as db:
+        book = await db.scalar(select(Book).where(Book.id == book_id))
+        if not book:
+            raise ValueError(f"Book {book_id} not found")
+        today = datetime.now().date()
+        visit = await db.scalar(
+            select(Visit).where(Visit.book_id == book_id, Visit.visit_date == today)
+        )
+        if visit:
+            visit.visit_count += 1
+            visit.updated_at = datetime.utcnow()
+        else:
+            db.add(Visit(
+                book_id=book_id,
+                visit_date=today,
+                visit_count=1,
+                created_at=datetime.utcnow(),
+                updated_at=datetime.utcnow()
+            ))
+        await db.commit()
+
+async def _buffered_record_visit(book_id: int) -> None:
+    async with SessionLocal() as db:
+        await analytics_service.record_visit(db, book_id)
+
+async def _visits_today(book_ids) -> int:
+    async with SessionLocal() as db:
+        return await db.scalar(
+            select(func.coalesce(func.sum(Visit.visit_count), 0))
+            .where(Visit.book_id.in_(book_ids), Visit.visit_date == datetime.now().date())
+        )
+
+async def _clear_visits_today(book_ids) -> None:
+    async with SessionLocal() as db:
+        await db.execute(
+            delete(Visit).where(Visit.book_id.in_(book_ids), Visit.visit_date == datetime.now().date())
+        )
+        await db.commit()
+
+async def run(mode: str, book_ids, rate: float, duration: float, max_in_flight: int) -> None:
+    record = _legacy_record_visit if mode == "legacy" else _buffered_record_visit
+    await _clear_visits_today(book_ids)
+    flusher = asyncio.create_task(analytics_service.visit_buffer.run_flusher()) if mode == "buffered" else None
+
+    slots = asyncio.Semaphore(max_in_flight)
+    latencies = []
+    errors = 0
+    dropped = 0
+
+    async def one(book_id: int) -> None:
+        nonlocal errors
+        try:
+            start = time.perf_counter()
+            await record(book_id)
+            latencies.append(time.perf_counter() - start)
+        except Exception:
+            errors += 1
+        finally:
+            slots.release()
+
+    tasks = []
+    total = int(rate * duration)
+    started = time.perf_counter()
+    for i in range(total):
+        delay = started + i / rate - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if slots.locked():
+            # The recorder has fallen behind; count the visit as shed rather than queueing it
+            dropped += 1
+            continue
+        await slots.acquire()
+        tasks.append(asyncio.create_task(one(book_ids[i % len(book_ids)])))
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+
+    if flusher:
+        flusher.cancel()
+        try:
+            await flusher
+        except asyncio.CancelledError:
+            pass
+        await analytics_service.visit_buffer.flush()
+    stored = await _visits_today(book_ids)
+    await _clear_visits_today(book_ids)
+
+    latencies.sort()
+    def percentile(p: float) -> float:
+        return latencies[min(int(len(latencies) * p), len(latencies) - 1)] * 1000 if latencies else 0.0
+    print(f"  {mode:<9} {len(latencies) / elapsed:8.0f} visits/s  "
+          f"p50 {percentile(0.5):7.2f} ms  p99 {percentile(0.99):7.2f} ms  "
+          f"shed {dropped}  errors {errors}  stored {stored}/{len(latencies)}")
+
+async def main(rate: float, duration: float, books: int, max_in_flight: int) -> None:
+    async with SessionLocal() as db:
+        result = await db.execute(select(Book.id).order_by(Book.id).limit(books))
+        book_ids = result.scalars().all()
+    if not book_ids:
+        print("No books in the database; run scripts/bootstrap_books.py first")
+        return
+    print(f"Offering {rate:.0f} visits/s for {duration:.0f}s over {len(book_ids)} books "
+          f"(at most {max_in_flight} in flight)")
+    await run("legacy", book_ids, rate, duration, max_in_flight)
+    await run("buffered", book_ids, rate, duration, max_in_flight)
+    await engine.dispose()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rate", type=float, default=5000.0, help="Visits offered per second")
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--books", type=int, default=100)
+    parser.add_argument("--max-in-flight", type=int, default=500)
+    args = parser.parse_args()
+    asyncio.run(main(args.rate, args.duration, args.books, args.max_in_flight))
@@ -229,6 +229,7 @@ async def bootstrap_books(start: int = 0, limit: int = None):
                 # Record a visit for the new book
                 try:
                     await analytics_service.record_visit(session, book.id)
+                    await analytics_service.visit_buffer.flush()
                     print(f"Recorded visit for book: {title}")
                 except Exception as e:
                     print(f"Error recording visit for book '{title}': {str(e)}")
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""
+Detach analytics event partitions older than the retention period.
+
+Detaching a month is a catalog change rather than a DELETE of its rows,
+so retention costs the same however many events the month holds. The
+detached tables are left in place for archiving unless --drop is given:
+
+    python scripts/event_retention.py --keep-months 13 --drop
+"""
+import argparse
+import asyncio
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+
+# Add the project root to Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.db.database import SessionLocal
+from app.services import event_service
+
+async def main(keep_months: int, drop: bool, dry_run: bool) -> None:
+    # Keep the current month and the keep_months - 1 before it
+    cutoff = event_service.month_start(datetime.now(timezone.utc).date())
+    for _ in range(keep_months - 1):
+        cutoff = event_service.month_start(cutoff - timedelta(days=1))
+    async with SessionLocal() as db:
+        if dry_run:
+            expired = [
+                name for name, month in await event_service.list_partitions(db)
+                if event_service.next_month(month) <= cutoff
+            ]
+            print(f"Would detach {len(expired)} partitions: {', '.join(expired) or '-'}")
+            return
+        async with db.begin():
+            detached = await event_service.detach_partitions_before(db, cutoff, drop=drop)
+    print(f"{'Dropped' if drop else 'Detached'} {len(detached)} partitions: {', '.join(detached) or '-'}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--keep-months", type=int, default=13, help="Months of events to keep, including the current one")
+    parser.add_argument("--drop", action="store_true", help="Drop detached partitions instead of keeping them as tables")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+    if args.keep_months < 2:
+        # Events up to a day old are still accepted into last month's partition
+        parser.error("--keep-months must be at least 2")
+    asyncio.run(main(args.keep_months, args.drop, args.dry_run))
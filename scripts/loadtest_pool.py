@@ -0,0 +1,123 @@
+"""
+Load test the connection pool: find the concurrency at which it saturates.
+
+Runs the app in-process against the database in DATABASE_URL, which should
+already hold books, and sends book detail and typeahead requests from a
+growing number of clients (--steps, default 5 to 320), --duration seconds
+per step:
+
+    python scripts/loadtest_pool.py --steps 5,10,20,40,80,160,320
+
+Reported per step, with the pool's own metrics: requests per second,
+median and p99 latency, mean and max checkout wait, checkout timeouts and
+the most connections in use. The pool saturates at the step where every
+connection is in use and throughput stops growing while checkouts start
+waiting; past it, added clients only queue. Size the pool with
+DATABASE_MAX_CONNECTIONS and WEB_CONCURRENCY (or DATABASE_POOL_SIZE and
+DATABASE_MAX_OVERFLOW) and rerun to compare. The response cache is
+disabled so every request reaches the database.
+
+--transactional-reads serves the read endpoints from get_db's session
+instead, one transaction per request held until the response is sent, as
+before the read-only sessions, to compare the two at the same load.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+# Add the project root to Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+from sqlalchemy import select
+
+from app.core.config import settings
+from app.db import models
+from app.db.database import engine, SessionLocal, get_db, get_read_db
+from app.db.pool_metrics import pool_metrics
+from app.main import app
+
+TYPEAHEAD_QUERIES = ["the", "har", "lord", "dune", "a", "king", "war", "love"]
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)] if ordered else 0.0
+
+async def _client(client: httpx.AsyncClient, paths, offset: int, deadline: float, latencies: list, errors: list) -> None:
+    i = offset
+    while time.perf_counter() < deadline:
+        path = paths[i % len(paths)]
+        i += 1
+        start = time.perf_counter()
+        try:
+            response = await client.get(path)
+            response.raise_for_status()
+        except Exception as e:
+            errors.append(e)
+            continue
+        latencies.append(time.perf_counter() - start)
+
+async def run_step(client: httpx.AsyncClient, paths, concurrency: int, duration: float) -> float:
+    metrics = pool_metrics[0]
+    waits, wait_total, timeouts = metrics.waits, metrics.wait_total, metrics.timeouts
+    metrics.wait_max = 0.0
+    metrics.max_in_use = 0
+    latencies, errors = [], []
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        _client(client, paths, offset, start + duration, latencies, errors) for offset in range(concurrency)
+    ))
+    elapsed = time.perf_counter() - start
+    step_waits = metrics.waits - waits
+    rate = len(latencies) / elapsed
+    print(f"  {concurrency:5d} clients {rate:8.0f} req/s  "
+          f"median {statistics.median(latencies) * 1000 if latencies else 0:8.2f} ms  "
+          f"p99 {_percentile(latencies, 0.99) * 1000:8.2f} ms  "
+          f"wait mean {(metrics.wait_total - wait_total) * 1000 / step_waits if step_waits else 0:7.2f} ms  "
+          f"max {metrics.wait_max * 1000:8.2f} ms  timeouts {metrics.timeouts - timeouts:4d}  "
+          f"errors {len(errors):4d}  in use {metrics.max_in_use:3d}", flush=True)
+    return rate
+
+async def main(steps, duration: float, transactional_reads: bool) -> None:
+    settings.POPULAR_CACHE_PAGES = 0
+    if transactional_reads:
+        app.dependency_overrides[get_read_db] = get_db
+    async with SessionLocal() as db:
+        book_ids = (await db.execute(select(models.Book.id).limit(200))).scalars().all()
+    if not book_ids:
+        sys.exit("The database has no books to request")
+    paths = []
+    for i, book_id in enumerate(book_ids):
+        paths.append(f"/api/books/{book_id}")
+        paths.append(f"/api/search/typeahead?q={TYPEAHEAD_QUERIES[i % len(TYPEAHEAD_QUERIES)]}")
+    pool = engine.sync_engine.pool
+    print(f"Pool of {pool.size()} + {pool._max_overflow} overflow, checkout timeout {pool.timeout():.0f}s, "
+          f"{duration:.0f}s per step, {'transactional' if transactional_reads else 'read-only'} read sessions")
+    transport = httpx.ASGITransport(app=app)
+    saturated_at = None
+    best_rate = 0.0
+    async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=None) as client:
+        for path in paths[:steps[0]]:
+            (await client.get(path)).raise_for_status()
+        for concurrency in steps:
+            rate = await run_step(client, paths, concurrency, duration)
+            if saturated_at is None and best_rate and rate < best_rate * 1.05:
+                saturated_at = concurrency
+            best_rate = max(best_rate, rate)
+    if saturated_at:
+        print(f"Throughput stopped growing at {saturated_at} clients ({best_rate:.0f} req/s at best)")
+    else:
+        print(f"Throughput still growing at {steps[-1]} clients: add steps to find the saturation point")
+    await engine.dispose()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--steps", default="5,10,20,40,80,160,320", help="comma separated client counts")
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--transactional-reads", action="store_true",
+                        help="serve the read endpoints from get_db's transactional session")
+    args = parser.parse_args()
+    asyncio.run(main([int(step) for step in args.steps.split(",")], args.duration, args.transactional_reads))
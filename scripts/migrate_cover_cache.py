@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Migrate the cover cache from the flat layout (static/cache/images/<md5>.jpg)
+to the sharded one (static/cache/images/ab/cd/<md5>.jpg).
+
+Moves the cached files into their shard directories, then rewrites
+books.cover_image_url values that point at flat cache URLs, one batch of
+books per transaction so the table is never locked for long:
+
+    python scripts/migrate_cover_cache.py --batch-size 500
+
+Old flat URLs keep resolving while the migration runs, so it can be run
+against a live site and resumed if interrupted.
+"""
+import argparse
+import asyncio
+import os
+import sys
+
+# Add the project root to Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import select, update, bindparam
+from app.db.database import SessionLocal
+from app.db.models import Book
+from app.services.image_cache_service import image_cache
+
+async def rewrite_cover_urls(batch_size: int, dry_run: bool) -> int:
+    """Rewrite flat cached cover URLs to sharded ones. Returns the number of books updated."""
+    last_id = 0
+    updated = 0
+    while True:
+        async with SessionLocal() as db:
+            result = await db.execute(
+                select(Book.id, Book._image_url)
+                .where(Book.id > last_id, Book._image_url.like('/cache/images/%'))
+                .order_by(Book.id)
+                .limit(batch_size)
+            )
+            rows = result.all()
+            if not rows:
+                return updated
+            last_id = rows[-1].id
+
+            changes = []
+            for book_id, url in rows:
+                new_url = image_cache.get_variant_url(url, "L")
+                if new_url != url:
+                    changes.append({"book_id": book_id, "new_url": new_url})
+            if changes and not dry_run:
+                await db.execute(
+                    update(Book.__table__)
+                    .where(Book.__table__.c.id == bindparam("book_id"))
+                    .values(cover_image_url=bindparam("new_url")),
+                    changes
+                )
+                await db.commit()
+            updated += len(changes)
+            print(f"Rewrote {len(changes)} cover URLs (books up to id {last_id})")
+
+async def main(batch_size: int, dry_run: bool, skip_files: bool, skip_db: bool) -> None:
+    if not skip_files and not dry_run:
+        moved = await asyncio.to_thread(image_cache.shard_legacy_files)
+        print(f"Moved {moved} cached files into shard directories")
+    if not skip_db:
+        updated = await rewrite_cover_urls(batch_size, dry_run)
+        print(f"{'Would rewrite' if dry_run else 'Rewrote'} {updated} cover URLs in total")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--dry-run", action="store_true", help="Report URL rewrites without moving or writing anything")
+    parser.add_argument("--skip-files", action="store_true", help="Only rewrite database URLs")
+    parser.add_argument("--skip-db", action="store_true", help="Only move cached files")
+    args = parser.parse_args()
+    asyncio.run(main(args.batch_size, args.dry_run, args.skip_files, args.skip_db))
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Recompute trending scores from the visits table.
+
+By default the recomputed scores are compared with the incrementally
+maintained ones, decayed to now, and nothing is written:
+
+    python scripts/recompute_trending.py --top 50
+
+The recomputation treats each day's visits as happening at midday, so
+small differences are expected; large ones point at lost flushes. With
+--apply the stored scores are replaced, which is needed after changing
+TRENDING_HALF_LIFE_DAYS and to fill them in after the migration adding
+them.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+from datetime import datetime, timezone
+
+# Add the project root to Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import select
+from app.db.database import SessionLocal
+from app.db.models import Book
+from app.services import popularity_service
+
+async def check(top: int) -> None:
+    now = datetime.now(timezone.utc)
+    async with SessionLocal() as db:
+        recomputed = await popularity_service.recompute_trending(db, now)
+        result = await db.execute(
+            select(Book.id, Book.trending_score, Book.trending_updated_at).where(Book.trending_score.isnot(None))
+        )
+        stored = {
+            book_id: popularity_service.current_trending_score(
+                Book(trending_score=score, trending_updated_at=updated_at), now
+            )
+            for book_id, score, updated_at in result.all()
+        }
+
+    errors = [
+        abs(stored.get(book_id, 0.0) - score) / score
+        for book_id, score in recomputed.items()
+    ]
+    print(f"{len(recomputed)} books with visits, {len(stored)} with a stored score")
+    if errors:
+        print(f"Relative error: median {statistics.median(errors):.2%}, max {max(errors):.2%}")
+    top_recomputed = set(sorted(recomputed, key=recomputed.get, reverse=True)[:top])
+    top_stored = set(sorted(stored, key=stored.get, reverse=True)[:top])
+    print(f"Top {top} overlap: {len(top_recomputed & top_stored)}/{len(top_recomputed)}")
+    missing = set(stored) - set(recomputed)
+    if missing:
+        print(f"{len(missing)} books have a stored score but no visits")
+
+async def apply() -> None:
+    async with SessionLocal() as db:
+        async with db.begin():
+            scores = await popularity_service.recompute_trending(db, datetime.now(timezone.utc), apply=True)
+    print(f"Stored trending scores for {len(scores)} books")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--apply", action="store_true", help="Replace the stored scores with the recomputed ones")
+    parser.add_argument("--top", type=int, default=50, help="Size of the top list to compare")
+    args = parser.parse_args()
+    asyncio.run(apply() if args.apply else check(args.top))
@@ -1,45 +1,41 @@
-from sqlalchemy import create_engine, select
-from sqlalchemy.orm import sessionmaker
-import os
+"""
+Write visits (or analytics events) to stdout as CSV or NDJSON.
+
+Streams through the same server-side cursor as GET /api/analytics/export,
+so it works on any number of rows:
+
+    python scripts/show_visits.py --start 2024-01-01 --end 2024-01-31 > visits.csv
+    python scripts/show_visits.py --dataset events --format ndjson --gzip > events.ndjson.gz
+"""
+import argparse
+import asyncio
 import sys
+from datetime import date
 from pathlib import Path
 
 # Add the app directory to the Python path
 app_dir = Path(__file__).resolve().parent.parent
 sys.path.append(str(app_dir))
 
-from app.db.models import Visit, Book
-from app.core.config import get_settings
-
-settings = get_settings()
-
-def show_all_visits():
-    # Create engine and session
-    engine = create_engine(settings.DATABASE_URL)
-    Session = sessionmaker(bind=engine)
-    session = Session()
+from app.db.database import engine
+from app.services import export_service
 
+async def show_visits(dataset: str, export_format: str, start, end, book_ids, compress: bool) -> None:
+    out = sys.stdout.buffer
     try:
-        # Query all visits with book information
-        query = select(Visit, Book).join(Book)
-        results = session.execute(query).all()
-
-        if not results:
-            print("No visits found in the database.")
-            return
-
-        print("\nAll visits in the database:")
-        print("-" * 80)
-        print(f"{'Book ID':<8} {'Book Title':<30} {'Visit Date':<12} {'Visit Count':<11} {'Created At':<20}")
-        print("-" * 80)
-
-        for visit, book in results:
-            print(f"{visit.book_id:<8} {book.title[:28]:<30} {visit.visit_date} {visit.visit_count:<11} {visit.created_at}")
-
-    except Exception as e:
-        print(f"Error: {e}")
+        async for chunk in export_service.stream_export(dataset, export_format, start, end, book_ids, compress):
+            out.write(chunk)
+        out.flush()
     finally:
-        session.close()
+        await engine.dispose()
 
 if __name__ == "__main__":
-    show_all_visits()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dataset", choices=sorted(export_service.EXPORT_DATASETS), default="visits")
+    parser.add_argument("--format", choices=sorted(export_service.EXPORT_FORMATS), default="csv")
+    parser.add_argument("--start", type=date.fromisoformat, help="First day, YYYY-MM-DD")
+    parser.add_argument("--end", type=date.fromisoformat, help="Last day, inclusive")
+    parser.add_argument("--book-id", type=int, action="append", help="Only this book; repeat for several")
+    parser.add_argument("--gzip", action="store_true", help="Compress the output")
+    args = parser.parse_args()
+    asyncio.run(show_visits(args.dataset, args.format, args.start, args.end, args.book_id, args.gzip))
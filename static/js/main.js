@@ -22,6 +22,52 @@ let currentPage = 1;
 let currentSearchTimeout = null;
 let selectedSearchIndex = -1;
 
+// Analytics events, sent in batches with navigator.sendBeacon
+const EVENT_BATCH_SIZE = 20;
+const EVENT_FLUSH_DELAY_MS = 5000;
+const pendingEvents = [];
+let eventFlushTimer = null;
+
+function getAnalyticsSessionId() {
+    let sessionId = sessionStorage.getItem('analyticsSessionId');
+    if (!sessionId) {
+        sessionId = Math.random().toString(36).slice(2) + Date.now().toString(36);
+        sessionStorage.setItem('analyticsSessionId', sessionId);
+    }
+    return sessionId;
+}
+
+function trackEvent(eventType, bookId = null, metadata = null) {
+    pendingEvents.push({
+        event_type: eventType,
+        book_id: bookId,
+        session_id: getAnalyticsSessionId(),
+        occurred_at: new Date().toISOString(),
+        metadata
+    });
+    if (pendingEvents.length >= EVENT_BATCH_SIZE) {
+        flushEvents();
+    } else if (!eventFlushTimer) {
+        eventFlushTimer = setTimeout(flushEvents, EVENT_FLUSH_DELAY_MS);
+    }
+}
+
+function flushEvents() {
+    clearTimeout(eventFlushTimer);
+    eventFlushTimer = null;
+    if (!pendingEvents.length) return;
+    const body = JSON.stringify({ events: pendingEvents.splice(0, pendingEvents.length) });
+    // sendBeacon survives the page being closed; fall back to a keepalive fetch
+    if (!(navigator.sendBeacon && navigator.sendBeacon('/api/analytics/events', body))) {
+        fetch('/api/analytics/events', { method: 'POST', body, keepalive: true }).catch(() => {});
+    }
+}
+
+document.addEventListener('visibilitychange', () => {
+    if (document.visibilityState === 'hidden') flushEvents();
+});
+window.addEventListener('pagehide', flushEvents);
+
 // Debounce function
 function debounce(func, wait) {
     let timeout;
@@ -41,6 +87,20 @@ function getMediumCoverUrl(url) {
     return url.replace(/-[LS]\.jpg$/, '-M.jpg');
 }
 
+// Paint the cover's placeholder (or dominant colour) until the image loads
+function coverPlaceholderStyle(book) {
+    const styles = [];
+    if (book.cover_color) styles.push(`background-color: ${book.cover_color}`);
+    if (book.cover_placeholder) styles.push(`background-image: url('${book.cover_placeholder}'); background-size: cover`);
+    return styles.join('; ');
+}
+
+// Intrinsic size attributes so the browser reserves the cover's layout space
+function coverSizeAttributes(book) {
+    return book.cover_width && book.cover_height ?
+        `width="${book.cover_width}" height="${book.cover_height}"` : '';
+}
+
 // Create book card HTML
 function createBookCard(book, onclick) {
     return `
@@ -50,8 +110,9 @@ function createBookCard(book, onclick) {
                 ${book.cover_image_url ? 
                     `<img src="${getMediumCoverUrl(book.cover_image_url)}" 
                          alt="${book.title}" 
+                         ${coverSizeAttributes(book)}
                          class="h-full w-auto object-contain"
-                         style="min-height: 100%;">` :
+                         style="min-height: 100%; ${coverPlaceholderStyle(book)}">` :
                     '<div class="w-full h-full bg-gray-200 flex items-center justify-center text-gray-400 text-xs">No cover</div>'
                 }
             </div>
@@ -171,7 +232,7 @@ async function handleSearchInput(event) {
                      onclick="window.location.href = '/book?id=${book.id}'">
                     <div class="flex items-center">
                         ${book.cover_image_url ? 
-                            `<img src="${book.cover_image_url}" alt="${book.title}" class="w-10 h-14 object-cover rounded mr-3">` :
+                            `<img src="${book.cover_image_url}" alt="${book.title}" class="w-10 h-14 object-cover rounded mr-3" style="${coverPlaceholderStyle(book)}">` :
                             `<div class="w-10 h-14 bg-gray-200 rounded mr-3 flex items-center justify-center text-center text-gray-400 text-xs"></div>`
                         }
                         <div>
@@ -219,7 +280,8 @@ async function loadPopularBooks(appendToExisting = false) {
             throw new Error(`Failed to load popular books: ${response.status} ${errorText}`);
         }
         
-        const books = await response.json();
+        const data = await response.json();
+        const books = data.books;
         console.log('Received books:', books); // Debug log
         
         if (!books || !books.length) {
@@ -230,11 +292,9 @@ async function loadPopularBooks(appendToExisting = false) {
             return;
         }
         
-        // Get pagination info from the first book
-        if (books[0]) {
-            hasMoreBooks = books[0]._has_more;
-            currentPage = books[0]._page;
-        }
+        // Pagination info for the whole page
+        hasMoreBooks = data.has_more;
+        currentPage = data.page;
         
         const booksHtml = books.map(book => 
             createBookCard(book, `handleBookClick('${book.id}')`)
@@ -361,7 +421,9 @@ async function showBookDetails(bookId) {
             document.getElementById('book-cover').innerHTML = `
                 <img src="${book.cover_image_url}" 
                      alt="${book.title}" 
-                     class="w-full h-full object-contain">`;
+                     ${coverSizeAttributes(book)}
+                     class="w-full h-full object-contain"
+                     style="${coverPlaceholderStyle(book)}">`;
         } else {
             document.getElementById('book-cover').innerHTML = `
                 <div class="w-full h-full bg-gray-200 flex items-center justify-center text-gray-400">
@@ -373,6 +435,7 @@ async function showBookDetails(bookId) {
         if (book.affiliate_links && book.affiliate_links.amazon) {
             document.getElementById('book-button').innerHTML = `
                 <a href="${book.affiliate_links}" 
+                   onclick="trackEvent('affiliate_click', ${book.id}, { store: 'amazon' })"
                    target="_blank" 
                    rel="noopener noreferrer" 
                    class="inline-flex items-center px-4 py-2 border border-transparent text-base font-medium rounded-md shadow-sm text-white bg-indigo-600 hover:bg-indigo-700 focus:outline-none focus:ring-2 focus:ring-offset-2 focus:ring-indigo-500">
@@ -428,6 +491,7 @@ async function recordVisit(bookId) {
 // Refresh book digest
 async function refreshBookDigest() {
     if (!currentBookId) return;
+    trackEvent('digest_refresh', currentBookId);
     
     try {
         // Show loading state
@@ -538,6 +602,7 @@ if (searchForm) {
         e.preventDefault();
         const query = searchInput.value.trim();
         if (query) {
+            trackEvent('search', null, { query });
             window.location.href = `/api/search/books/view?q=${encodeURIComponent(query)}`;
         }
     });
@@ -1,10 +1,19 @@
+import functools
+import os
 import pytest
+import pytest_asyncio
+from unittest.mock import patch
 from fastapi.testclient import TestClient
+from httpx import AsyncClient
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
 from app.main import app
-from app.db.database import Base, get_db
+from app.db.database import Base, ReadSessionLocal, get_db, get_read_db, _asyncpg_url
 from app.db.models import Book, Author, Visit
+from app.db import models
+from app.services import analytics_service
+from tests.query_budget import capture_queries
 
 # Use SQLite in-memory database for testing
 SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
@@ -37,8 +46,10 @@ def client(test_db):
             test_db.close()
     
     app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_read_db] = override_get_db
     yield TestClient(app)
     del app.dependency_overrides[get_db]
+    del app.dependency_overrides[get_read_db]
 
 @pytest.fixture
 def sample_data(test_db):
@@ -77,3 +88,66 @@ def sample_data(test_db):
     test_db.commit()
 
     return {"author": author, "books": books}
+
+# Postgres for the query budget and plan tests, which are skipped without
+# it locally and fail without it in CI
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+
+@pytest_asyncio.fixture
+async def pg_engine():
+    if not TEST_DATABASE_URL:
+        if os.getenv("CI"):
+            pytest.fail("TEST_DATABASE_URL is not set: the query budget and plan tests need Postgres")
+        pytest.skip("TEST_DATABASE_URL is not set")
+    engine = create_async_engine(_asyncpg_url(TEST_DATABASE_URL))
+    async with engine.begin() as conn:
+        await conn.run_sync(models.Base.metadata.create_all)
+    try:
+        yield engine
+    finally:
+        async with engine.begin() as conn:
+            await conn.run_sync(models.Base.metadata.drop_all)
+        await engine.dispose()
+
+@pytest_asyncio.fixture
+async def pg_books(pg_engine):
+    async with AsyncSession(pg_engine, expire_on_commit=False) as db:
+        author = Author(name="Frank Herbert", open_library_key="OL79034A")
+        books = [
+            Book(title="Dune", open_library_key="OL893415W", author=author),
+            Book(title="Dune Messiah", open_library_key="OL893526W", author=author),
+        ]
+        db.add_all(books)
+        await db.commit()
+    return books
+
+@pytest_asyncio.fixture
+async def pg_client(pg_engine):
+    """Client of the app with its sessions on the test Postgres."""
+    Session = sessionmaker(pg_engine, class_=AsyncSession, expire_on_commit=False)
+    read_engine = pg_engine.execution_options(isolation_level="AUTOCOMMIT")
+
+    async def override_get_db():
+        async with Session() as session:
+            yield session
+            await session.commit()
+
+    async def override_get_read_db():
+        async with ReadSessionLocal(bind=read_engine) as session:
+            yield session
+
+    app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_read_db] = override_get_read_db
+    try:
+        # A fresh visit buffer, so no book is known to exist without a query
+        with patch.object(analytics_service, "visit_buffer", analytics_service.VisitBuffer()):
+            async with AsyncClient(app=app, base_url="http://test") as client:
+                yield client
+    finally:
+        del app.dependency_overrides[get_db]
+        del app.dependency_overrides[get_read_db]
+
+@pytest.fixture
+def count_queries(pg_engine):
+    """capture_queries on the test Postgres: with count_queries() as log: ..."""
+    return functools.partial(capture_queries, pg_engine)
@@ -0,0 +1,122 @@
+"""
+Query budgets: how many SQL statements an endpoint may issue per call.
+
+Budgets are declared per route in ROUTE_BUDGETS. A test decorated with
+@query_budget(route) fails, listing the statements it ran, when its body
+issues more statements (or spends more time in the database) than the
+route's budget. The count_queries fixture records the same for tests
+that check a budget themselves:
+
+    @query_budget("GET /api/books/{book_id}")
+    async def test_book_detail(pg_client, pg_books):
+        await pg_client.get(f"/api/books/{pg_books[0].id}")
+
+Statements are counted on the engine of the pg_engine fixture, against
+the Postgres in TEST_DATABASE_URL; the tests are skipped without it.
+"""
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from sqlalchemy import event
+from typing import Any, Iterator, List, NamedTuple, Optional
+import functools
+import inspect
+import re
+import time
+
+@dataclass(frozen=True)
+class Budget:
+    max_queries: int
+    max_ms: Optional[float] = None
+
+ROUTE_BUDGETS = {
+    "GET /api/search/typeahead": Budget(1),
+    "GET /api/books/{book_id}": Budget(1),
+    # The book's existence check; none once the book is known
+    "POST /api/analytics/visit/{book_id}": Budget(1),
+    # Book (with its author) select, then the author and book updates
+    "PATCH /api/admin/books/{book_id}": Budget(3),
+}
+
+_WHITESPACE = re.compile(r"\s+")
+
+class Statement(NamedTuple):
+    text: str
+    seconds: float
+    parameters: Any = None
+    # The SQL expression compiled into text, when it was not a raw string
+    clause: Any = None
+
+@dataclass
+class QueryLog:
+    statements: List[Statement] = field(default_factory=list)
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+    @property
+    def total_ms(self) -> float:
+        return sum(statement.seconds for statement in self.statements) * 1000
+
+    def report(self) -> str:
+        return "\n".join(
+            f"  {i}. ({statement.seconds * 1000:.2f} ms) {_WHITESPACE.sub(' ', statement.text)}"
+            for i, statement in enumerate(self.statements, 1)
+        )
+
+    def assert_within(self, budget: Budget, route: str = "the test") -> None:
+        if budget.max_queries is not None and self.count > budget.max_queries:
+            raise AssertionError(
+                f"{route} ran {self.count} statements, over its budget of {budget.max_queries}:\n{self.report()}"
+            )
+        if budget.max_ms is not None and self.total_ms > budget.max_ms:
+            raise AssertionError(
+                f"{route} spent {self.total_ms:.1f} ms in the database, over its budget of "
+                f"{budget.max_ms:.1f} ms:\n{self.report()}"
+            )
+
+@contextmanager
+def capture_queries(engine) -> Iterator[QueryLog]:
+    """Record the statements an async engine (or any engine sharing its pool) runs in the block."""
+    log = QueryLog()
+    sync_engine = engine.sync_engine
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_budget_start_times", []).append(time.perf_counter())
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        seconds = time.perf_counter() - conn.info["query_budget_start_times"].pop()
+        clause = context.compiled.statement if context is not None and context.compiled is not None else None
+        log.statements.append(Statement(statement, seconds, parameters, clause))
+
+    event.listen(sync_engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(sync_engine, "after_cursor_execute", after_cursor_execute)
+    try:
+        yield log
+    finally:
+        event.remove(sync_engine, "before_cursor_execute", before_cursor_execute)
+        event.remove(sync_engine, "after_cursor_execute", after_cursor_execute)
+
+def query_budget(route: str):
+    """Fail the decorated async test when its body goes over the route's budget in ROUTE_BUDGETS."""
+    budget = ROUTE_BUDGETS[route]
+
+    def decorator(test):
+        signature = inspect.signature(test)
+        takes_engine = "pg_engine" in signature.parameters
+
+        @functools.wraps(test)
+        async def wrapper(*args, **kwargs):
+            engine = kwargs["pg_engine"] if takes_engine else kwargs.pop("pg_engine")
+            with capture_queries(engine) as log:
+                await test(*args, **kwargs)
+            log.assert_within(budget, route)
+
+        # Request the pg_engine fixture whether or not the test does
+        if not takes_engine:
+            wrapper.__signature__ = signature.replace(parameters=[
+                *signature.parameters.values(),
+                inspect.Parameter("pg_engine", inspect.Parameter.KEYWORD_ONLY)
+            ])
+        return wrapper
+    return decorator
@@ -80,3 +80,31 @@ async def test_get_popular_books_no_visits(client: TestClient):
     assert response.status_code == 200
     data = response.json()
     assert isinstance(data, list)
+
+@pytest.mark.asyncio
+async def test_popular_page_has_one_metadata_envelope(pg_client, pg_engine, pg_books, monkeypatch):
+    from datetime import date
+    from sqlalchemy.ext.asyncio import AsyncSession
+    from app.core.config import settings
+    from app.services import popularity_service
+
+    monkeypatch.setattr(settings, "POPULAR_CACHE_PAGES", 0)
+    async with AsyncSession(pg_engine) as db:
+        db.add_all([
+            Visit(book_id=book.id, visit_date=date.today(), visit_count=count)
+            for book, count in zip(pg_books, [3, 5])
+        ])
+        await db.commit()
+        await popularity_service.rebuild(db, date.today())
+        await db.commit()
+
+    response = await pg_client.get("/api/analytics/popular", params={"page": 1, "per_page": 1})
+    data = response.json()
+    assert [book["title"] for book in data["books"]] == ["Dune Messiah"]
+    assert not any(key.startswith("_") for key in data["books"][0])
+    assert {key: data[key] for key in ("total", "page", "per_page", "total_pages", "has_more")} == \
+        {"total": 2, "page": 1, "per_page": 1, "total_pages": 2, "has_more": True}
+
+    # Without page, still a bare list
+    response = await pg_client.get("/api/analytics/popular")
+    assert [book["title"] for book in response.json()] == ["Dune Messiah", "Dune"]
@@ -0,0 +1,234 @@
+import asyncio
+import pytest
+from types import SimpleNamespace
+from unittest.mock import patch
+from sqlalchemy import func, select
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.sql.dml import Insert
+from app.core.config import settings
+from app.db import models
+from app.core.rate_limit import TokenBucket
+from app.services import cover_refresh_service
+from app.services.cover_refresh_service import CoverRefreshJob
+
+BOOKS = [
+    SimpleNamespace(
+        id=i,
+        open_library_key=f"OL{i}W",
+        title=f"Book {i}",
+        cover_image_url=None,
+        cover_image_open_library_url=None,
+        cover_placeholder=None
+    )
+    for i in range(1, 6)
+]
+
+class FakeResult:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def all(self):
+        return self.rows
+
+    def mappings(self):
+        return self
+
+    def first(self):
+        return self.rows[0] if self.rows else None
+
+class FakeDatabase:
+    """The books' cover updates and the checkpoint row, and what each commit wrote."""
+    def __init__(self):
+        self.updates = []
+        self.checkpoint = None
+        self.commits = []
+
+class FakeSession:
+    """
+    Serves batches of BOOKS after the latest job's position and the stored
+    checkpoint, and applies cover updates and checkpoint writes on commit.
+    """
+    def __init__(self, jobs, database):
+        self.job = jobs[-1]
+        self.database = database
+        self.updates = []
+        self.checkpoint = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+    async def scalar(self, statement):
+        return len(BOOKS)
+
+    async def execute(self, statement, params=None):
+        if params is not None:
+            self.updates.extend(params)
+            return None
+        if isinstance(statement, Insert):
+            values = statement.compile(dialect=postgresql.dialect()).params
+            self.checkpoint = {key: value for key, value in values.items() if not key.startswith("param")}
+            return None
+        if models.CoverRefreshCheckpoint.__table__ in statement.froms:
+            return FakeResult([self.database.checkpoint] if self.database.checkpoint else [])
+        last_id = self.job.state["last_book_id"]
+        return FakeResult([book for book in BOOKS if book.id > last_id][:settings.COVER_REFRESH_BATCH_SIZE])
+
+    async def commit(self):
+        self.database.updates.extend(self.updates)
+        if self.checkpoint is not None:
+            self.database.checkpoint = self.checkpoint
+        self.database.commits.append((
+            [update["book_id"] for update in self.updates],
+            self.checkpoint and self.checkpoint["last_book_id"]
+        ))
+        self.updates, self.checkpoint = [], None
+
+async def acquire_lock(self):
+    self.state = await self._load_checkpoint()
+    return True
+
+async def release_lock(self):
+    pass
+
+async def locked_elsewhere(self):
+    return False
+
+def fake_covers():
+    """Stand-ins for the cover lookups: book 3 has no cover."""
+    async def find_cover_url(client, key, title, rate_limiter=None):
+        return None if key == "OL3W" else f"https://covers.openlibrary.org/b/id/{key}-L.jpg"
+
+    async def get_cached_url(url, cache_if_missing=True, size="L"):
+        return f"/cache/images/{url.rsplit('/', 1)[1]}"
+
+    async def get_cover_details(url, compute=True):
+        return {"placeholder": "data:image/webp;base64,", "color": "#102030", "width": 400, "height": 600}
+
+    return find_cover_url, get_cached_url, get_cover_details
+
+@pytest.mark.asyncio
+async def test_refresh_job_checkpoints_and_resumes(monkeypatch):
+    monkeypatch.setattr(CoverRefreshJob, "_acquire_lock", acquire_lock)
+    monkeypatch.setattr(CoverRefreshJob, "_release_lock", release_lock)
+    monkeypatch.setattr(CoverRefreshJob, "_locked_elsewhere", locked_elsewhere)
+    monkeypatch.setattr(settings, "COVER_REFRESH_BATCH_SIZE", 2)
+    job = CoverRefreshJob()
+    jobs = [job]
+    database = FakeDatabase()
+    blocked = asyncio.Event()
+
+    async def find_cover_url(client, key, title, rate_limiter=None):
+        if key == "OL3W":
+            # Book 3 has no cover; block the first run here to interrupt it
+            if not blocked.is_set():
+                blocked.set()
+                await asyncio.sleep(60)
+            return None
+        return f"https://covers.openlibrary.org/b/id/{key}-L.jpg"
+
+    async def get_cached_url(url, cache_if_missing=True, size="L"):
+        return f"/cache/images/{url.rsplit('/', 1)[1]}"
+
+    async def get_cover_details(url, compute=True):
+        return {"placeholder": "data:image/webp;base64,", "color": "#102030", "width": 400, "height": 600}
+
+    with patch.object(cover_refresh_service, "SessionLocal", lambda: FakeSession(jobs, database)), \
+         patch.object(cover_refresh_service.book_service, "find_cover_url", find_cover_url), \
+         patch.object(cover_refresh_service.image_cache, "get_cached_url", get_cached_url), \
+         patch.object(cover_refresh_service.image_cache, "get_cover_details", get_cover_details):
+        await job.start()
+        await blocked.wait()
+        await job.stop()
+
+        # Stopped during the second batch: the first batch's covers were
+        # committed in one transaction with the position after them
+        assert database.checkpoint["status"] == "running"
+        assert database.checkpoint["last_book_id"] == 2
+        assert database.checkpoint["processed"] == 2
+        assert ([1, 2], 2) in database.commits
+        assert [u["book_id"] for u in database.updates] == [1, 2]
+
+        resumed = CoverRefreshJob()
+        jobs.append(resumed)
+        await resumed.resume()
+        await resumed._task
+        status = await resumed.get_status()
+
+    assert status["status"] == "completed"
+    assert status["processed"] == 5
+    assert status["updated"] == 4
+    assert status["skipped"] == 1
+    assert [u["book_id"] for u in database.updates] == [1, 2, 4, 5]
+    assert database.updates[0]["cover_url"] == "/cache/images/OL1W-L.jpg"
+    assert database.updates[0]["cover_color"] == "#102030"
+    assert database.checkpoint["status"] == "completed"
+    assert database.checkpoint["last_book_id"] == 5
+
+@pytest.mark.asyncio
+async def test_refresh_job_runs_in_one_process(pg_engine):
+    """A second process's job neither starts nor resumes while the first one runs."""
+    first = CoverRefreshJob()
+    second = CoverRefreshJob()
+    jobs = [first]
+    database = FakeDatabase()
+    release = asyncio.Event()
+    find_cover_url, get_cached_url, get_cover_details = fake_covers()
+
+    async def blocking_find_cover_url(client, key, title, rate_limiter=None):
+        await release.wait()
+        return await find_cover_url(client, key, title, rate_limiter)
+
+    with patch.object(cover_refresh_service, "engine", pg_engine), \
+         patch.object(cover_refresh_service, "SessionLocal", lambda: FakeSession(jobs, database)), \
+         patch.object(cover_refresh_service.book_service, "find_cover_url", blocking_find_cover_url), \
+         patch.object(cover_refresh_service.image_cache, "get_cached_url", get_cached_url), \
+         patch.object(cover_refresh_service.image_cache, "get_cover_details", get_cover_details):
+        assert (await first.start())["running"]
+        await asyncio.sleep(0.05)
+
+        status = await second.start(restart=True)
+        await second.resume()
+        assert not second.is_running()
+        assert status["running"] and status["throughput_per_second"] is None
+
+        release.set()
+        await first._task
+        assert (await second.get_status())["status"] == "completed"
+
+        # Released with the run: the other process can take the job over
+        jobs.append(second)
+        await second.start(restart=True)
+        await second._task
+        assert (await second.get_status())["processed"] == 5
+    assert [u["book_id"] for u in database.updates] == [1, 2, 4, 5, 1, 2, 4, 5]
+
+@pytest.mark.asyncio
+async def test_checkpoint_row_round_trips(pg_engine):
+    """The checkpoint is one row, upserted on every save."""
+    Session = sessionmaker(pg_engine, class_=AsyncSession, expire_on_commit=False)
+    job = CoverRefreshJob()
+    with patch.object(cover_refresh_service, "SessionLocal", Session):
+        assert await job._load_checkpoint() == cover_refresh_service._new_state()
+        for last_book_id in [2, 4]:
+            job.state.update(status="running", last_book_id=last_book_id, processed=last_book_id)
+            job.state["recent_errors"].append({"book_id": last_book_id, "error": "Not found"})
+            await job._save_checkpoint()
+        saved = await CoverRefreshJob()._load_checkpoint()
+    assert saved == job.state
+    async with Session() as db:
+        assert await db.scalar(select(func.count()).select_from(models.CoverRefreshCheckpoint)) == 1
+
+@pytest.mark.asyncio
+async def test_token_bucket_limits_rate():
+    bucket = TokenBucket(rate=100, capacity=2)
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    for _ in range(6):
+        await bucket.acquire()
+    # Two tokens are available at once; the other four take 10ms each
+    assert loop.time() - start >= 0.035
@@ -0,0 +1,177 @@
+import asyncio
+import json
+import pytest
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from unittest.mock import patch, AsyncMock, MagicMock
+from sqlalchemy import func, select, text, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.sql.dml import Update
+from app.db import models
+from app.services import book_service
+
+class FakeResult:
+    def __init__(self, value):
+        self.value = value
+
+    def scalar_one_or_none(self):
+        return self.value
+
+class FakeSession:
+    """Just enough of AsyncSession for _refresh_book_digest_once."""
+    def __init__(self, book):
+        self.book = book
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+    def begin(self):
+        return self
+
+    async def scalar(self, statement):
+        return datetime.now(timezone.utc)
+
+    async def execute(self, statement):
+        if isinstance(statement, Update):
+            self.book.summary = statement.compile().params["summary"]
+            return SimpleNamespace(rowcount=1)
+        return FakeResult(self.book)
+
+@pytest.fixture
+def fake_lock(monkeypatch):
+    """The book's advisory lock, always free."""
+    async def try_session_lock(engine, namespace, key):
+        return object()
+
+    async def release_session_lock(connection, namespace, key):
+        pass
+
+    monkeypatch.setattr(book_service, "try_session_lock", try_session_lock)
+    monkeypatch.setattr(book_service, "release_session_lock", release_session_lock)
+
+@pytest.mark.asyncio
+async def test_concurrent_refreshes_share_one_llm_call(fake_lock):
+    book = SimpleNamespace(
+        id=1,
+        title="Dune",
+        author=SimpleNamespace(name="Frank Herbert"),
+        updated_at=None
+    )
+    digest = json.dumps({
+        "title": "Dune",
+        "author": "Frank Herbert",
+        "summary": "Spice.",
+        "questions_and_answers": []
+    })
+
+    async def slow_llm(prompt, provider):
+        await asyncio.sleep(0.05)
+        return digest
+
+    db = MagicMock()
+    with patch.object(book_service, "SessionLocal", lambda: FakeSession(book)), \
+         patch('app.services.llm_service.query_llm', side_effect=slow_llm) as mock_llm, \
+         patch.object(book_service, "get_book", new_callable=AsyncMock) as mock_get_book:
+        mock_get_book.return_value = book
+        results = await asyncio.gather(*(
+            book_service.refresh_book_digest(db, 1, "local") for _ in range(20)
+        ))
+
+    assert mock_llm.call_count == 1
+    assert mock_get_book.await_count == 20
+    assert all(result.summary == "Spice." for result in results)
+    assert book_service._digest_refreshes == {}
+
+@pytest.mark.asyncio
+async def test_failed_refresh_is_not_cached(fake_lock):
+    book = SimpleNamespace(
+        id=2,
+        title="Emma",
+        author=SimpleNamespace(name="Jane Austen"),
+        updated_at=None
+    )
+    db = MagicMock()
+    with patch.object(book_service, "SessionLocal", lambda: FakeSession(book)), \
+         patch('app.services.llm_service.query_llm', new_callable=AsyncMock) as mock_llm:
+        mock_llm.side_effect = Exception("provider down")
+        for _ in range(2):
+            with pytest.raises(ValueError):
+                await book_service.refresh_book_digest(db, 2, "local")
+
+    assert mock_llm.call_count == 2
+
+async def _pg_book(Session):
+    async with Session() as db:
+        book = models.Book(
+            title="Dune",
+            author=models.Author(name="Frank Herbert", open_library_key="OL1A"),
+            open_library_key="OL1W"
+        )
+        db.add(book)
+        await db.commit()
+        return book.id
+
+def _digest(summary):
+    return json.dumps({"title": "Dune", "author": "Frank Herbert", "summary": summary, "questions_and_answers": []})
+
+@pytest.mark.asyncio
+async def test_refresh_waits_for_another_workers_digest(pg_engine, monkeypatch):
+    Session = sessionmaker(pg_engine, class_=AsyncSession, expire_on_commit=False)
+    book_id = await _pg_book(Session)
+
+    monkeypatch.setattr(book_service, "_DIGEST_POLL_SECONDS", 0.05)
+
+    # Another worker holds the book's lock while it stores a digest
+    async with pg_engine.connect() as other:
+        transaction = await other.begin()
+        await other.execute(select(func.pg_advisory_xact_lock(book_service._DIGEST_LOCK_NAMESPACE, book_id)))
+        with patch.object(book_service, "SessionLocal", Session), \
+             patch.object(book_service, "engine", pg_engine), \
+             patch('app.services.llm_service.query_llm', new_callable=AsyncMock) as mock_llm:
+            refresh = asyncio.ensure_future(book_service._refresh_book_digest_once(book_id, "local"))
+            await asyncio.sleep(0.2)
+            assert not refresh.done()
+            await other.execute(
+                update(models.Book.__table__)
+                .where(models.Book.id == book_id)
+                .values(summary="Theirs", updated_at=func.clock_timestamp())
+            )
+            await transaction.commit()
+            await refresh
+
+    mock_llm.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_two_workers_make_one_llm_call(pg_engine, monkeypatch):
+    Session = sessionmaker(pg_engine, class_=AsyncSession, expire_on_commit=False)
+    book_id = await _pg_book(Session)
+    monkeypatch.setattr(book_service, "_DIGEST_POLL_SECONDS", 0.05)
+    open_transactions = []
+
+    async def slow_llm(prompt, provider):
+        await asyncio.sleep(0.3)
+        async with pg_engine.connect() as conn:
+            open_transactions.append(await conn.scalar(text(
+                "SELECT count(*) FROM pg_stat_activity "
+                "WHERE datname = current_database() AND state LIKE 'idle in transaction%'"
+            )))
+        return _digest("Spice.")
+
+    # Two workers refreshing at once, as the in-process single flight does not span them
+    with patch.object(book_service, "SessionLocal", Session), \
+         patch.object(book_service, "engine", pg_engine), \
+         patch('app.services.llm_service.query_llm', side_effect=slow_llm) as mock_llm:
+        await asyncio.wait_for(asyncio.gather(
+            book_service._refresh_book_digest_once(book_id, "local"),
+            book_service._refresh_book_digest_once(book_id, "local")
+        ), timeout=5)
+
+    assert mock_llm.call_count == 1
+    # The lock is held across the call without a transaction
+    assert open_transactions == [0]
+    async with Session() as db:
+        assert (await db.get(models.Book, book_id)).summary == "Spice."
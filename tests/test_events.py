@@ -0,0 +1,89 @@
+import json
+import pytest
+from datetime import date, datetime, timedelta, timezone
+from unittest.mock import patch
+from fastapi import FastAPI
+from httpx import AsyncClient
+from app.api import analytics
+from app.db import schemas
+from app.services import event_service
+from app.services.event_service import EventBuffer
+
+class FakeSession:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+    def begin(self):
+        return self
+
+@pytest.fixture
+def client_and_buffer():
+    buffer = EventBuffer()
+    app = FastAPI()
+    app.include_router(analytics.router, prefix="/api/analytics")
+    with patch.object(analytics, "event_buffer", buffer):
+        yield AsyncClient(app=app, base_url="http://test"), buffer
+
+@pytest.mark.asyncio
+async def test_events_endpoint_accepts_beacon_bodies(client_and_buffer):
+    client, buffer = client_and_buffer
+    body = json.dumps({"events": [
+        {"event_type": "search", "metadata": {"query": "dune"}},
+        {"event_type": "affiliate_click", "book_id": 7, "session_id": "abc"},
+    ]})
+    async with client:
+        # navigator.sendBeacon posts strings as text/plain
+        response = await client.post("/api/analytics/events", content=body, headers={"Content-Type": "text/plain"})
+        assert response.status_code == 202
+        assert response.json() == {"accepted": 2, "dropped": 0}
+
+        response = await client.post("/api/analytics/events", content=json.dumps({"events": [{"event_type": "Bad Type"}]}))
+        assert response.status_code == 422
+
+        too_many = {"events": [{"event_type": "search"}] * (event_service.settings.EVENT_BATCH_MAX_EVENTS + 1)}
+        response = await client.post("/api/analytics/events", content=json.dumps(too_many))
+        assert response.status_code == 413
+    assert buffer.pending() == 2
+
+def test_add_clamps_timestamps_and_drops_oversized_metadata():
+    buffer = EventBuffer()
+    received_at = datetime(2026, 3, 1, 0, 10, tzinfo=timezone.utc)
+    late = received_at - timedelta(minutes=20)
+    accepted, dropped = buffer.add([
+        schemas.EventIn(event_type="search", occurred_at=late),
+        schemas.EventIn(event_type="search", occurred_at=received_at - timedelta(days=30)),
+        schemas.EventIn(event_type="search", occurred_at=received_at + timedelta(hours=1)),
+        schemas.EventIn(event_type="search", metadata={"blob": "x" * event_service.settings.EVENT_METADATA_MAX_BYTES}),
+    ], received_at)
+
+    assert (accepted, dropped) == (3, 1)
+    assert [record[0] for record in buffer._records] == [late, received_at, received_at]
+    # A late event from last month still needs last month's partition
+    assert event_service.partition_months(received_at.date()) == [date(2026, 2, 1), date(2026, 3, 1), date(2026, 4, 1)]
+
+@pytest.mark.asyncio
+async def test_failed_flush_keeps_events_for_retry():
+    buffer = EventBuffer()
+    buffer.add([schemas.EventIn(event_type="search"), schemas.EventIn(event_type="digest_refresh", book_id=3)])
+    buffer._partitioned_months.update(event_service.partition_months(datetime.now(timezone.utc).date()))
+    copied = []
+
+    async def failing_copy(db, records):
+        raise ConnectionError("database unavailable")
+
+    async def copy(db, records):
+        copied.extend(records)
+
+    with patch.object(event_service, "SessionLocal", FakeSession):
+        with patch.object(buffer, "_copy", failing_copy), pytest.raises(ConnectionError):
+            await buffer.flush()
+        assert buffer.pending() == 2
+        with patch.object(buffer, "_copy", copy):
+            assert await buffer.flush() == 2
+
+    assert [record[2] for record in copied] == ["search", "digest_refresh"]
+    assert buffer.pending() == 0
+    assert buffer.stats["flush_errors"] == 1
@@ -0,0 +1,104 @@
+import csv
+import gzip
+import io
+import json
+import pytest
+from datetime import date
+from sqlalchemy import event
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import sessionmaker
+from app.db.database import ReadOnlySession
+from app.db.models import Visit
+from app.services import export_service
+
+COLUMNS = ["occurred_at", "event_type", "book_id", "metadata"]
+ROWS = [
+    ("2024-03-01T10:00:00.000000Z", "search", None, {"query": "dune, messiah"}),
+    ("2024-03-01T10:00:01.000000Z", "affiliate_click", 7, None),
+]
+
+async def batches(*batches):
+    for batch in batches:
+        yield batch
+
+async def export(rows_batches, export_format, compress):
+    chunks = [chunk async for chunk in export_service.encode_rows(
+        COLUMNS, batches(*rows_batches), export_format, compress
+    )]
+    return b"".join(chunks)
+
+@pytest.mark.asyncio
+async def test_ndjson_export_has_one_object_per_line():
+    data = await export([ROWS[:1], ROWS[1:]], "ndjson", compress=False)
+
+    lines = data.decode().splitlines()
+    assert [json.loads(line) for line in lines] == [dict(zip(COLUMNS, row)) for row in ROWS]
+
+@pytest.mark.asyncio
+async def test_csv_export_has_a_header_and_json_encoded_metadata():
+    data = await export([ROWS], "csv", compress=False)
+
+    records = list(csv.reader(io.StringIO(data.decode())))
+    assert records[0] == COLUMNS
+    assert records[1] == ["2024-03-01T10:00:00.000000Z", "search", "", '{"query":"dune, messiah"}']
+    assert records[2] == ["2024-03-01T10:00:01.000000Z", "affiliate_click", "7", ""]
+
+@pytest.mark.asyncio
+async def test_compressed_export_is_one_gzip_stream():
+    plain = await export([ROWS, ROWS, []], "ndjson", compress=False)
+    compressed = await export([ROWS, ROWS, []], "ndjson", compress=True)
+
+    assert gzip.decompress(compressed) == plain
+
+@pytest.mark.asyncio
+async def test_empty_export_is_still_valid():
+    assert await export([], "ndjson", compress=False) == b""
+    assert gzip.decompress(await export([], "csv", compress=True)).decode().strip() == ",".join(COLUMNS)
+
+def test_date_filters_are_inclusive():
+    query = export_service.export_query("events", date(2024, 3, 1), date(2024, 3, 31), [7])
+    compiled = query.compile(dialect=postgresql.dialect())
+    params = compiled.params
+
+    assert "analytics_events.occurred_at >= " in str(compiled)
+    assert "analytics_events.occurred_at < " in str(compiled)
+    assert params["occurred_at_1"].isoformat() == "2024-03-01T00:00:00+00:00"
+    assert params["occurred_at_2"].isoformat() == "2024-04-01T00:00:00+00:00"
+
+def test_visits_export_columns():
+    query = export_service.export_query("visits")
+
+    assert [column.name for column in query.selected_columns] == [
+        "book_id", "title", "open_library_key", "visit_date", "visit_count", "created_at", "updated_at"
+    ]
+
+def test_export_filename():
+    assert export_service.export_filename("visits", "csv", date(2024, 1, 1), date(2024, 1, 31), True) == \
+        "visits-2024-01-01-2024-01-31.csv.gz"
+    assert export_service.export_filename("events", "ndjson", None, None, False) == "events.ndjson"
+
+@pytest.mark.asyncio
+async def test_stream_export_reads_in_a_read_only_transaction(pg_engine, pg_books, monkeypatch):
+    Session = sessionmaker(pg_engine, class_=ReadOnlySession, expire_on_commit=False)
+    async with pg_engine.begin() as conn:
+        await conn.execute(Visit.__table__.insert(), [
+            {"book_id": book.id, "visit_date": date(2024, 3, day), "visit_count": day}
+            for book in pg_books for day in (1, 2)
+        ])
+    monkeypatch.setattr(export_service, "ReadSessionLocal", Session)
+    monkeypatch.setattr(export_service.settings, "EXPORT_BATCH_ROWS", 2)
+    read_only = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if "FROM visits" in statement:
+            read_only.append(conn.get_execution_options().get("postgresql_readonly"))
+
+    event.listen(pg_engine.sync_engine, "before_cursor_execute", record)
+    try:
+        body = b"".join([chunk async for chunk in export_service.stream_export("visits", "ndjson", compress=False)])
+    finally:
+        event.remove(pg_engine.sync_engine, "before_cursor_execute", record)
+    rows = [json.loads(line) for line in body.decode().splitlines()]
+    assert sorted((row["book_id"], row["visit_count"]) for row in rows) == \
+        sorted((book.id, day) for book in pg_books for day in (1, 2))
+    assert read_only == [True]
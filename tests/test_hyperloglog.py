@@ -0,0 +1,38 @@
+import pytest
+from app.core.hyperloglog import HyperLogLog, merge_sketches
+
+def _sketch(precision, ids):
+    sketch = HyperLogLog(precision)
+    for visitor in ids:
+        sketch.add(visitor)
+    return sketch
+
+@pytest.mark.parametrize("precision", [12, 14])
+@pytest.mark.parametrize("cardinality", [0, 1, 50, 5000, 50000])
+def test_estimates_stay_within_a_few_standard_errors(precision, cardinality):
+    sketch = _sketch(precision, (f"visitor-{i}" for i in range(cardinality)))
+    tolerance = max(3 * 1.04 / (1 << precision) ** 0.5 * cardinality, 1)
+    assert abs(sketch.count() - cardinality) <= tolerance
+
+def test_serialisation_round_trips_sparse_and_dense():
+    sparse = _sketch(12, (f"visitor-{i}" for i in range(20)))
+    dense = _sketch(12, (f"visitor-{i}" for i in range(20000)))
+    assert len(sparse.to_bytes()) == 1 + 3 * 20
+    assert len(dense.to_bytes()) == 1 + 4096
+    for sketch in (sparse, dense):
+        assert HyperLogLog.from_bytes(sketch.to_bytes()).count() == sketch.count()
+
+def test_merging_days_counts_returning_visitors_once():
+    monday = _sketch(12, (f"visitor-{i}" for i in range(0, 3000)))
+    tuesday = _sketch(12, (f"visitor-{i}" for i in range(2000, 5000)))
+    union = _sketch(12, (f"visitor-{i}" for i in range(0, 5000)))
+    merged = merge_sketches([monday.to_bytes(), None, tuesday.to_bytes()], 12)
+    assert merged.count() == union.count()
+
+def test_merging_different_precisions_folds_to_the_lower_one():
+    ids = [f"visitor-{i}" for i in range(8000)]
+    high = _sketch(14, ids)
+    assert high.reduce(12).to_bytes() == _sketch(12, ids).to_bytes()
+    merged = _sketch(12, ids[:4000]).merge(_sketch(14, ids[4000:]))
+    assert merged.precision == 12
+    assert merged.count() == _sketch(12, ids).count()
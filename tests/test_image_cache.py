@@ -0,0 +1,379 @@
+import asyncio
+import fcntl
+import hashlib
+import json
+import pytest
+import threading
+import time
+import pytest_asyncio
+from types import SimpleNamespace
+from io import BytesIO
+from PIL import Image
+from app.core.config import settings
+from app.services import image_cache_service
+from app.services.image_cache_service import ImageCache, build_cover_variants, describe_cover, variant_path
+
+KEY = "0123456789abcdef0123456789abcdef"
+
+def _jpeg(width=400, height=600) -> bytes:
+    buffer = BytesIO()
+    Image.new("RGB", (width, height), (120, 40, 200)).save(buffer, "JPEG")
+    return buffer.getvalue()
+
+@pytest.fixture
+def cache(tmp_path):
+    return ImageCache(cache_dir=tmp_path)
+
+@pytest_asyncio.fixture
+async def upstream():
+    """
+    A local image host serving cover.jpg, slow.jpg (after a delay),
+    truncated.jpg (connection dropped mid-body) and redirect.jpg, counting
+    the requests for each path.
+    """
+    from aiohttp import web
+
+    cover = _jpeg()
+    hits = {}
+
+    @web.middleware
+    async def count_hits(request, handler):
+        hits[request.path] = hits.get(request.path, 0) + 1
+        return await handler(request)
+
+    async def serve_cover(request):
+        return web.Response(body=cover, content_type="image/jpeg")
+
+    async def serve_slowly(request):
+        await asyncio.sleep(0.2)
+        return web.Response(body=cover, content_type="image/jpeg")
+
+    async def serve_truncated(request):
+        response = web.StreamResponse(headers={"Content-Type": "image/jpeg", "Content-Length": str(len(cover))})
+        await response.prepare(request)
+        await response.write(cover[:len(cover) // 2])
+        request.transport.close()
+        return response
+
+    async def redirect_away(request):
+        raise web.HTTPFound("https://evil.example/cover.jpg")
+
+    app = web.Application(middlewares=[count_hits])
+    app.router.add_get("/cover.jpg", serve_cover)
+    app.router.add_get("/slow.jpg", serve_slowly)
+    app.router.add_get("/truncated.jpg", serve_truncated)
+    app.router.add_get("/redirect.jpg", redirect_away)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    try:
+        yield SimpleNamespace(
+            url=f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}", cover=cover, hits=hits
+        )
+    finally:
+        await runner.cleanup()
+
+class _InFlight:
+    """Counts image jobs running at once in the worker threads."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = 0
+        self.peak = 0
+
+    def __call__(self, seconds):
+        with self.lock:
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+        time.sleep(seconds)
+        with self.lock:
+            self.running -= 1
+
+def _cache_files(cache):
+    """Covers and temporary files in the cache directory, without its bookkeeping files."""
+    return [
+        path for path in cache.cache_dir.rglob("*")
+        if path.is_file() and path.name not in (".manifest.jsonl", ".manifest.lock", ".sweep.lock", ".access-index")
+    ]
+
+def test_build_cover_variants(tmp_path):
+    original = tmp_path / f"{KEY}.jpg"
+    data = _jpeg()
+    original.write_bytes(data)
+    build_cover_variants(str(original), ("webp",), data)
+
+    small = Image.open(variant_path(original, "S", "jpg"))
+    assert small.size[0] <= 80 and small.size[1] <= 120
+    assert Image.open(variant_path(original, "M", "webp")).format == "WEBP"
+    assert variant_path(original, "L", "webp").exists()
+
+def test_describe_cover(tmp_path):
+    original = tmp_path / f"{KEY}.jpg"
+    original.write_bytes(_jpeg(400, 600))
+    details = describe_cover(str(original))
+    assert (details["width"], details["height"]) == (400, 600)
+    assert details["placeholder"].startswith("data:image/webp;base64,")
+    assert len(details["placeholder"]) < 500
+    # Solid (120, 40, 200), give or take JPEG rounding
+    r, g, b = (int(details["color"][i:i + 2], 16) for i in (1, 3, 5))
+    assert abs(r - 120) < 8 and abs(g - 40) < 8 and abs(b - 200) < 8
+
+def test_get_variant_url(cache):
+    assert cache.get_variant_url(f"/cache/images/01/23/{KEY}.jpg", "S") == f"/cache/images/01/23/{KEY}-S.jpg"
+    assert cache.get_variant_url(f"/cache/images/01/23/{KEY}-M.jpg", "L") == f"/cache/images/01/23/{KEY}.jpg"
+    # Old flat URLs are moved to the sharded layout
+    assert cache.get_variant_url(f"/cache/images/{KEY}.jpg", "L") == f"/cache/images/01/23/{KEY}.jpg"
+    assert cache.get_variant_url("https://covers.openlibrary.org/b/id/1-L.jpg", "S") == \
+        "https://covers.openlibrary.org/b/id/1-S.jpg"
+    assert cache.get_variant_url(None, "S") is None
+
+@pytest.mark.asyncio
+async def test_get_variant_file_negotiates_and_backfills(cache):
+    (cache.cache_dir / f"{KEY}.jpg").write_bytes(_jpeg())
+    assert cache.shard_legacy_files() == 1
+
+    path, media_type = await cache.get_variant_file(f"01/23/{KEY}-S.jpg", "image/webp,image/*")
+    assert path == cache.cache_dir / "01" / "23" / f"{KEY}-S.webp"
+    assert media_type == "image/webp"
+
+    # Flat URLs resolve to the same file
+    path, media_type = await cache.get_variant_file(f"{KEY}-S.jpg", "image/*")
+    assert path == cache.cache_dir / "01" / "23" / f"{KEY}-S.jpg"
+    assert media_type == "image/jpeg"
+
+    assert await cache.get_variant_file("../secrets.jpg") is None
+
+@pytest.mark.asyncio
+async def test_legacy_flat_covers_are_served_before_they_are_moved(tmp_path):
+    (tmp_path / f"{KEY}.jpg").write_bytes(_jpeg())
+    cache = ImageCache(cache_dir=tmp_path)  # Scans the flat file into the manifest, with no source URL
+
+    cached_url = await cache.get_cached_url(f"/cache/images/{KEY}.jpg")
+    assert cached_url == f"/cache/images/01/23/{KEY}.jpg"
+    path, media_type = await cache.get_variant_file(cached_url.removeprefix("/cache/images/"), "image/*")
+    assert path == tmp_path / f"{KEY}.jpg"
+    path, _ = await cache.get_variant_file(f"01/23/{KEY}-S.jpg", "image/*")
+    assert path == tmp_path / f"{KEY}-S.jpg"
+
+    # Moved with its variants, the cover is served from its shard directory
+    cache.shard_legacy_files()
+    assert not list(tmp_path.glob("*.jpg"))
+    path, _ = await cache.get_variant_file(f"{KEY}.jpg", "image/*")
+    assert path == tmp_path / "01" / "23" / f"{KEY}.jpg"
+    await cache.close()
+    assert await cache.get_variant_file(f"ff/ff/{KEY}.jpg") is None
+    assert await cache.get_variant_file(f"{'f' * 32}.jpg") is None
+    await cache.close()
+
+@pytest.mark.asyncio
+async def test_sweep_evicts_least_recently_used_unpinned(cache, monkeypatch):
+    from app.core.config import settings
+    keys = [f"{i:032x}" for i in range(4)]
+    paths = [cache._original_path(key) for key in keys]
+    for i, key in enumerate(keys):
+        paths[i].parent.mkdir(parents=True, exist_ok=True)
+        paths[i].write_bytes(b"x" * 100)
+        await cache._record(key, f"https://covers.example/{i}.jpg", "image/jpeg", 100)
+        cache._touch(key, 100)
+        cache._index[key][0] = float(i)  # keys[0] is the least recently used
+
+    monkeypatch.setattr(settings, "IMAGE_CACHE_MAX_BYTES", 250)
+    monkeypatch.setattr(settings, "IMAGE_CACHE_SWEEP_TARGET", 1.0)
+    freed = await cache.sweep(pinned_keys={keys[0]})
+
+    assert freed == 200
+    assert paths[0].exists()  # pinned
+    assert not paths[1].exists()
+    assert not paths[2].exists()
+    assert paths[3].exists()
+    assert cache.get_stats()["evictions"] == 2
+
+    # The access index survives a restart
+    reloaded = ImageCache(cache_dir=cache.cache_dir)
+    assert set(reloaded._index) == {keys[0], keys[3]}
+    assert set(reloaded._manifest) == {keys[0], keys[3]}
+
+@pytest.mark.asyncio
+async def test_compaction_and_sweeps_are_serialized_across_workers(cache):
+    other = ImageCache(cache_dir=cache.cache_dir)  # Another worker sharing the cache
+    manifest_lock = cache.cache_dir / image_cache_service._MANIFEST_LOCK_FILENAME
+
+    # The other worker is appending: the rewrite waits, then keeps its entry
+    with image_cache_service._flock(manifest_lock, fcntl.LOCK_SH):
+        compaction = asyncio.ensure_future(asyncio.to_thread(cache._compact_manifest))
+        await asyncio.sleep(0.1)
+        assert not compaction.done()
+        other._append_line(json.dumps({"key": KEY, "url": None, "fetched_at": 1.0}) + "\n")
+    assert KEY in await compaction
+
+    # The other worker is sweeping: this one's sweep starts once it is done
+    sweep_lock = await asyncio.to_thread(other._lock_sweep)
+    sweep = asyncio.ensure_future(cache.sweep(pinned_keys=set()))
+    await asyncio.sleep(0.1)
+    assert not sweep.done()
+    sweep_lock.close()
+    assert await sweep == 0
+    assert KEY in cache._manifest
+
+@pytest.mark.asyncio
+async def test_manifest_recovers_lost_files_and_skips_recent_failures(cache, monkeypatch):
+    url = "https://covers.example/b/id/1-L.jpg"
+    key = cache.get_cache_key(url)
+    await cache._record(key, url, "image/jpeg", 100)
+
+    # Hits are answered from the manifest without touching the disk
+    assert await cache.get_cached_image_path(url) == str(cache._original_path(key))
+    assert ImageCache(cache_dir=cache.cache_dir)._manifest[key]["url"] == url
+
+    # A lost file is re-downloaded from the recorded source URL
+    downloads = []
+
+    async def fake_download(source_url, cache_path):
+        downloads.append(source_url)
+        cache_path.write_bytes(_jpeg())
+        await cache._record(cache_path.stem, source_url, "image/jpeg", 100)
+        return str(cache_path)
+
+    monkeypatch.setattr(cache, "_fetch", fake_download)
+    path, _ = await cache.get_variant_file(f"{key}.jpg", "image/*")
+    assert path == cache._original_path(key)
+    assert downloads == [url]
+
+    # Failed downloads are not retried until the negative TTL expires
+    async def failing_download(source_url, cache_path):
+        downloads.append(source_url)
+        return None
+
+    monkeypatch.setattr(cache, "_fetch", failing_download)
+    missing = "https://covers.example/b/id/2-L.jpg"
+    assert await cache.ensure_cached(missing) is None
+    assert await cache.ensure_cached(missing) is None
+    assert downloads.count(missing) == 1
+    assert cache.get_stats()["negative_hits"] == 1
+    await cache.close()
+
+@pytest.mark.asyncio
+async def test_proxy_streams_caches_and_serves_ranges(cache, upstream, monkeypatch):
+    from fastapi import FastAPI
+    from httpx import AsyncClient
+    from app.api import images
+    from app.core.config import settings
+
+    base_url, cover = upstream.url, upstream.cover
+
+    monkeypatch.setattr(settings, "IMAGE_PROXY_ALLOWED_HOSTS", "127.0.0.1")
+    monkeypatch.setattr(images, "image_cache", cache)
+    app = FastAPI()
+    app.include_router(images.router)
+    try:
+        async with AsyncClient(app=app, base_url="http://test") as client:
+            response = await client.get("/images/proxy", params={"url": "https://evil.example/cover.jpg"})
+            assert response.status_code == 403
+            response = await client.get("/images/proxy", params={"url": f"{base_url}/redirect.jpg"})
+            assert response.status_code == 404
+
+            # A miss streams the upstream body and tees it into the cache
+            url = f"{base_url}/cover.jpg"
+            response = await client.get("/images/proxy", params={"url": url})
+            assert response.status_code == 200
+            assert response.content == cover
+            await asyncio.gather(*cache._downloads.values())  # Stored in the background
+            assert cache.get_cache_key(url) in cache._manifest
+
+            # A hit redirects, with the short TTL, to the immutable content hash URL
+            response = await client.get("/images/proxy", params={"url": url})
+            assert response.status_code == 302
+            assert response.headers["cache-control"] == "public, max-age=86400"
+            key, sha256 = cache.get_cache_key(url), hashlib.sha256(cover).hexdigest()
+            hashed_url = f"/images/proxy/{key}/{sha256}"
+            assert response.headers["location"] == f"http://test{hashed_url}"
+
+            response = await client.get(hashed_url)
+            assert response.status_code == 200
+            assert response.content == cover
+            assert response.headers["cache-control"] == "public, max-age=31536000, immutable"
+            assert response.headers["etag"] == f'"{sha256}"'
+
+            response = await client.get(hashed_url, headers={"If-None-Match": f'"{sha256}"'})
+            assert response.status_code == 304
+
+            response = await client.get(hashed_url, headers={"Range": "bytes=10-19"})
+            assert response.status_code == 206
+            assert response.content == cover[10:20]
+            assert response.headers["content-range"] == f"bytes 10-19/{len(cover)}"
+
+            response = await client.get(hashed_url, headers={"Range": f"bytes={len(cover)}-"})
+            assert response.status_code == 416
+
+            # An outdated hash is redirected to the current one; unknown keys are not found
+            response = await client.get(f"/images/proxy/{key}/{'0' * 64}")
+            assert response.status_code == 302
+            assert response.headers["location"] == f"http://test{hashed_url}"
+            response = await client.get(f"/images/proxy/{'0' * 32}/{sha256}")
+            assert response.status_code == 404
+    finally:
+        await cache.close()
+
+@pytest.mark.asyncio
+async def test_concurrent_requests_share_one_download(cache, upstream):
+    url = f"{upstream.url}/slow.jpg"
+    try:
+        paths = await asyncio.gather(*(cache.get_cached_url(url) for _ in range(10)))
+    finally:
+        await cache.close()
+
+    assert upstream.hits["/slow.jpg"] == 1
+    assert set(paths) == {image_cache_service.cache_url(cache.get_cache_key(url))}
+    assert cache._original_path(cache.get_cache_key(url)).read_bytes() == upstream.cover
+
+@pytest.mark.asyncio
+async def test_failed_downloads_leave_no_files(cache, upstream):
+    try:
+        for url in [f"{upstream.url}/truncated.jpg", f"{upstream.url}/missing.jpg"]:
+            assert await cache.get_cached_url(url) == url
+            assert cache.get_cache_key(url) not in cache._manifest
+    finally:
+        await cache.close()
+
+    assert upstream.hits["/truncated.jpg"] == 1
+    assert _cache_files(cache) == []
+
+@pytest.mark.asyncio
+async def test_image_jobs_in_flight_are_bounded(cache, monkeypatch):
+    monkeypatch.setattr(settings, "IMAGE_WORKER_POOL", "thread")
+    monkeypatch.setattr(settings, "IMAGE_WORKERS", 8)
+    monkeypatch.setattr(settings, "IMAGE_WORKER_MAX_PENDING", 3)
+    job = _InFlight()
+    try:
+        await asyncio.gather(*(cache.run_image_job(job, 0.05) for _ in range(12)))
+    finally:
+        await cache.close()
+    # The pool has room for 8, but only 3 jobs are let through at a time
+    assert job.peak == 3
+
+@pytest.mark.asyncio
+async def test_corrupt_images_are_rejected_in_the_pool(cache, monkeypatch):
+    monkeypatch.setattr(settings, "IMAGE_WORKER_POOL", "process")
+    monkeypatch.setattr(settings, "IMAGE_WORKERS", 1)
+    buffer = BytesIO()
+    Image.effect_noise((2000, 2000), 64).convert("RGB").save(buffer, "JPEG")
+    corrupt = buffer.getvalue()[:len(buffer.getvalue()) // 2]
+    original = cache.cache_dir / f"{KEY}.jpg"
+
+    ticks = 0
+    async def ticker():
+        nonlocal ticks
+        while True:
+            await asyncio.sleep(0.001)
+            ticks += 1
+
+    ticking = asyncio.create_task(ticker())
+    try:
+        with pytest.raises(OSError, match="truncated"):
+            await cache.run_image_job(build_cover_variants, str(original), ("webp",), corrupt)
+    finally:
+        ticking.cancel()
+        await cache.close()
+    # The event loop kept running while the worker process decoded the image
+    assert ticks >= 5
+    assert _cache_files(cache) == []
@@ -0,0 +1,94 @@
+import json
+import pytest
+from app.core.config import settings
+from app.core.utils import clean_json_string, validate_book_metadata
+from app.api.llm import generate_book_digest_prompt
+from app.services import llm_service
+from app.services.local_llm_service import LocalLLMProvider
+
+@pytest.fixture
+def fast_local_llm(monkeypatch):
+    monkeypatch.setattr(settings, "LOCAL_LLM_LATENCY_MS", 0.0)
+    monkeypatch.setattr(settings, "LOCAL_LLM_TOKENS_PER_SECOND", 0.0)
+    monkeypatch.setattr(settings, "LOCAL_LLM_ERROR_RATE", 0.0)
+    monkeypatch.setattr(settings, "LOCAL_LLM_MALFORMED_RATE", 0.0)
+
+@pytest.mark.asyncio
+async def test_local_digest_is_deterministic_and_valid(fast_local_llm):
+    prompt = generate_book_digest_prompt("Dune", "Frank Herbert")
+    provider = LocalLLMProvider(seed=1)
+
+    first = await provider.complete(prompt)
+    second = await provider.complete(prompt)
+    assert first == second
+
+    digest = json.loads(clean_json_string(first))
+    assert validate_book_metadata(digest, "Dune", "Frank Herbert") == (True, "")
+    assert len(digest["summary"]) > 1000
+    assert len(digest["questions_and_answers"]) == 5
+
+@pytest.mark.asyncio
+async def test_local_stream_matches_completion(fast_local_llm):
+    prompt = generate_book_digest_prompt("Emma", "Jane Austen")
+    provider = LocalLLMProvider(seed=1)
+    chunks = [chunk async for chunk in provider.stream(prompt)]
+    assert len(chunks) > 1
+    assert "".join(chunks) == provider.generate_digest(prompt)
+
+@pytest.mark.asyncio
+async def test_local_error_and_malformed_rates(fast_local_llm, monkeypatch):
+    prompt = generate_book_digest_prompt("Emma", "Jane Austen")
+    provider = LocalLLMProvider(seed=1)
+
+    monkeypatch.setattr(settings, "LOCAL_LLM_ERROR_RATE", 1.0)
+    with pytest.raises(Exception):
+        await provider.complete(prompt)
+
+    monkeypatch.setattr(settings, "LOCAL_LLM_ERROR_RATE", 0.0)
+    monkeypatch.setattr(settings, "LOCAL_LLM_MALFORMED_RATE", 1.0)
+    assert await provider.complete(prompt) != provider.generate_digest(prompt)
+
+def test_llm_provider_setting_overrides_request(monkeypatch):
+    monkeypatch.setattr(settings, "LLM_PROVIDER", "local")
+    assert llm_service.get_provider("gemini").name == "local"
+
+    monkeypatch.setattr(settings, "LLM_PROVIDER", None)
+    assert llm_service.get_provider("chatgpt").name == "chatgpt"
+    with pytest.raises(ValueError):
+        llm_service.get_provider("unknown")
+
+def test_callers_select_the_local_provider_only_in_debug(monkeypatch):
+    monkeypatch.setattr(settings, "LLM_PROVIDER", None)
+    monkeypatch.setattr(settings, "DEBUG", False)
+    with pytest.raises(ValueError, match="not enabled"):
+        llm_service.get_provider("local")
+
+    monkeypatch.setattr(settings, "DEBUG", True)
+    assert llm_service.get_provider("local").name == "local"
+
+@pytest.mark.asyncio
+async def test_query_rejects_the_local_provider_unless_enabled(fast_local_llm, monkeypatch):
+    from fastapi import FastAPI
+    from httpx import AsyncClient
+    from app.api import llm
+
+    monkeypatch.setattr(settings, "LLM_PROVIDER", None)
+    monkeypatch.setattr(settings, "DEBUG", False)
+    app = FastAPI()
+    app.include_router(llm.router)
+    book = {"title": "Dune", "author": "Frank Herbert"}
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        response = await client.post("/query", params={"provider": "local"}, json=book)
+        assert response.status_code == 400
+
+        monkeypatch.setattr(settings, "LLM_PROVIDER", "local")
+        response = await client.post("/query", params={"provider": "local"}, json=book)
+        assert response.status_code == 200
+        assert response.json()["title"] == "Dune"
+
+def test_providers_must_implement_complete():
+    class Incomplete(llm_service.LLMProvider):
+        name = "incomplete"
+
+    with pytest.raises(TypeError):
+        Incomplete()
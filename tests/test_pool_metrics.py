@@ -0,0 +1,52 @@
+import pytest
+from sqlalchemy import exc
+from sqlalchemy.util import greenlet_spawn
+from app.db.pool_metrics import InstrumentedPool, PoolMetrics, pool_sizing
+
+class FakeDBAPIConnection:
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+def test_pool_sizing_shares_the_connection_budget_between_workers():
+    assert pool_sizing(30, 1) == (20, 10)
+    assert pool_sizing(90, 4) == (14, 8)
+    assert pool_sizing(2, 4) == (1, 0)
+
+@pytest.mark.asyncio
+async def test_pool_metrics_record_checkouts_and_timeouts():
+    pool = InstrumentedPool(FakeDBAPIConnection, pool_size=1, max_overflow=1, timeout=0.05)
+    pool.metrics = metrics = PoolMetrics("primary", pool)
+
+    def exhaust_pool():
+        held = [pool.connect(), pool.connect()]
+        with pytest.raises(exc.TimeoutError):
+            pool.connect()
+        return held
+
+    held = await greenlet_spawn(exhaust_pool)
+    stats = metrics.get_stats()
+    assert stats["in_use"] == 2
+    assert stats["overflow"] == 1
+    assert stats["max_in_use"] == 2
+    assert stats["checkouts"] == 2
+    assert stats["timeouts"] == 1
+    assert stats["wait_max_ms"] >= 50
+    assert stats["connections_open"] == 2
+    assert stats["connection_age_max_seconds"] >= 0
+
+    await greenlet_spawn(lambda: [connection.close() for connection in held])
+    await greenlet_spawn(pool.dispose)
+    stats = metrics.get_stats()
+    assert stats["in_use"] == 0
+    assert stats["connections_open"] == 0
+    assert stats["connections_closed"] == 2
+
+def test_metrics_carry_over_when_the_pool_is_recreated():
+    pool = InstrumentedPool(FakeDBAPIConnection, pool_size=1)
+    pool.metrics = PoolMetrics("primary", pool)
+    recreated = pool.recreate()
+    assert recreated.metrics is pool.metrics
+    assert recreated.metrics.pool is recreated
@@ -0,0 +1,106 @@
+import pytest
+from datetime import date, datetime, timedelta, timezone
+from types import SimpleNamespace
+from sqlalchemy.dialects import postgresql
+from app.core.exceptions import InvalidCursorError
+from app.db.models import Book
+from app.services import popularity_service
+
+class FakeResult:
+    def __init__(self, rows):
+        self._rows = rows
+
+    def all(self):
+        return self._rows
+
+    def scalars(self):
+        return FakeResult([row[0] for row in self._rows])
+
+class FakeSession:
+    """Records executed statements and answers each with the next canned result."""
+    def __init__(self, results):
+        self.statements = []
+        self.results = list(results)
+
+    async def execute(self, statement, params=None):
+        self.statements.append(statement.compile(dialect=postgresql.dialect()))
+        self.params = params
+        return FakeResult(self.results.pop(0) if self.results else [])
+
+def test_window_deltas_only_count_visits_inside_each_window():
+    today = date(2026, 3, 10)
+    rows = [
+        {"book_id": 1, "visit_date": date(2026, 3, 10), "visit_count": 2},
+        {"book_id": 1, "visit_date": date(2026, 3, 8), "visit_count": 5},
+        {"book_id": 2, "visit_date": date(2026, 3, 9), "visit_count": 1},
+        {"book_id": 3, "visit_date": date(2025, 1, 1), "visit_count": 4},
+    ]
+    deltas = popularity_service.window_deltas(rows, {1: today, 7: today, 365: today})
+    assert deltas == {
+        1: {1: 2, 2: 1},
+        7: {1: 7, 2: 1},
+        365: {1: 7, 2: 1},
+    }
+
+@pytest.mark.asyncio
+async def test_add_upserts_increments_and_counts_new_books():
+    window = SimpleNamespace(window_days=7, as_of=date(2026, 3, 10), book_count=4)
+    db = FakeSession([[(True,), (False,)]])
+    await popularity_service._add(db, window, {5: 3, 2: 1})
+
+    sql = str(db.statements[0])
+    assert "ON CONFLICT (window_days, book_id) DO UPDATE" in sql
+    assert "visit_count = (popularity_rollups.visit_count + excluded.visit_count)" in sql
+    # Rows are written in book order so concurrent flushes lock them consistently
+    assert [db.statements[0].params[f"book_id_m{i}"] for i in range(2)] == [2, 5]
+    assert window.book_count == 5
+
+@pytest.mark.asyncio
+async def test_roll_over_subtracts_days_that_left_the_window():
+    window = SimpleNamespace(window_days=7, as_of=date(2026, 3, 8), book_count=10)
+    db = FakeSession([[], [(1,), (2,)]])
+    await popularity_service._roll_over(db, window, date(2026, 3, 10))
+
+    update, delete = db.statements
+    # Two days passed, so visits dated March 1st and 2nd expire from the 7 day window
+    assert sorted(value for value in update.params.values() if isinstance(value, date)) == [
+        date(2026, 3, 1), date(2026, 3, 3)
+    ]
+    assert "UPDATE popularity_rollups SET visit_count=(popularity_rollups.visit_count - anon_1.total)" in str(update)
+    assert "DELETE FROM popularity_rollups" in str(delete)
+    assert window.book_count == 8
+    assert window.as_of == date(2026, 3, 10)
+
+def test_trending_keys_order_books_by_current_score():
+    now = datetime(2026, 3, 10, tzinfo=timezone.utc)
+    half_life = timedelta(days=popularity_service.settings.TRENDING_HALF_LIFE_DAYS)
+    # 100 visits one half-life ago are worth 50 now, less than 60 fresh visits
+    old = Book(trending_score=100.0, trending_updated_at=now - half_life)
+    old.trending_key = popularity_service.trending_key(100.0, now - half_life)
+    new = Book(trending_score=60.0, trending_updated_at=now)
+    new.trending_key = popularity_service.trending_key(60.0, now)
+
+    assert popularity_service.current_trending_score(old, now) == pytest.approx(50.0)
+    assert new.trending_key > old.trending_key
+    # Decaying both to any later instant keeps the order the keys give
+    later = now + 3 * half_life
+    assert popularity_service.current_trending_score(new, later) > popularity_service.current_trending_score(old, later)
+
+@pytest.mark.asyncio
+async def test_apply_trending_decays_and_adds_in_one_statement():
+    now = datetime(2026, 3, 10, tzinfo=timezone.utc)
+    db = FakeSession([])
+    await popularity_service.apply_trending(db, {9: 2, 4: 5}, now)
+
+    sql = str(db.statements[0])
+    assert sql.startswith("UPDATE books SET trending_score=(coalesce(books.trending_score * exp(greatest(")
+    assert "updated_at=books.updated_at" in sql
+    assert [(row["book_id"], row["visits"]) for row in db.params] == [(4, 5.0), (9, 2.0)]
+    assert db.params[0]["key_offset"] == pytest.approx(popularity_service.trending_key(1.0, now))
+
+def test_cursor_round_trip_and_rejects_garbage():
+    book = Book(id=42)
+    book.trending_key = 1234.5678901234567
+    assert popularity_service.decode_cursor(popularity_service.encode_cursor(book)) == (book.trending_key, 42)
+    with pytest.raises(InvalidCursorError):
+        popularity_service.decode_cursor("not a cursor")
@@ -0,0 +1,41 @@
+import pytest
+from tests.query_budget import ROUTE_BUDGETS, Budget, QueryLog, Statement, query_budget
+
+@pytest.mark.asyncio
+@query_budget("GET /api/search/typeahead")
+async def test_typeahead_budget(pg_client, pg_books):
+    response = await pg_client.get("/api/search/typeahead", params={"q": "dune"})
+    assert [suggestion["title"] for suggestion in response.json()] == ["Dune", "Dune Messiah"]
+
+@pytest.mark.asyncio
+@query_budget("GET /api/books/{book_id}")
+async def test_book_detail_budget(pg_client, pg_books):
+    response = await pg_client.get(f"/api/books/{pg_books[0].id}")
+    assert response.json()["author"] == "Frank Herbert"
+
+@pytest.mark.asyncio
+@query_budget("POST /api/analytics/visit/{book_id}")
+async def test_record_visit_budget(pg_client, pg_books):
+    response = await pg_client.post(f"/api/analytics/visit/{pg_books[0].id}")
+    assert response.status_code == 200
+
+@pytest.mark.asyncio
+async def test_update_book_budget(pg_client, pg_books, count_queries):
+    with count_queries() as log:
+        response = await pg_client.patch(
+            f"/api/admin/books/{pg_books[0].id}",
+            json={"title": "Dune (Deluxe Edition)", "author": "Frank Patrick Herbert"}
+        )
+    assert response.json()["book"]["author"] == "Frank Patrick Herbert"
+    log.assert_within(ROUTE_BUDGETS["PATCH /api/admin/books/{book_id}"], "PATCH /api/admin/books/{book_id}")
+
+def test_budget_report_lists_the_statements():
+    log = QueryLog([Statement("SELECT books.id\n  FROM books", 0.002), Statement("SELECT authors.id FROM authors", 0.001)])
+    log.assert_within(Budget(2))
+    with pytest.raises(AssertionError) as excinfo:
+        log.assert_within(Budget(1), "GET /api/books/{book_id}")
+    assert str(excinfo.value) == (
+        "GET /api/books/{book_id} ran 2 statements, over its budget of 1:\n"
+        "  1. (2.00 ms) SELECT books.id FROM books\n"
+        "  2. (1.00 ms) SELECT authors.id FROM authors"
+    )
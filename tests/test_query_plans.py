@@ -0,0 +1,141 @@
+"""
+Plan snapshots of the hot queries on a seeded dataset.
+
+Each hot query runs through the service code that issues it, against the
+Postgres in TEST_DATABASE_URL (skipped without it), and every statement
+it sends is explained. The test fails when a query no longer uses the
+indexes it needs, or when its plan's shape (node types, tables and
+indexes, without costs) differs from the snapshot in tests/plan_snapshots,
+or has no snapshot. After reviewing a plan change, record the snapshots
+again with UPDATE_PLAN_SNAPSHOTS=1.
+"""
+from pathlib import Path
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ClauseElement, Executable
+import difflib
+import json
+import os
+import pytest
+
+from app.db import models
+from app.services import analytics_service, book_service, search_service
+from tests.query_budget import capture_queries
+
+SNAPSHOTS = Path(__file__).parent / "plan_snapshots"
+
+# Table sizes large enough for the planner to prefer the indexes it would
+# in production: 5,000 authors, 20,000 books and 300,000 visits over 90 days
+SEED = [
+    "INSERT INTO authors (name, open_library_key) "
+    "SELECT 'Author ' || i, 'OL' || i || 'A' FROM generate_series(1, 5000) AS i",
+    "INSERT INTO books (title, author_id, open_library_key) "
+    "SELECT 'Book ' || i, 1 + mod(i, 5000), 'OL' || i || 'W' FROM generate_series(1, 20000) AS i",
+    "INSERT INTO visits (book_id, visit_date, visit_count) "
+    "SELECT b, current_date - d, 1 + mod(b * d, 50) "
+    "FROM generate_series(1, 20000) AS b, generate_series(0, 89) AS d WHERE mod(b + d, 6) = 0",
+]
+
+# Name, the service call issuing the query, and indexes its plans must use
+HOT_QUERIES = [
+    ("typeahead", lambda db: search_service.get_typeahead_suggestions(db, "book 12"), set()),
+    ("book_detail", lambda db: book_service.get_book(db, 4242), {"books_pkey", "authors_pkey"}),
+    ("record_visit_book_exists", lambda db: analytics_service.VisitBuffer().book_exists(db, 4242), {"books_pkey"}),
+    (
+        "author_by_open_library_key",
+        lambda db: db.execute(select(models.Author).where(models.Author.open_library_key == "OL4242A")),
+        {"authors_open_library_key_key"}
+    ),
+    (
+        # A look-back without a rollup window aggregates the visits table
+        "popular_books_aggregate",
+        lambda db: analytics_service.get_popular_books(db, days=3, get_total=True),
+        {"ix_visits_visit_date_book_id", "uq_visits_book_id_visit_date"}
+    ),
+]
+
+class Explain(Executable, ClauseElement):
+    """EXPLAIN of a statement, executed with its bound parameters as the app sends them."""
+
+    inherit_cache = False
+
+    def __init__(self, statement):
+        self.statement = statement
+
+@compiles(Explain, "postgresql")
+def _compile_explain(element, compiler, **kw):
+    return "EXPLAIN (FORMAT JSON) " + compiler.process(element.statement, **kw)
+
+def plan_shape(node: dict, depth: int = 0) -> list:
+    """A plan's nodes, one per line and indented by depth: type, index and table."""
+    line = "  " * depth + node["Node Type"]
+    if "Index Name" in node:
+        line += f" using {node['Index Name']}"
+    if "Relation Name" in node:
+        line += f" on {node['Relation Name']}"
+    lines = [line]
+    for child in node.get("Plans", []):
+        lines.extend(plan_shape(child, depth + 1))
+    return lines
+
+def used_indexes(node: dict) -> set:
+    indexes = {node["Index Name"]} if "Index Name" in node else set()
+    for child in node.get("Plans", []):
+        indexes |= used_indexes(child)
+    return indexes
+
+@pytest.mark.asyncio
+async def test_hot_query_plans(pg_engine):
+    async with pg_engine.begin() as conn:
+        # The models' duplicates of the primary keys, which the migrations
+        # never created: plans use the production schema's pkey indexes
+        await conn.exec_driver_sql("DROP INDEX ix_books_id, ix_authors_id, ix_visits_id")
+        for statement in SEED:
+            await conn.exec_driver_sql(statement)
+    async with pg_engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        # Index only scans need the visibility map
+        await conn.exec_driver_sql("VACUUM ANALYZE")
+
+    update = os.getenv("UPDATE_PLAN_SNAPSHOTS") == "1"
+    regressions = []
+    for name, run_query, required_indexes in HOT_QUERIES:
+        with capture_queries(pg_engine) as log:
+            async with AsyncSession(pg_engine, expire_on_commit=False) as db:
+                await run_query(db)
+
+        shape, indexes = [], set()
+        async with pg_engine.connect() as conn:
+            # Plans independent of the server's parallelism and JIT settings
+            await conn.exec_driver_sql("SET max_parallel_workers_per_gather = 0")
+            await conn.exec_driver_sql("SET jit = off")
+            for i, statement in enumerate(log.statements, 1):
+                if statement.clause is None:
+                    result = await conn.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {statement.text}", statement.parameters)
+                else:
+                    result = await conn.execute(Explain(statement.clause))
+                plan = result.scalar()
+                plan = (json.loads(plan) if isinstance(plan, str) else plan)[0]["Plan"]
+                shape.append(f"-- statement {i}")
+                shape.extend(plan_shape(plan))
+                indexes |= used_indexes(plan)
+
+        missing = required_indexes - indexes
+        if missing:
+            regressions.append(f"{name} no longer uses {', '.join(sorted(missing))}:\n" + "\n".join(shape))
+
+        snapshot = SNAPSHOTS / f"{name}.txt"
+        if update:
+            SNAPSHOTS.mkdir(exist_ok=True)
+            snapshot.write_text("\n".join(shape) + "\n")
+            continue
+        if not snapshot.exists():
+            regressions.append(f"{name} has no snapshot, record it with UPDATE_PLAN_SNAPSHOTS=1:\n" + "\n".join(shape))
+            continue
+        expected = snapshot.read_text().splitlines()
+        if shape != expected:
+            diff = "\n".join(difflib.unified_diff(expected, shape, "snapshot", "plan", lineterm=""))
+            regressions.append(f"{name} plan changed:\n{diff}")
+
+    assert not regressions, "\n\n".join(regressions)
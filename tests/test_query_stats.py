@@ -0,0 +1,111 @@
+import asyncio
+import pytest
+from datetime import date
+from types import SimpleNamespace
+from unittest.mock import patch
+from fastapi import FastAPI
+from httpx import AsyncClient
+from app.db import query_stats as query_stats_module
+from app.db.query_stats import QueryStats, QueryCountMiddleware, normalize_statement, redact_parameters
+
+class FakeConnection:
+    def __init__(self):
+        self.info = {}
+
+    def get_execution_options(self):
+        return {}
+
+def run_statement(stats, conn, statement, parameters=(), seconds=0.001, executemany=False):
+    """Feed a statement through the engine event hooks as if it took the given seconds."""
+    with patch.object(query_stats_module.time, "perf_counter", side_effect=[0.0, seconds]):
+        stats._before_cursor_execute(conn, None, statement, parameters, None, executemany)
+        stats._after_cursor_execute(conn, None, statement, parameters, None, executemany)
+
+def test_statements_are_normalized():
+    assert normalize_statement(
+        "SELECT books.id FROM books\n  WHERE books.id IN (%s, %s, %s) AND books.title = 'Dune' LIMIT 10"
+    ) == "SELECT books.id FROM books WHERE books.id IN (...) AND books.title = ? LIMIT ?"
+    assert normalize_statement(
+        "INSERT INTO book_visits (book_id, count) VALUES ($1, $2), ($3, $4), ($5, $6)"
+    ) == "INSERT INTO book_visits (book_id, count) VALUES (...), ..."
+    assert normalize_statement("SELECT md5(title) FROM books WHERE id = $1") == \
+        "SELECT md5(title) FROM books WHERE id = $1"
+
+def test_parameters_are_redacted():
+    assert redact_parameters((42, "someone@example.com", None, date(2024, 1, 1)), False) == \
+        [42, "<str len=19>", None, date(2024, 1, 1)]
+    assert redact_parameters([(1, b"\x00\x01"), (2, b"\x02")], True) == \
+        {"parameter_sets": 2, "first": [1, "<bytes len=2>"]}
+
+def test_statements_are_aggregated_and_slow_ones_logged(caplog):
+    stats = QueryStats()
+    conn = FakeConnection()
+    run_statement(stats, conn, "SELECT * FROM books WHERE id = %s", (1,), seconds=0.002)
+    run_statement(stats, conn, "SELECT * FROM books  WHERE id = %s", (2,), seconds=0.5)
+    run_statement(stats, conn, "SELECT * FROM authors WHERE name = %s", ("Frank Herbert",), seconds=0.3)
+
+    statements = stats.get_statements()
+    assert [statement["statement"] for statement in statements] == [
+        "SELECT * FROM books WHERE id = %s", "SELECT * FROM authors WHERE name = %s"
+    ]
+    assert statements[0]["calls"] == 2
+    assert statements[0]["slow"] == 1
+    assert statements[0]["total_ms"] == pytest.approx(502)
+    assert statements[0]["max_ms"] == pytest.approx(500)
+    assert "Frank Herbert" not in caplog.text
+    assert "parameters=['<str len=13>']" in caplog.text
+
+@pytest.mark.asyncio
+async def test_requests_report_their_statements():
+    stats = QueryStats()
+    app = FastAPI()
+    app.add_middleware(QueryCountMiddleware)
+
+    @app.get("/books/{book_id}")
+    async def get_book(book_id: int):
+        conn = FakeConnection()
+        for _ in range(3):
+            run_statement(stats, conn, "SELECT * FROM books WHERE id = %s", (book_id,))
+        return {"id": book_id}
+
+    with patch.object(query_stats_module, "query_stats", stats):
+        async with AsyncClient(app=app, base_url="http://test") as client:
+            response = await client.get("/books/1")
+            await client.get("/books/2")
+
+    assert response.headers["server-timing"] == 'db;dur=3.0;desc="3 queries"'
+    assert stats.get_routes() == [{
+        "route": "GET /books/{book_id}",
+        "requests": 2,
+        "queries": 6,
+        "mean_queries": 3.0,
+        "max_queries": 3,
+        "db_ms": pytest.approx(6.0)
+    }]
+
+@pytest.mark.asyncio
+async def test_lock_and_side_effect_statements_are_not_explained(monkeypatch):
+    monkeypatch.setattr(query_stats_module.settings, "DATABASE_SLOW_QUERY_EXPLAIN_RATE", 1.0)
+    stats = QueryStats()
+    conn = FakeConnection()
+    conn.engine = None
+    explained = []
+
+    async def explain(engine, statement, parameters, elapsed):
+        explained.append(statement)
+        stats._explaining = False
+
+    monkeypatch.setattr(stats, "_explain", explain)
+    for statement in [
+        "SELECT pg_advisory_xact_lock(%s, %s)",
+        "SELECT pg_advisory_xact_lock(hashtext('visits'))",
+        "select pg_try_advisory_lock(1)",
+        "SELECT nextval('books_id_seq')",
+        "SELECT * FROM books WHERE id = %s FOR UPDATE",
+        "SELECT * FROM books WHERE id = %s FOR NO KEY UPDATE SKIP LOCKED",
+        "SELECT * FROM books WHERE title = %s",
+    ]:
+        run_statement(stats, conn, statement, seconds=0.5)
+        await asyncio.gather(*stats._explain_tasks)
+
+    assert explained == ["SELECT * FROM books WHERE title = %s"]
@@ -0,0 +1,28 @@
+import pytest
+from unittest.mock import patch, AsyncMock
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.db import models
+from app.db.database import ReadSessionLocal, ReadOnlySessionError
+
+def test_read_sessions_run_in_autocommit():
+    session = ReadSessionLocal()
+    assert session.bind.sync_engine.get_execution_options()["isolation_level"] == "AUTOCOMMIT"
+
+@pytest.mark.asyncio
+async def test_read_session_refuses_to_flush_changes():
+    async with ReadSessionLocal() as db:
+        db.add(models.Author(name="Frank Herbert", open_library_key="OL79034A"))
+        with pytest.raises(ReadOnlySessionError):
+            await db.flush()
+
+@pytest.mark.asyncio
+async def test_read_session_releases_its_connection_after_each_statement():
+    async with ReadSessionLocal() as db:
+        with patch.object(AsyncSession, "execute", new_callable=AsyncMock) as execute, \
+             patch.object(AsyncSession, "close", new_callable=AsyncMock) as close:
+            await db.execute("SELECT 1")
+            assert close.await_count == 1
+            execute.side_effect = RuntimeError("connection lost")
+            with pytest.raises(RuntimeError):
+                await db.execute("SELECT 1")
+            assert close.await_count == 2
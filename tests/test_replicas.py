@@ -0,0 +1,156 @@
+import pytest
+from types import SimpleNamespace
+from unittest.mock import patch, AsyncMock
+from fastapi import Response
+from sqlalchemy import exc
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from app.db import database
+from app.db.replicas import Replica, ReplicaRouter, is_retryable_on_primary
+
+class FakeConnection:
+    def __init__(self, engine):
+        self.engine = engine
+
+    async def __aenter__(self):
+        if self.engine.error:
+            raise self.engine.error
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+    async def scalar(self, statement):
+        return self.engine.lag
+
+class FakeEngine:
+    """Stand-in for a replica's engine: a lag to report, or an error to connect with."""
+    def __init__(self, lag=0.0, error=None):
+        self.lag = lag
+        self.error = error
+
+    def connect(self):
+        return FakeConnection(self)
+
+def make_router(*engines, max_lag=5.0):
+    return ReplicaRouter([Replica(f"replica{i}", engine) for i, engine in enumerate(engines)], max_lag=max_lag)
+
+def test_pick_round_robins_over_healthy_replicas():
+    router = make_router(FakeEngine(), FakeEngine(), FakeEngine())
+    router.replicas[1].healthy = False
+
+    assert [router.pick().name for _ in range(4)] == ["replica0", "replica2", "replica0", "replica2"]
+
+def test_pick_returns_none_without_healthy_replicas():
+    assert make_router().pick() is None
+    router = make_router(FakeEngine())
+    router.replicas[0].healthy = False
+    assert router.pick() is None
+
+@pytest.mark.asyncio
+async def test_health_checks_take_failing_and_lagging_replicas_out_of_rotation():
+    down = FakeEngine(error=OSError("Connection refused"))
+    lagging = FakeEngine(lag=30.0)
+    router = make_router(FakeEngine(lag=0.5), down, lagging)
+
+    await router.check_all()
+
+    assert [replica.healthy for replica in router.replicas] == [True, False, False]
+    assert router.replicas[0].lag == 0.5
+    assert router.replicas[1].error == "Connection refused"
+    assert router.replicas[2].error == "30.0s behind the primary"
+
+    down.error = None
+    lagging.lag = 1.0
+    await router.check_all()
+    assert all(replica.healthy for replica in router.replicas)
+
+def _router_with_engines(count):
+    return ReplicaRouter([
+        Replica(f"replica{i}", create_async_engine(f"postgresql+asyncpg://postgres@replica{i}/bookai"))
+        for i in range(count)
+    ], max_lag=5.0)
+
+@pytest.mark.asyncio
+async def test_read_sessions_are_spread_over_replicas():
+    router = _router_with_engines(2)
+    with patch.object(database, "replica_router", router):
+        binds = [database.ReadSessionLocal().bind for _ in range(4)]
+        primary = database.ReadSessionLocal(bind=database.read_engine).bind
+
+    assert binds == [router.replicas[0].engine, router.replicas[1].engine] * 2
+    assert primary is database.read_engine
+
+@pytest.mark.asyncio
+async def test_read_is_retried_on_the_primary_when_a_replica_is_lost():
+    router = _router_with_engines(1)
+    lost = exc.DBAPIError("SELECT 1", None, OSError("connection is closed"), connection_invalidated=True)
+    with patch.object(database, "replica_router", router), \
+         patch.object(AsyncSession, "execute", new_callable=AsyncMock) as execute:
+        execute.side_effect = [lost, "rows"]
+        session = database.ReadSessionLocal()
+        assert session.replica is router.replicas[0]
+
+        assert await session.execute("SELECT 1") == "rows"
+
+    assert session.bind is database.read_engine
+    assert session.replica is None
+    assert not router.replicas[0].healthy
+
+@pytest.mark.asyncio
+async def test_programming_errors_are_not_retried():
+    router = _router_with_engines(1)
+    error = exc.ProgrammingError("SELECT nope", None, Exception("syntax error"))
+    with patch.object(database, "replica_router", router), \
+         patch.object(AsyncSession, "execute", new_callable=AsyncMock) as execute:
+        execute.side_effect = error
+        session = database.ReadSessionLocal()
+        with pytest.raises(exc.ProgrammingError):
+            await session.execute("SELECT nope")
+
+    assert execute.await_count == 1
+    assert router.replicas[0].healthy
+
+@pytest.mark.asyncio
+async def test_cancelled_and_conflicting_reads_are_retryable(pg_engine):
+    """Errors as the asyncpg dialect raises them: DBAPIErrors wrapping the driver's."""
+    async with pg_engine.connect() as conn:
+        await conn.exec_driver_sql("SET statement_timeout = 10")
+        with pytest.raises(exc.DBAPIError) as cancelled:
+            await conn.exec_driver_sql("SELECT pg_sleep(1)")
+    assert type(cancelled.value) is exc.DBAPIError
+    assert is_retryable_on_primary(cancelled.value)
+
+    async with pg_engine.begin() as conn:
+        await conn.exec_driver_sql("INSERT INTO authors (id, name, open_library_key) VALUES (1, 'Ursula', 'OL1A')")
+    async with pg_engine.connect() as reader, pg_engine.begin() as writer:
+        reader = await reader.execution_options(isolation_level="REPEATABLE READ")
+        await reader.exec_driver_sql("SELECT name FROM authors WHERE id = 1")
+        await writer.exec_driver_sql("UPDATE authors SET name = 'Ursula K.' WHERE id = 1")
+        await writer.commit()
+        with pytest.raises(exc.DBAPIError) as conflict:
+            await reader.exec_driver_sql("UPDATE authors SET name = 'Ursula K. Le Guin' WHERE id = 1")
+    assert type(conflict.value) is exc.DBAPIError
+    assert is_retryable_on_primary(conflict.value)
+
+    with pytest.raises(exc.DBAPIError) as syntax_error:
+        async with pg_engine.connect() as conn:
+            await conn.exec_driver_sql("SELEC 1")
+    assert not is_retryable_on_primary(syntax_error.value)
+
+@pytest.mark.asyncio
+async def test_clients_that_wrote_read_from_the_primary():
+    router = _router_with_engines(1)
+    with patch.object(database, "replica_router", router):
+        response = Response()
+        writes = database.get_db(response)
+        await writes.__anext__()
+        await writes.aclose()
+        assert database.PRIMARY_COOKIE in response.headers["set-cookie"]
+
+        reads = database.get_read_db(SimpleNamespace(cookies={database.PRIMARY_COOKIE: "1"}))
+        assert (await reads.__anext__()).bind is database.read_engine
+        await reads.aclose()
+
+        reads = database.get_read_db(SimpleNamespace(cookies={}))
+        assert (await reads.__anext__()).bind is router.replicas[0].engine
+        await reads.aclose()
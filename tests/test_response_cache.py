@@ -0,0 +1,119 @@
+import asyncio
+import pytest
+import redis.asyncio as redis
+from app.core.config import settings
+from app.services.response_cache_service import ResponseCache, MemoryCacheStore
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+class FailingStore:
+    async def get(self, key):
+        raise redis.ConnectionError("Connection refused")
+
+    async def set(self, key, value, ttl):
+        raise redis.ConnectionError("Connection refused")
+
+    async def add(self, key, value, ttl):
+        raise redis.ConnectionError("Connection refused")
+
+    async def close(self):
+        pass
+
+def make_cache(clock):
+    return ResponseCache(store=MemoryCacheStore(clock), clock=clock)
+
+def counting_render(body=b"[]", delay=0.0):
+    calls = []
+
+    async def render():
+        calls.append(1)
+        await asyncio.sleep(delay)
+        return body + str(len(calls)).encode()
+
+    return render, calls
+
+@pytest.mark.asyncio
+async def test_miss_renders_once_then_hits():
+    clock = FakeClock()
+    cache = make_cache(clock)
+    render, calls = counting_render()
+
+    assert await cache.get("popular", render) == b"[]1"
+    assert await cache.get("popular", render) == b"[]1"
+    assert len(calls) == 1
+    assert cache.stats["misses"] == 1
+    assert cache.stats["hits"] == 1
+
+@pytest.mark.asyncio
+async def test_concurrent_misses_share_one_render():
+    clock = FakeClock()
+    cache = make_cache(clock)
+    render, calls = counting_render(delay=0.05)
+
+    bodies = await asyncio.gather(*(cache.get("popular", render) for _ in range(20)))
+
+    assert bodies == [b"[]1"] * 20
+    assert len(calls) == 1
+
+@pytest.mark.asyncio
+async def test_stale_entry_is_served_while_refreshed_once():
+    clock = FakeClock()
+    cache = make_cache(clock)
+    render, calls = counting_render(delay=0.01)
+    await cache.get("popular", render)
+
+    clock.now += settings.RESPONSE_CACHE_TTL + 1
+    bodies = await asyncio.gather(*(cache.get("popular", render) for _ in range(10)))
+    assert bodies == [b"[]1"] * 10
+    assert cache.stats["stale_hits"] == 10
+
+    await asyncio.sleep(0.05)
+    assert len(calls) == 2
+    assert await cache.get("popular", render) == b"[]2"
+    assert cache.stats["hits"] == 1
+
+@pytest.mark.asyncio
+async def test_expired_entry_is_rendered_again():
+    clock = FakeClock()
+    cache = make_cache(clock)
+    render, calls = counting_render()
+    await cache.get("popular", render)
+
+    clock.now += settings.RESPONSE_CACHE_TTL + settings.RESPONSE_CACHE_STALE_TTL + 1
+    assert await cache.get("popular", render) == b"[]2"
+    assert cache.stats["misses"] == 2
+
+@pytest.mark.asyncio
+async def test_miss_waits_for_a_render_in_another_process():
+    clock = FakeClock()
+    store = MemoryCacheStore(clock)
+    cache = ResponseCache(store=store, clock=clock)
+    other_process = ResponseCache(store=store, clock=clock)
+    other_render, other_calls = counting_render(b"[other]", delay=0.1)
+    render, calls = counting_render()
+
+    other = asyncio.ensure_future(other_process.get("popular", other_render))
+    await asyncio.sleep(0.01)
+    body = await cache.get("popular", render)
+
+    assert body == b"[other]1"
+    assert await other == b"[other]1"
+    assert calls == []
+    assert len(other_calls) == 1
+
+@pytest.mark.asyncio
+async def test_failing_store_falls_back_to_in_process_cache():
+    clock = FakeClock()
+    cache = ResponseCache(store=FailingStore(), fallback=MemoryCacheStore(clock), clock=clock)
+    render, calls = counting_render()
+
+    assert await cache.get("popular", render) == b"[]1"
+    assert await cache.get("popular", render) == b"[]1"
+    assert len(calls) == 1
+    # Only the first call tried the failing store
+    assert cache.stats["store_errors"] == 1
@@ -0,0 +1,20 @@
+import pytest
+from app.db.database import UniqueStatementNameConnection, statement_connect_args
+
+def test_direct_connections_cache_prepared_statements():
+    for mode in ("direct", "pgbouncer_prepared"):
+        assert statement_connect_args(mode, 256) == {"statement_cache_size": 256, "prepared_statement_cache_size": 256}
+
+def test_pgbouncer_mode_prepares_uniquely_named_statements_without_caching():
+    connect_args = statement_connect_args("pgbouncer", 256)
+    assert connect_args["statement_cache_size"] == 0
+    assert connect_args["prepared_statement_cache_size"] == 0
+    assert connect_args["connection_class"] is UniqueStatementNameConnection
+
+    names = {UniqueStatementNameConnection._get_unique_id(None, "stmt") for _ in range(100)}
+    assert len(names) == 100
+    assert all(name.startswith("__asyncpg_stmt_") for name in names)
+
+def test_unknown_statement_mode_is_rejected():
+    with pytest.raises(ValueError):
+        statement_connect_args("session", 256)
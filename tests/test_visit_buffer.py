@@ -0,0 +1,139 @@
+import pytest
+from datetime import date
+from unittest.mock import patch, AsyncMock
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy.dialects import postgresql
+from app.services import analytics_service
+from app.core.hyperloglog import HyperLogLog, hash_visitor
+from app.core.visitor import VISITOR_COOKIE, visitor_hash
+from app.services.analytics_service import VisitBuffer
+
+class FakeResult:
+    def __init__(self, rows):
+        self._rows = rows
+
+    def all(self):
+        return self._rows
+
+class FakeSession:
+    """Records executed statements; optionally fails like a lost connection."""
+    def __init__(self, statements, fail=False, stored_sketches=()):
+        self.statements = statements
+        self.fail = fail
+        self.stored_sketches = list(stored_sketches)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+    def begin(self):
+        return self
+
+    async def execute(self, statement):
+        if self.fail:
+            raise ConnectionError("database unavailable")
+        self.statements.append(statement)
+        if "visitor_sketch IS NOT NULL" in str(statement):
+            return FakeResult(self.stored_sketches)
+        return FakeResult([])
+
+@pytest.mark.asyncio
+async def test_flush_upserts_buffered_counts_in_one_statement():
+    buffer = VisitBuffer()
+    today = date(2026, 1, 2)
+    for _ in range(3):
+        buffer.add(1, visit_date=today)
+    buffer.add(2, visit_date=today)
+    assert buffer.pending() == 2
+
+    statements = []
+    with patch.object(analytics_service, "SessionLocal", lambda: FakeSession(statements)), \
+            patch.object(analytics_service.popularity_service, "apply_visits", new_callable=AsyncMock) as apply_visits, \
+            patch.object(analytics_service.popularity_service, "apply_trending", new_callable=AsyncMock) as apply_trending:
+        assert await buffer.flush() == 2
+        assert await buffer.flush() == 0
+
+    # The advisory lock, then a single upsert
+    assert len(statements) == 2
+    assert "pg_advisory_xact_lock" in str(statements[0])
+    # The rollups see the same batch, and are not touched again once current
+    apply_visits.assert_awaited_once()
+    assert [row["visit_count"] for row in apply_visits.await_args.args[1]] == [3, 1]
+    assert apply_trending.await_args.args[1] == {1: 3, 2: 1}
+    compiled = statements[1].compile(dialect=postgresql.dialect())
+    sql = str(compiled)
+    assert "ON CONFLICT (book_id, visit_date) DO UPDATE" in sql
+    assert "visit_count = (visits.visit_count + excluded.visit_count)" in sql
+    assert [compiled.params[f"visit_count_m{i}"] for i in range(2)] == [3, 1]
+    assert buffer.pending() == 0
+
+@pytest.mark.asyncio
+async def test_failed_flush_keeps_counts_for_retry():
+    buffer = VisitBuffer()
+    today = date(2026, 1, 2)
+    buffer.add(1, 2, visit_date=today)
+
+    with patch.object(analytics_service, "SessionLocal", lambda: FakeSession([], fail=True)):
+        with pytest.raises(ConnectionError):
+            await buffer.flush()
+    buffer.add(1, visit_date=today)
+
+    statements = []
+    with patch.object(analytics_service, "SessionLocal", lambda: FakeSession(statements)), \
+            patch.object(analytics_service.popularity_service, "apply_visits", new_callable=AsyncMock), \
+            patch.object(analytics_service.popularity_service, "apply_trending", new_callable=AsyncMock):
+        await buffer.flush()
+    compiled = statements[-1].compile(dialect=postgresql.dialect())
+    assert compiled.params["visit_count_m0"] == 3
+    assert buffer.stats["flush_errors"] == 1
+
+@pytest.mark.asyncio
+async def test_flush_merges_visitor_sketches_with_stored_ones():
+    buffer = VisitBuffer()
+    today = date(2026, 1, 2)
+    # A refresher hitting a book ten times is one visitor
+    for _ in range(10):
+        buffer.add(1, visit_date=today, visitor=hash_visitor("reader-a"))
+    buffer.add(1, visit_date=today, visitor=hash_visitor("reader-b"))
+    stored = HyperLogLog(analytics_service.settings.VISIT_HLL_PRECISION)
+    stored.add("reader-c")
+    stored.add("reader-a")
+
+    statements = []
+    session = lambda: FakeSession(statements, stored_sketches=[(1, today, stored.to_bytes())])
+    with patch.object(analytics_service, "SessionLocal", session), \
+            patch.object(analytics_service.popularity_service, "apply_visits", new_callable=AsyncMock) as apply_visits, \
+            patch.object(analytics_service.popularity_service, "apply_trending", new_callable=AsyncMock):
+        await buffer.flush()
+
+    compiled = statements[-1].compile(dialect=postgresql.dialect())
+    assert compiled.params["visit_count_m0"] == 11
+    assert HyperLogLog.from_bytes(compiled.params["visitor_sketch_m0"]).count() == 3
+    assert "visitor_sketch = coalesce(excluded.visitor_sketch, visits.visitor_sketch)" in str(compiled)
+    # The rollups get the merged day sketch too
+    assert apply_visits.await_args.args[1][0]["visitor_sketch"] == compiled.params["visitor_sketch_m0"]
+
+def test_first_visit_hashes_the_cookie_it_sets():
+    app = FastAPI()
+
+    @app.get("/visitor")
+    def visitor(hashed: int = Depends(visitor_hash)):
+        return {"visitor": hashed}
+
+    browser = {"user-agent": "Mozilla/5.0 (X11; Linux x86_64) Firefox/131.0"}
+    with TestClient(app) as client:
+        first = client.get("/visitor", headers=browser)
+        assert VISITOR_COOKIE in first.cookies
+        # The follow-up request sends the cookie back
+        second = client.get("/visitor", headers=browser)
+    assert second.json() == first.json()
+
+    # Crawlers get no cookie; their address and user agent identify them
+    with TestClient(app) as client:
+        crawler = {"user-agent": "Mozilla/5.0 (compatible; Googlebot/2.1)"}
+        first = client.get("/visitor", headers=crawler)
+        assert VISITOR_COOKIE not in first.cookies
+        assert client.get("/visitor", headers=crawler).json() == first.json()